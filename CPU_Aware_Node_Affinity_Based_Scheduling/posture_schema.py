@@ -0,0 +1,247 @@
+# posture_schema.py — versioned schema for posture_log: timestamptz, monthly partitions, retention.
+#
+# ensure_schema(cur) runs when an analyzer connects to the DB (under an advisory lock, so
+# pods starting together apply each migration once). Applied migrations are recorded in
+# schema_migrations; append new ones to MIGRATIONS and never edit one that has shipped.
+#   1 baseline                 the original unpartitioned posture_log (TIMESTAMP columns)
+#   2 partitioned_timestamptz  posture_log becomes RANGE-partitioned by month on a
+#                              TIMESTAMPTZ received_time (microseconds). Existing rows are
+#                              copied in one transaction, reading their naive times as
+#                              LEGACY_TIMEZONE; rollup buckets are converted the same way.
+# Maintenance (at connect, and every MAINTENANCE_SECONDS from the daemon's DB writer):
+#   - partitions posture_log_yYYYYmMM (UTC month bounds) up to PARTITIONS_AHEAD months
+#     ahead; rows outside every partition land in posture_log_default
+#   - BRIN on received_time (tiny, rows arrive in time order) and btree on
+#     (pi_id, received_time), declared on the parent so new partitions inherit them
+#   - RETENTION_MONTHS > 0 drops whole partitions older than that; the rollups in
+#     posture_rollups.py keep their aggregates
+# Writers pass timezone-aware datetimes; psycopg2 sends them as native timestamptz values.
+# The same file (with posture_rollups.py) ships with the Round-Robin and
+# CPU_Aware_Node_Affinity_Based_Scheduling analyzers.
+#
+#   python posture_schema.py status | migrate | maintain
+import os
+import re
+import sys
+import logging
+from datetime import date, datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+from posture_rollups import ensure_rollups
+
+LOGGER = logging.getLogger("posture_schema")
+
+LEGACY_TIMEZONE = os.environ.get("LEGACY_TIMEZONE", "UTC")
+PARTITIONS_AHEAD = int(os.environ.get("PARTITIONS_AHEAD", "3"))
+RETENTION_MONTHS = int(os.environ.get("RETENTION_MONTHS", "0"))   # 0 = keep everything
+MAINTENANCE_SECONDS = float(os.environ.get("SCHEMA_MAINTENANCE_SECONDS", "86400"))
+
+PARTITION_RE = re.compile(r"^posture_log_y(\d{4})m(\d{2})$")
+
+# ---------------------------
+# Migrations
+# ---------------------------
+def _baseline(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS posture_log (
+            id SERIAL PRIMARY KEY,
+            pi_id TEXT,
+            filename TEXT,
+            received_time TIMESTAMP,
+            analyzed_time TIMESTAMP,
+            neck_angle INT,
+            body_angle INT,
+            posture_status TEXT,
+            landmarks_detected BOOLEAN,
+            processed_by TEXT
+        );
+        """
+    )
+    cur.execute("ALTER TABLE posture_log ADD COLUMN IF NOT EXISTS model_complexity SMALLINT;")
+    cur.execute("ALTER TABLE posture_log ADD COLUMN IF NOT EXISTS frame_id TEXT;")
+
+def _partitioned_timestamptz(cur):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = 'posture_log'::regclass")
+    if cur.fetchone()[0] == "p":
+        return
+    # move the old table and every name it owns out of the way
+    cur.execute("DROP TRIGGER IF EXISTS posture_rollup ON posture_log")
+    cur.execute("DROP INDEX IF EXISTS posture_log_pi_received")
+    cur.execute("ALTER TABLE posture_log RENAME TO posture_log_unpartitioned")
+    cur.execute("ALTER INDEX IF EXISTS posture_log_pkey RENAME TO posture_log_unpartitioned_pkey")
+    cur.execute("ALTER SEQUENCE IF EXISTS posture_log_id_seq RENAME TO posture_log_unpartitioned_id_seq")
+    cur.execute(
+        """
+        CREATE TABLE posture_log (
+            id BIGSERIAL,
+            pi_id TEXT,
+            filename TEXT,
+            received_time TIMESTAMPTZ NOT NULL,
+            analyzed_time TIMESTAMPTZ,
+            neck_angle INT,
+            body_angle INT,
+            posture_status TEXT,
+            landmarks_detected BOOLEAN,
+            processed_by TEXT,
+            model_complexity SMALLINT,
+            frame_id TEXT,
+            PRIMARY KEY (id, received_time)
+        ) PARTITION BY RANGE (received_time);
+        """
+    )
+    cur.execute("CREATE TABLE posture_log_default PARTITION OF posture_log DEFAULT")
+    cur.execute("SELECT (MIN(received_time AT TIME ZONE %s) AT TIME ZONE 'UTC')::date "
+                "FROM posture_log_unpartitioned", (LEGACY_TIMEZONE,))
+    ensure_partitions(cur, first=cur.fetchone()[0])
+    cur.execute(
+        """
+        INSERT INTO posture_log (id, pi_id, filename, received_time, analyzed_time, neck_angle, body_angle,
+                                 posture_status, landmarks_detected, processed_by, model_complexity, frame_id)
+        SELECT id, pi_id, filename,
+               COALESCE(received_time, analyzed_time, 'epoch') AT TIME ZONE %(tz)s,
+               analyzed_time AT TIME ZONE %(tz)s,
+               neck_angle, body_angle, posture_status, landmarks_detected, processed_by, model_complexity, frame_id
+        FROM posture_log_unpartitioned
+        """,
+        {"tz": LEGACY_TIMEZONE},
+    )
+    LOGGER.info("🗄️ Copied %d rows into partitioned posture_log", cur.rowcount)
+    cur.execute("SELECT setval('posture_log_id_seq', GREATEST((SELECT MAX(id) FROM posture_log), 1))")
+    cur.execute("DROP TABLE posture_log_unpartitioned")
+    for res in ("minute", "hour"):
+        cur.execute("SELECT data_type FROM information_schema.columns "
+                    "WHERE table_name = %s AND column_name = 'bucket'", (f"posture_rollup_{res}",))
+        row = cur.fetchone()
+        if row and row[0] == "timestamp without time zone":
+            cur.execute(f"DROP VIEW IF EXISTS posture_{res}")  # recreated by ensure_rollups
+            cur.execute(f"ALTER TABLE posture_rollup_{res} ALTER COLUMN bucket TYPE TIMESTAMPTZ "
+                        f"USING bucket AT TIME ZONE %s", (LEGACY_TIMEZONE,))
+
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "baseline", _baseline),
+    (2, "partitioned_timestamptz", _partitioned_timestamptz),
+]
+
+# ---------------------------
+# Partitions, indexes, retention
+# ---------------------------
+def _month(d: date, delta: int = 0) -> date:
+    m = d.year * 12 + d.month - 1 + delta
+    return date(m // 12, m % 12 + 1, 1)
+
+def ensure_partitions(cur, ahead: int = PARTITIONS_AHEAD, first: Optional[date] = None) -> List[str]:
+    """Monthly partitions from `first` (default: this month) to `ahead` months out; returns new names."""
+    this_month = _month(datetime.now(timezone.utc).date())
+    month = _month(first) if first else this_month
+    created = []
+    while month <= _month(this_month, ahead):
+        name = f"posture_log_y{month.year:04d}m{month.month:02d}"
+        lo, hi = f"{month.isoformat()} 00:00+00", f"{_month(month, 1).isoformat()} 00:00+00"
+        cur.execute("SELECT to_regclass(%s)", (name,))
+        if cur.fetchone()[0] is None:
+            # rows of this month already in the default partition must move before the range exists
+            cur.execute(f"CREATE TABLE {name} (LIKE posture_log INCLUDING DEFAULTS)")
+            cur.execute(f"WITH moved AS (DELETE FROM posture_log_default WHERE received_time >= %s "
+                        f"AND received_time < %s RETURNING *) INSERT INTO {name} SELECT * FROM moved", (lo, hi))
+            cur.execute(f"ALTER TABLE posture_log ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (lo, hi))
+            created.append(name)
+        month = _month(month, 1)
+    return created
+
+def ensure_indexes(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS posture_log_received_brin ON posture_log USING brin (received_time)")
+    cur.execute("CREATE INDEX IF NOT EXISTS posture_log_pi_received ON posture_log (pi_id, received_time)")
+
+def apply_retention(cur, months: int = RETENTION_MONTHS) -> List[str]:
+    """Drop partitions that end before the first of (this month - months); returns dropped names."""
+    if months <= 0:
+        return []
+    cutoff = _month(datetime.now(timezone.utc).date(), -months)
+    cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'posture_log'::regclass")
+    dropped = []
+    for (name,) in cur.fetchall():
+        m = PARTITION_RE.match(name)
+        if m and _month(date(int(m.group(1)), int(m.group(2)), 1), 1) <= cutoff:
+            cur.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+    cur.execute("DELETE FROM posture_log_default WHERE received_time < %s", (f"{cutoff.isoformat()} 00:00+00",))
+    if dropped:
+        LOGGER.info("🧹 Retention (%d months): dropped %s", months, ", ".join(dropped))
+    return dropped
+
+def maintain(cur):
+    """Partitions ahead, indexes, retention. Call inside a transaction."""
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('posture_schema'))")
+    created = ensure_partitions(cur)
+    if created:
+        LOGGER.info("🗄️ Created partitions %s", ", ".join(created))
+    ensure_indexes(cur)
+    apply_retention(cur)
+
+# ---------------------------
+# Entry points
+# ---------------------------
+def applied_versions(cur) -> List[int]:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    )
+    cur.execute("SELECT version FROM schema_migrations ORDER BY version")
+    return [r[0] for r in cur.fetchall()]
+
+def ensure_schema(cur):
+    """Apply pending migrations, then maintain() and the rollups. Caller commits."""
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('posture_schema'))")
+    applied = set(applied_versions(cur))
+    for version, name, migrate in MIGRATIONS:
+        if version not in applied:
+            LOGGER.info("🗄️ Applying schema migration %d (%s)", version, name)
+            migrate(cur)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+    maintain(cur)
+    ensure_rollups(cur)
+
+def _connect():
+    import psycopg2
+    return psycopg2.connect(host=os.environ.get("DB_HOST", "aws-0-eu-north-1.pooler.supabase.com"),
+                            dbname=os.environ.get("DB_NAME", "postgres"),
+                            user=os.environ.get("DB_USER", "postgres.yvqqpgixkwsiychmwvkc"),
+                            password=os.environ.get("DB_PASSWORD", ""),
+                            port=int(os.environ.get("DB_PORT", "5432")),
+                            sslmode=os.environ.get("DB_SSLMODE", "require"))
+
+def main(argv: List[str]) -> int:
+    if not argv or argv[0] not in ("status", "migrate", "maintain"):
+        print("usage: posture_schema.py status | migrate | maintain")
+        return 2
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    conn = _connect()
+    try:
+        with conn.cursor() as cur:
+            if argv[0] == "status":
+                applied = set(applied_versions(cur))
+                for version, name, _ in MIGRATIONS:
+                    print(f"{version:3d} {name:28s} {'applied' if version in applied else 'pending'}")
+                cur.execute("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+                            "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'posture_log'::regclass "
+                            "ORDER BY 1")
+                for name, bound in cur.fetchall():
+                    print(f"    {name:28s} {bound}")
+            elif argv[0] == "migrate":
+                ensure_schema(cur)
+            else:
+                maintain(cur)
+        conn.commit()
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -6,7 +6,7 @@ import math as m
 import numpy as np
 import paho.mqtt.client as mqtt
 import psycopg2
-from datetime import datetime
+from datetime import datetime, timezone
 import mediapipe as mp
 import socket
 from concurrent.futures import ProcessPoolExecutor, as_completed
@@ -161,7 +161,7 @@ def on_message(client, userdata, msg):
 
         h, w = original_image.shape[:2]
         unique_id = random.randint(10000, 99999)
-        received_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        received_time = datetime.now(timezone.utc)
         hostname = socket.gethostname()
 
         futures = [
@@ -172,7 +172,7 @@ def on_message(client, userdata, msg):
         for idx, f in enumerate(as_completed(futures), 1):
             try:
                 result = f.result()
-                analyzed_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                analyzed_time = datetime.now(timezone.utc)
 
                 cursor.execute(
                     "INSERT INTO posture_log (pi_id, filename, received_time, analyzed_time, neck_angle, body_angle, posture_status, landmarks_detected, processed_by) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
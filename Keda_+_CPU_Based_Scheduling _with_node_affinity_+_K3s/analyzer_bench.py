@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# analyzer_bench.py — offline throughput benchmark for the posture analyzer.
+#
+# Same worker pool and analysis code as Images_From_Pi1.py, but frames come from disk
+# (or are synthesized) instead of MQTT, so a run needs no Pi/broker and timings are
+# not mixed with arrival jitter. CPU-only is fine; use it in CI as a regression gate.
+#
+#   python analyzer_bench.py                      # synthetic 1280x720 frame
+#   python analyzer_bench.py frame.jpg            # one file, or a directory of .jpg/.png
+#   BENCH_SCHEDULE=1,10,50 BENCH_TRIALS=5 BENCH_MIN_FPS=4 python analyzer_bench.py frames/
+#
+# Each schedule level runs BENCH_WARMUP untimed rounds, then BENCH_TRIALS timed rounds
+# of N copies submitted at once. Reports throughput (frames/s) with a 95% confidence
+# interval, per-task service / queue-wait / latency percentiles (task_timing) and per-stage means (decode, inference, rules, annotate,
+# write, db). Writes BENCH_CSV (Images_From_Pi1 columns) and BENCH_JSON.
+import os
+import sys
+import json
+import glob
+import math
+import time
+import socket
+import logging
+import platform
+import statistics
+import tempfile
+from datetime import datetime, timezone
+from concurrent.futures import wait
+from typing import Dict, List, Optional
+
+import posture_analysis as pa
+from resource_sampler import ResourceSampler
+from task_timing import percentile, summarize, timed_task
+
+# ---------------------------
+# Config (env overrides)
+# ---------------------------
+BENCH_SCHEDULE = [int(x) for x in os.environ.get("BENCH_SCHEDULE", "10,50,100").split(",") if x.strip()]
+BENCH_WARMUP = int(os.environ.get("BENCH_WARMUP", "1"))
+BENCH_TRIALS = int(os.environ.get("BENCH_TRIALS", "5"))
+BENCH_CSV = os.environ.get("BENCH_CSV", "bench_results.csv")
+BENCH_JSON = os.environ.get("BENCH_JSON", "bench_results.json")
+BENCH_WIDTH = int(os.environ.get("BENCH_WIDTH", "1280"))
+BENCH_HEIGHT = int(os.environ.get("BENCH_HEIGHT", "720"))
+# Fail (exit 1) when the largest level's mean throughput is below this; 0 disables
+BENCH_MIN_FPS = float(os.environ.get("BENCH_MIN_FPS", "0"))
+# Time DB inserts into a TEMP copy of posture_log (emptied on commit) when a DSN is given
+BENCH_DB_DSN = os.environ.get("BENCH_DB_DSN", "")
+OUTPUT_BASE = os.environ.get("OUTPUT_DIR", "")
+
+_default_workers = os.cpu_count() or 4
+NUM_WORKERS = int(os.environ.get("NUM_WORKERS", str(max(1, _default_workers))))
+
+STAGES = ("decode", "inference", "rules", "annotate", "write", "db")
+
+LOGGER = logging.getLogger("analyzer_bench")
+LOGGER.setLevel(logging.INFO)
+_sh = logging.StreamHandler(sys.stdout)
+_sh.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(message)s"))
+LOGGER.addHandler(_sh)
+
+# two-sided 95% Student-t quantiles by degrees of freedom (normal beyond 30)
+_T95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+        10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 25: 2.060, 30: 2.042}
+
+def ci95(values: List[float]) -> Dict[str, float]:
+    """Mean and half-width of the 95% confidence interval."""
+    n = len(values)
+    mean = statistics.fmean(values) if values else 0.0
+    if n < 2:
+        return {"mean": mean, "ci95": None, "n": n}
+    df = n - 1
+    t = _T95.get(df) or (_T95[max(k for k in _T95 if k <= df)] if df <= 30 else 1.96)
+    return {"mean": mean, "ci95": t * statistics.stdev(values) / math.sqrt(n), "n": n}
+
+def task_ci95(trials: List[Dict], dist: str, pct: str) -> Optional[Dict[str, float]]:
+    """ci95 of one task-timing percentile over the trials that processed frames; None if none did."""
+    vals = [t["tasks"][dist][pct] for t in trials if t["tasks"][dist][pct] is not None]
+    return ci95(vals) if vals else None
+
+# ---------------------------
+# Frame source
+# ---------------------------
+def load_frames(path: str) -> List[bytes]:
+    """Encoded frames (as the Pis publish them) from a file/dir, or one synthetic JPEG."""
+    if path:
+        paths = sorted(glob.glob(os.path.join(path, "*.jpg")) + glob.glob(os.path.join(path, "*.png"))) \
+            if os.path.isdir(path) else [path]
+        frames = []
+        for p in paths:
+            with open(p, "rb") as f:
+                frames.append(f.read())
+        if not frames:
+            raise SystemExit(f"no frames found at {path}")
+        return frames
+    # No person in a synthetic frame, so only detection runs: compare runs on the same source
+    pa.load_libs()
+    rng = pa.np.random.default_rng(0)
+    img = rng.integers(0, 255, size=(BENCH_HEIGHT, BENCH_WIDTH, 3), dtype=pa.np.uint8)
+    img = pa.cv2.GaussianBlur(img, (31, 31), 0)
+    ok, buf = pa.cv2.imencode(".jpg", img, [pa.cv2.IMWRITE_JPEG_QUALITY, 80])
+    return [buf.tobytes()]
+
+# ---------------------------
+# DB stage
+# ---------------------------
+class DbStage:
+    def __init__(self, dsn: str):
+        self.conn = None
+        if not dsn:
+            return
+        import psycopg2
+        self.conn = psycopg2.connect(dsn)
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TEMP TABLE bench_posture_log (
+                    pi_id TEXT, filename TEXT, received_time TIMESTAMPTZ, analyzed_time TIMESTAMPTZ,
+                    neck_angle INT, body_angle INT, posture_status TEXT, landmarks_detected BOOLEAN,
+                    processed_by TEXT, model_complexity SMALLINT
+                ) ON COMMIT DELETE ROWS;
+                """
+            )
+
+    def insert(self, rows) -> float:
+        if self.conn is None or not rows:
+            return 0.0
+        t0 = time.perf_counter()
+        with self.conn.cursor() as cur:
+            cur.executemany("INSERT INTO bench_posture_log VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", rows)
+        self.conn.commit()
+        return time.perf_counter() - t0
+
+# ---------------------------
+# Runner
+# ---------------------------
+def _annotate_timed(frame, landmarks, result, fpath) -> Dict[str, float]:
+    """Runs in the annotation pool; returns its annotate/write timings."""
+    timings = {}
+    pa.annotate_and_save(frame, landmarks, result, fpath, timings)
+    return timings
+
+def run_round(pool, annotator, frames, copies, complexity, output_folder, db: DbStage, hostname: str):
+    """One timed round: N copies at once, like one Images_From_Pi1 loop; returns its stats."""
+    received = datetime.now(timezone.utc)
+    t0 = time.perf_counter()
+    futures = []
+    for i in range(copies):
+        futures.append(pool.submit(timed_task, pa.analyze_payload, time.monotonic(), frames[i % len(frames)],
+                                   "bench", i, output_folder, i, complexity, None, True))
+    wait(futures)
+    analyze_wall = time.perf_counter() - t0
+
+    results, frame_of, task_times = [], [], []
+    for i, f in enumerate(futures):
+        try:
+            result, times = f.result()
+            results.append(result)
+            task_times.append(times)
+            frame_of.append(frames[i % len(frames)])
+        except Exception as e:
+            LOGGER.error("Worker task failed: %s", e)
+    stage_sums = {s: [] for s in STAGES}
+    for r in results:
+        for s, v in r.get("timings", {}).items():
+            stage_sums.setdefault(s, []).append(v)
+
+    # output stage separately, so analysis throughput is comparable across OUTPUT_POLICY
+    pending = [(frame, r) for frame, r in zip(frame_of, results) if r.get("annotate_pending")]
+    ta = time.perf_counter()
+    afuts = [annotator.submit(_annotate_timed, frame, r.pop("landmarks"), r,
+                              os.path.join(output_folder, r["filename"])) for frame, r in pending]
+    wait(afuts)
+    annotate_wall = time.perf_counter() - ta
+    for f in afuts:
+        if not f.exception():
+            for s, v in f.result().items():
+                stage_sums[s].append(v)
+
+    analyzed = datetime.now(timezone.utc)
+    rows = [("bench", r.get("filename"), received, analyzed, r.get("neck_angle"), r.get("body_angle"),
+             r.get("posture_status"), r.get("landmarks_detected"), hostname, r.get("model_complexity"))
+            for r in results]
+    db_s = db.insert(rows)
+    if db.conn is not None:
+        stage_sums["db"].append(db_s / max(1, len(rows)))
+    return {
+        "copies": copies,
+        "processed": len(results),
+        "analyze_wall_s": analyze_wall,
+        "annotate_wall_s": annotate_wall,
+        "annotated": len(afuts),
+        "throughput_fps": len(results) / analyze_wall if analyze_wall > 0 else 0.0,
+        "tasks": summarize(task_times),
+        "stage_means_s": {s: (statistics.fmean(v) if v else None) for s, v in stage_sums.items()},
+        "received_time": received.astimezone().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else ""
+    hostname = socket.gethostname()
+    output_folder = OUTPUT_BASE or tempfile.mkdtemp(prefix="posture-bench-")
+    os.makedirs(output_folder, exist_ok=True)
+
+    frames = load_frames(source)
+    LOGGER.info("🏁 Bench on %s | %d frame(s) from %s | workers=%d schedule=%s warmup=%d trials=%d",
+                hostname, len(frames), source or "synthetic", NUM_WORKERS, BENCH_SCHEDULE, BENCH_WARMUP, BENCH_TRIALS)
+
+    t0 = time.perf_counter()
+    pool = pa.make_pool(NUM_WORKERS)
+    pa.warm_pool(pool, NUM_WORKERS)
+    annotator = pa.make_annotation_pool(1)
+    complexity = pa.resolve_complexity(pool, NUM_WORKERS)
+    startup_s = time.perf_counter() - t0
+    db = DbStage(BENCH_DB_DSN)
+
+    levels, csv_rows = [], []
+    try:
+        for loop_idx, copies in enumerate(BENCH_SCHEDULE, start=1):
+            for _ in range(BENCH_WARMUP):
+                run_round(pool, annotator, frames, copies, complexity, output_folder, DbStage(""), hostname)
+            sampler = ResourceSampler(interval_ms=200).start()
+            trials = [run_round(pool, annotator, frames, copies, complexity, output_folder, db, hostname)
+                      for _ in range(BENCH_TRIALS)]
+            resources = sampler.stop_and_summary()
+            fps = ci95([t["throughput_fps"] for t in trials])
+            per_frame = ci95([t["analyze_wall_s"] / max(1, t["processed"]) for t in trials])
+            stages = {}
+            for s in STAGES:
+                vals = [t["stage_means_s"].get(s) for t in trials if t["stage_means_s"].get(s) is not None]
+                if vals:
+                    stages[s] = ci95(vals)
+            levels.append({"copies": copies, "throughput_fps": fps, "sec_per_frame": per_frame,
+                           "round_wall_s": {"p50": percentile([t["analyze_wall_s"] for t in trials], 50),
+                                            "p95": percentile([t["analyze_wall_s"] for t in trials], 95)},
+                           "service_p50_s": task_ci95(trials, "service_s", "p50"),
+                           "service_p99_s": task_ci95(trials, "service_s", "p99"),
+                           "queue_wait_p95_s": task_ci95(trials, "queue_wait_s", "p95"),
+                           "stages_s": stages, "resources": resources, "trials": trials})
+            csv_rows.append([loop_idx, copies, trials[-1]["processed"], round(per_frame["mean"], 6), "bench",
+                             trials[-1]["received_time"], resources.get("avg_gpu_pct"), resources.get("avg_cpu_pct"),
+                             resources.get("avg_ram_pct"), complexity])
+            LOGGER.info("✅ copies=%d: %.2f ± %s fps | %s", copies, fps["mean"],
+                        f"{fps['ci95']:.2f}" if fps["ci95"] is not None else "n/a",
+                        " ".join(f"{s}={v['mean'] * 1000:.1f}ms" for s, v in stages.items()))
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        annotator.shutdown(wait=True, cancel_futures=True)
+
+    import csv
+    with open(BENCH_CSV, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["loop_index", "copies_in_loop", "processed_count", "avg_process_time_seconds",
+                    "pi_id", "loop_received_time", "avg_gpu_pct", "avg_cpu_pct", "avg_ram_pct", "model_complexity"])
+        w.writerows(csv_rows)
+    report = {
+        "host": hostname,
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "source": source or "synthetic",
+        "frames": len(frames),
+        "workers": NUM_WORKERS,
+        "model_complexity": complexity,
+        "output_policy": pa.OUTPUT_POLICY,
+        "roi_enabled": pa.ROI_ENABLED,
+        "warmup": BENCH_WARMUP,
+        "trials": BENCH_TRIALS,
+        "startup_s": startup_s,
+        "levels": levels,
+    }
+    with open(BENCH_JSON, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    LOGGER.info("🧾 Wrote %s and %s", BENCH_CSV, BENCH_JSON)
+
+    if BENCH_MIN_FPS > 0 and levels and levels[-1]["throughput_fps"]["mean"] < BENCH_MIN_FPS:
+        LOGGER.error("❌ Throughput %.2f fps below BENCH_MIN_FPS=%.2f",
+                     levels[-1]["throughput_fps"]["mean"], BENCH_MIN_FPS)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
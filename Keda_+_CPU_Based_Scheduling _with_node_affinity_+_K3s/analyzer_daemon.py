@@ -0,0 +1,606 @@
+#!/usr/bin/env python3
+# analyzer_daemon.py — one analyzer process serving many Pi topics.
+#
+# Replaces one-image-per-topic deployments (Images_From_Pi1.py ... _9) with a single
+# daemon per node:
+#   - subscribes to a configurable topic set (ANALYZER_TOPICS)
+#   - one ProcessPoolExecutor shared by all topics, so the Pose model is loaded
+#     NUM_WORKERS times per node instead of once per topic/pod
+#   - per-topic bounded queues drained with smooth weighted round-robin, so a busy
+#     camera cannot starve the others
+#   - TRACKING_MODE=true: each topic is pinned to one single-worker pool so MediaPipe
+#     can track landmarks across that camera's consecutive frames instead of running
+#     full person detection on every frame
+#
+# ANALYZER_TOPICS: comma list of "subscription[=weight]", e.g.
+#   "images/pi1=2,images/pi2=1"  or  "images/#"  (every concrete topic gets the weight
+#   of the first subscription that matches it; default weight 1)
+import os
+import sys
+import json
+import signal
+import socket
+import random
+import logging
+import threading
+import collections
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from typing import Deque, Dict, List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+import psycopg2
+
+from posture_analysis import (analyze_payload, annotate_and_save, load_libs, make_annotation_pool, make_pool,
+                              resolve_complexity, warm_pool)
+from analyzer_startup import PROFILE, start_ready_server
+import analyzer_metrics
+import mqtt_client
+import trace_context
+from posture_schema import MAINTENANCE_SECONDS, ensure_schema, maintain
+from task_timing import percentile, timed_task
+
+# ---------------------------
+# Config (env overrides)
+# ---------------------------
+# MQTT_BROKERS (mqtt_sharding.py) spreads the cameras over several brokers; this one otherwise
+BROKER = os.environ.get("MQTT_BROKER", "192.168.1.79")
+PORT = int(os.environ.get("MQTT_PORT", "1883"))
+ANALYZER_TOPICS = os.environ.get("ANALYZER_TOPICS", "images/#")
+EXCLUDE_TOPICS = set(t.strip() for t in os.environ.get("EXCLUDE_TOPICS", "images/jetson_orin").split(",") if t.strip())
+OUTPUT_BASE = os.environ.get("OUTPUT_DIR", "./analyzed_images")
+
+_default_workers = os.cpu_count() or 4
+NUM_WORKERS = int(os.environ.get("NUM_WORKERS", str(max(1, _default_workers))))
+# Frames submitted to the pool but not finished; keeps fairness decisions at dispatch time
+MAX_INFLIGHT = int(os.environ.get("MAX_INFLIGHT", str(NUM_WORKERS * 2)))
+# Per-topic backlog and what is shed when a topic's queue is full: drop_oldest (default),
+# drop_newest, or latest (one frame per topic, replaced by each new one). Priority between
+# cameras is the ANALYZER_TOPICS weight (the single-queue analyzers use ingest_queue.py).
+TOPIC_QUEUE_SIZE = int(os.environ.get("TOPIC_QUEUE_SIZE", "8"))
+TOPIC_QUEUE_POLICY = os.environ.get("TOPIC_QUEUE_POLICY", "drop_oldest").lower()
+# Analyze each received frame this many times (the benchmarks use 100+; live use 1)
+COPIES_PER_MESSAGE = int(os.environ.get("COPIES_PER_MESSAGE", "1"))
+
+# Per-topic tracking (static_image_mode=False); frames of a topic always go to the same
+# worker process, at most PINNED_INFLIGHT at a time (keeps per-stream order)
+TRACKING_MODE = os.environ.get("TRACKING_MODE", "false").lower() == "true"
+PINNED_INFLIGHT = int(os.environ.get("PINNED_INFLIGHT", "2"))
+if TRACKING_MODE and COPIES_PER_MESSAGE != 1:
+    # repeated copies of one frame would look like a frozen stream to the tracker
+    COPIES_PER_MESSAGE = 1
+
+# Annotated JPEGs (OUTPUT_POLICY in posture_analysis) are drawn/encoded in a separate
+# niced pool; when it falls this far behind, further annotations are skipped
+ANNOTATE_WORKERS = int(os.environ.get("ANNOTATE_WORKERS", "1"))
+ANNOTATE_BACKLOG = int(os.environ.get("ANNOTATE_BACKLOG", "16"))
+
+# How often queue-depth / in-flight / complexity gauges are refreshed for /metrics
+METRICS_SECONDS = float(os.environ.get("METRICS_SECONDS", "5"))
+
+# Adaptive model_complexity: start at the calibrated/configured level, step down while
+# the backlog stays high, step back up (never above the start level) once idle
+ADAPTIVE_QUALITY = os.environ.get("ADAPTIVE_QUALITY", "true").lower() == "true"
+BACKLOG_HIGH = int(os.environ.get("BACKLOG_HIGH", str(max(2, TOPIC_QUEUE_SIZE // 2))))
+STEP_DOWN_SECONDS = float(os.environ.get("STEP_DOWN_SECONDS", "10"))
+STEP_UP_SECONDS = float(os.environ.get("STEP_UP_SECONDS", "60"))
+
+# Per-camera feedback for the Pi publishers (RaspberryPi_scripts/rate_control.py):
+# backlog / p95 latency / drops published to FEEDBACK_PREFIX + <pi_id> every FEEDBACK_SECONDS
+FEEDBACK_ENABLED = os.environ.get("FEEDBACK_ENABLED", "true").lower() == "true"
+FEEDBACK_PREFIX = os.environ.get("FEEDBACK_PREFIX", "control/")
+FEEDBACK_SECONDS = float(os.environ.get("FEEDBACK_SECONDS", "5"))
+
+DB_HOST = os.environ.get("DB_HOST", "aws-0-eu-north-1.pooler.supabase.com")
+DB_NAME = os.environ.get("DB_NAME", "postgres")
+DB_USER = os.environ.get("DB_USER", "postgres.yvqqpgixkwsiychmwvkc")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "University12@")
+DB_PORT = int(os.environ.get("DB_PORT", "5432"))
+DB_SSLMODE = os.environ.get("DB_SSLMODE", "require")
+DB_ENABLED = os.environ.get("DB_ENABLED", "false").lower() == "true"
+
+# ---------------------------
+# Logging
+# ---------------------------
+LOGGER = logging.getLogger("posture_daemon")
+LOGGER.setLevel(logging.INFO)
+_sh = logging.StreamHandler(sys.stdout)
+_sh.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(message)s"))
+LOGGER.addHandler(_sh)
+
+def parse_topic_spec(spec: str) -> List[Tuple[str, int]]:
+    """'images/pi1=2, images/#' -> [('images/pi1', 2), ('images/#', 1)]"""
+    out = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        sub, _, weight = part.partition("=")
+        out.append((sub.strip(), max(1, int(weight)) if weight.strip() else 1))
+    return out
+
+def pi_id_from_topic(topic: str) -> str:
+    parts = topic.split("/")
+    return parts[1] if len(parts) > 1 else "unknown"
+
+# ---------------------------
+# Weighted per-topic queues
+# ---------------------------
+class WeightedTopicQueues:
+    """
+    One bounded deque per concrete topic. get() picks the next topic with smooth
+    weighted round-robin (nginx-style): over any window, non-empty topics are
+    served in proportion to their weights, interleaved rather than in bursts.
+    """
+    def __init__(self, subscriptions: List[Tuple[str, int]], maxlen: int, policy: str = TOPIC_QUEUE_POLICY):
+        if policy not in ("drop_oldest", "drop_newest", "latest"):
+            raise ValueError(f"TOPIC_QUEUE_POLICY must be drop_oldest, drop_newest or latest, got {policy!r}")
+        self.subscriptions = subscriptions
+        self.policy = policy
+        self.maxlen = 1 if policy == "latest" else maxlen
+        self.cond = threading.Condition()
+        self.queues: Dict[str, Deque] = {}
+        self.weights: Dict[str, int] = {}
+        self.current: Dict[str, int] = {}
+        self.dropped: Dict[str, int] = collections.Counter()
+        self.closed = False
+
+    def _weight_for(self, topic: str) -> int:
+        for sub, weight in self.subscriptions:
+            if mqtt.topic_matches_sub(sub, topic):
+                return weight
+        return 1
+
+    def put(self, topic: str, item) -> None:
+        with self.cond:
+            q = self.queues.get(topic)
+            if q is None:
+                q = self.queues[topic] = collections.deque(maxlen=self.maxlen)
+                self.weights[topic] = self._weight_for(topic)
+                self.current[topic] = 0
+                LOGGER.info("New topic %s (weight=%d)", topic, self.weights[topic])
+            if len(q) == q.maxlen:
+                self.dropped[topic] += 1
+                analyzer_metrics.frame_dropped(pi_id_from_topic(topic), policy=self.policy)
+                if self.policy == "drop_newest":
+                    return
+            q.append(item)  # full deque: append evicts the oldest
+            self.cond.notify()
+
+    def get(self, timeout: Optional[float] = None, eligible=None):
+        """Return (topic, item) or None on timeout/close. eligible(topic) filters which topics may be served."""
+        def _ready():
+            return [t for t, q in self.queues.items() if q and (eligible is None or eligible(t))]
+
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.closed or _ready(), timeout=timeout):
+                return None
+            if self.closed:
+                return None
+            ready = _ready()
+            total = 0
+            for t in ready:
+                self.current[t] += self.weights[t]
+                total += self.weights[t]
+            best = max(ready, key=lambda t: self.current[t])
+            self.current[best] -= total
+            return best, self.queues[best].popleft()
+
+    def wake(self):
+        """Re-evaluate get() waiters (e.g. a pinned worker freed a slot)."""
+        with self.cond:
+            self.cond.notify_all()
+
+    def depths(self) -> Dict[str, int]:
+        with self.cond:
+            return {t: len(q) for t, q in self.queues.items()}
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+# ---------------------------
+# Topic -> worker pinning (tracking mode)
+# ---------------------------
+class PinnedPools:
+    """
+    One single-worker pool per process. A new topic is pinned to the pool with the
+    least total topic weight, so heavy cameras spread across workers; each pool takes
+    at most PINNED_INFLIGHT frames at a time so one slow stream cannot hog the dispatcher.
+    """
+    def __init__(self, pools: List[ProcessPoolExecutor]):
+        self.pools = pools
+        self.lock = threading.Lock()
+        self.assigned: Dict[str, int] = {}
+        self.load = [0] * len(pools)
+        self.inflight = [0] * len(pools)
+
+    def index_for(self, topic: str, weight: int = 1) -> int:
+        with self.lock:
+            i = self.assigned.get(topic)
+            if i is None:
+                i = min(range(len(self.pools)), key=lambda k: (self.load[k], k))
+                self.assigned[topic] = i
+                self.load[i] += weight
+                LOGGER.info("📌 %s pinned to worker %d (load=%d)", topic, i, self.load[i])
+            return i
+
+    def has_slot(self, topic: str, weight: int = 1) -> bool:
+        i = self.index_for(topic, weight)
+        with self.lock:
+            return self.inflight[i] < PINNED_INFLIGHT
+
+    def submit(self, topic: str, fn, *args):
+        i = self.index_for(topic)
+        with self.lock:
+            self.inflight[i] += 1
+        return i, self.pools[i].submit(fn, *args)
+
+    def done(self, i: int):
+        with self.lock:
+            self.inflight[i] -= 1
+
+    def shutdown(self):
+        for pool in self.pools:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+# ---------------------------
+# Adaptive quality
+# ---------------------------
+class QualityController:
+    """
+    Picks the model_complexity for the next task. Backlog at or above BACKLOG_HIGH for
+    STEP_DOWN_SECONDS drops one level; an empty backlog for STEP_UP_SECONDS raises one
+    level, capped at `ceiling` (what calibration says this node sustains).
+    """
+    def __init__(self, ceiling: int, enabled: bool = ADAPTIVE_QUALITY):
+        self.ceiling = ceiling
+        self.level = ceiling
+        self.enabled = enabled
+        self.high_since: Optional[float] = None
+        self.idle_since: Optional[float] = None
+        self.changes = 0
+
+    def observe(self, backlog: int, now: Optional[float] = None) -> int:
+        if not self.enabled:
+            return self.level
+        now = time.monotonic() if now is None else now
+        self.high_since = (self.high_since or now) if backlog >= BACKLOG_HIGH else None
+        self.idle_since = (self.idle_since or now) if backlog == 0 else None
+        if self.high_since is not None and now - self.high_since >= STEP_DOWN_SECONDS and self.level > 0:
+            self._set(self.level - 1, f"backlog {backlog} >= {BACKLOG_HIGH} for {STEP_DOWN_SECONDS:.0f}s")
+            self.high_since = now
+        elif self.idle_since is not None and now - self.idle_since >= STEP_UP_SECONDS and self.level < self.ceiling:
+            self._set(self.level + 1, f"idle for {STEP_UP_SECONDS:.0f}s")
+            self.idle_since = now
+        return self.level
+
+    def _set(self, level: int, reason: str):
+        LOGGER.warning("🎚️ model_complexity %d -> %d (%s)", self.level, level, reason)
+        self.level = level
+        self.changes += 1
+
+# ---------------------------
+# DB writer (single thread owns the connection)
+# ---------------------------
+class DbWriter(threading.Thread):
+    """Batches rows; a row's trace context (if any) gets a db_commit span and goes to the sink."""
+    def __init__(self, sink: "trace_context.TraceSink"):
+        super().__init__(daemon=True)
+        self.rows: "collections.deque" = collections.deque()
+        self.event = threading.Event()
+        self.conn = None
+        self.sink = sink
+        self.maintained = time.monotonic()
+
+    def connect(self):
+        if not DB_ENABLED:
+            LOGGER.warning("DB disabled via DB_ENABLED=false; skipping DB writes.")
+            return
+        try:
+            self.conn = psycopg2.connect(host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+                                         port=DB_PORT, sslmode=DB_SSLMODE)
+            with self.conn.cursor() as cur:
+                ensure_schema(cur)
+            self.conn.commit()
+            LOGGER.info("✅ DB connected and schema ensured.")
+        except Exception as e:
+            LOGGER.error("❌ DB connection failed: %s; continuing without DB writes.", e)
+            self.conn = None
+
+    def submit(self, row, ctx=None):
+        if self.conn is not None:
+            self.rows.append((row, ctx))
+            self.event.set()
+        else:
+            self.sink.emit(ctx)
+
+    def maintain(self):
+        # new month partitions and retention; the writer thread owns the connection
+        self.maintained = time.monotonic()
+        try:
+            with self.conn.cursor() as cur:
+                maintain(cur)
+            self.conn.commit()
+        except Exception as e:
+            LOGGER.error("Schema maintenance failed: %s", e)
+            try: self.conn.rollback()
+            except Exception: pass
+
+    def run(self):
+        while True:
+            self.event.wait(MAINTENANCE_SECONDS)
+            self.event.clear()
+            if self.conn is not None and time.monotonic() - self.maintained >= MAINTENANCE_SECONDS:
+                self.maintain()
+            batch = []
+            while self.rows:
+                batch.append(self.rows.popleft())
+            if not batch:
+                continue
+            try:
+                t0, t0_ns = time.monotonic(), time.time_ns()
+                with self.conn.cursor() as cur:
+                    cur.executemany(
+                        """
+                        INSERT INTO posture_log
+                        (pi_id, filename, received_time, analyzed_time, neck_angle, body_angle,
+                         posture_status, landmarks_detected, processed_by, model_complexity, frame_id)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        """,
+                        [row for row, _ in batch],
+                    )
+                self.conn.commit()
+                analyzer_metrics.db_write(time.monotonic() - t0)
+                for _, ctx in batch:
+                    trace_context.add_span(ctx, "db_commit", t0_ns, batch=len(batch))
+                    self.sink.emit(ctx)
+            except Exception as e:
+                LOGGER.error("DB insert of %d rows failed: %s", len(batch), e)
+                try: self.conn.rollback()
+                except Exception: pass
+
+# ---------------------------
+# Daemon
+# ---------------------------
+class AnalyzerDaemon:
+    def __init__(self):
+        self.hostname = socket.gethostname()
+        self.subscriptions = parse_topic_spec(ANALYZER_TOPICS)
+        self.queues = WeightedTopicQueues(self.subscriptions, TOPIC_QUEUE_SIZE)
+        self.slots = threading.BoundedSemaphore(MAX_INFLIGHT)
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.pinned: Optional[PinnedPools] = None
+        self.sink = trace_context.TraceSink()
+        self.db = DbWriter(self.sink)
+        self.stop = threading.Event()
+        self.processed: Dict[str, int] = collections.Counter()
+        self.latencies: Dict[str, Deque[float]] = collections.defaultdict(lambda: collections.deque(maxlen=256))
+        self.submitted = 0  # written by the dispatch thread only
+        self.completed = 0  # pool callbacks (one thread per pool in tracking mode)
+        self.count_lock = threading.Lock()  # completed, processed, latencies
+        self.quality: Optional[QualityController] = None
+        self.annotator: Optional[ProcessPoolExecutor] = None
+        self.annotate_lock = threading.Lock()
+        self.annotate_inflight = 0
+        self.annotate_skipped = 0
+
+    # MQTT callbacks
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        if mqtt_client.connected(rc):
+            subs = [mqtt_client.subscription(s) for s, _ in self.subscriptions]
+            LOGGER.info("✅ Connected to MQTT; subscribing to %s", subs)
+            client.subscribe([(s, 0) for s in subs])
+            PROFILE.satisfy("mqtt_connected")
+        else:
+            LOGGER.error("❌ MQTT connection failed with rc=%s", rc)
+
+    def on_message(self, client, userdata, msg):
+        if msg.topic in EXCLUDE_TOPICS:
+            return
+        # decode happens in the worker; only bytes cross the process boundary
+        recv_ns = time.time_ns()
+        ctx, payload = trace_context.unwrap(msg.payload)
+        trace_context.add_span(ctx, "mqtt_receive", recv_ns, recv_ns, topic=msg.topic)
+        received_time = datetime.now(timezone.utc)
+        if ctx is not None and ctx.get("replayed"):
+            # spooled in the Pi's outbox during an outage: file it under its capture time
+            received_time = datetime.fromtimestamp(ctx["t_capture_ns"] / 1e9, tz=timezone.utc)
+        self.queues.put(msg.topic, (payload, received_time, ctx, recv_ns))
+
+    # dispatch: fairness is decided here, the pool only ever sees MAX_INFLIGHT tasks
+    def dispatch_loop(self):
+        eligible = None
+        if self.pinned is not None:
+            eligible = lambda t: self.pinned.has_slot(t, self.queues.weights.get(t, 1))
+        while not self.stop.is_set():
+            got = self.queues.get(timeout=1.0, eligible=eligible)
+            if got is None:
+                continue
+            topic, (payload, received_time, ctx, recv_ns) = got
+            trace_context.add_span(ctx, "topic_queue", recv_ns)
+            pi_id = pi_id_from_topic(topic)
+            output_folder = os.path.join(OUTPUT_BASE, f"analyzed_images_from_{pi_id}")
+            os.makedirs(output_folder, exist_ok=True)
+            unique_id = random.randint(10000, 99999)
+            PROFILE.mark("first_frame_dispatched")
+            complexity = self.quality.observe(sum(self.queues.depths().values()))
+            for copy_idx in range(COPIES_PER_MESSAGE):
+                self.slots.acquire()
+                self.submitted += 1
+                args = (analyze_payload, time.monotonic(), payload, pi_id, unique_id, output_folder, copy_idx,
+                        complexity, topic if self.pinned is not None else None, True)
+                if self.pinned is not None:
+                    worker, fut = self.pinned.submit(topic, timed_task, *args)
+                else:
+                    worker, fut = None, self.pool.submit(timed_task, *args)
+                # only the first copy carries the frame's trace
+                frame = {"topic": topic, "received_time": received_time, "worker": worker, "payload": payload,
+                         "output_folder": output_folder, "ctx": ctx if copy_idx == 0 else None,
+                         "frame_id": ctx["frame_id"] if ctx else None,
+                         "replayed": bool(ctx and ctx.get("replayed"))}
+                fut.add_done_callback(lambda f, fr=frame: self._done(f, fr))
+
+    def _annotate(self, payload: bytes, result: dict, output_folder: str) -> Optional[str]:
+        """Queue the JPEG for a deferred-output result; returns the filename, or None if skipped."""
+        with self.annotate_lock:
+            if self.annotate_inflight >= ANNOTATE_BACKLOG:
+                self.annotate_skipped += 1
+                return None
+            self.annotate_inflight += 1
+        fut = self.annotator.submit(annotate_and_save, payload, result.get("landmarks"),
+                                    {k: v for k, v in result.items() if k != "landmarks"},
+                                    os.path.join(output_folder, result["filename"]))
+        fut.add_done_callback(self._annotated)
+        return result["filename"]
+
+    def _annotated(self, fut):
+        with self.annotate_lock:
+            self.annotate_inflight -= 1
+        if fut.exception() is not None:
+            LOGGER.error("Annotation failed: %s", fut.exception())
+
+    def _done(self, fut, frame: dict):
+        topic, received_time, worker, ctx = frame["topic"], frame["received_time"], frame["worker"], frame["ctx"]
+        self.slots.release()
+        with self.count_lock:
+            self.completed += 1
+        if worker is not None:
+            self.pinned.done(worker)
+            self.queues.wake()
+        try:
+            result, times = fut.result()
+        except Exception as e:
+            LOGGER.error("Worker task failed for %s: %s", topic, e)
+            return
+        if ctx is not None:
+            trace_context.add_span(ctx, "pool_queue", trace_context.mono_to_ns(times.enqueued),
+                                   trace_context.mono_to_ns(times.started))
+            trace_context.add_span(ctx, "worker", trace_context.mono_to_ns(times.started),
+                                   trace_context.mono_to_ns(times.finished),
+                                   model_complexity=result.get("model_complexity"))
+        PROFILE.mark("first_frame_done")
+        # replayed frames are minutes old by design; keep them out of latency and feedback
+        latency = None if frame["replayed"] else (datetime.now(timezone.utc) - received_time).total_seconds()
+        with self.count_lock:
+            self.processed[topic] += 1
+            if latency is not None:
+                self.latencies[topic].append(latency)
+        analyzer_metrics.frame_done(pi_id_from_topic(topic), result.get("model_complexity"),
+                                    result.get("posture_status"), latency)
+        filename = self._annotate(frame["payload"], result, frame["output_folder"]) \
+            if result.get("annotate_pending") else None
+        self.db.submit((pi_id_from_topic(topic), filename, received_time, datetime.now(timezone.utc),
+                        result.get("neck_angle"), result.get("body_angle"), result.get("posture_status"),
+                        result.get("landmarks_detected"), self.hostname, result.get("model_complexity"),
+                        frame["frame_id"]), ctx)
+
+    def report_loop(self, every: float = 30.0):
+        while not self.stop.wait(every):
+            with self.count_lock:
+                processed = dict(self.processed)
+            LOGGER.info("📊 processed=%s depth=%s dropped=%s model_complexity=%d annotate_backlog=%d skipped=%d",
+                        processed, self.queues.depths(), dict(self.queues.dropped),
+                        self.quality.level, self.annotate_inflight, self.annotate_skipped)
+
+    def metrics_loop(self, every: float = METRICS_SECONDS):
+        # gauges are sampled here; counters/histograms are recorded where events happen
+        while not self.stop.wait(every):
+            for topic, depth in self.queues.depths().items():
+                analyzer_metrics.queue_depth(pi_id_from_topic(topic), depth)
+            analyzer_metrics.inflight(self.submitted - self.completed)
+            analyzer_metrics.model_complexity(self.quality.level)
+
+    def feedback_loop(self, client, every: float = FEEDBACK_SECONDS):
+        """One report per camera so its publisher can back off (AIMD) before we drop frames."""
+        last_dropped: Dict[str, int] = collections.Counter()
+        while not self.stop.wait(every):
+            depths = self.queues.depths()
+            with self.count_lock:  # frames finished since the last report
+                latencies = {t: list(self.latencies.pop(t)) for t in list(self.latencies)}
+            for topic in set(depths) | set(latencies):
+                dropped = self.queues.dropped[topic]
+                p95 = percentile(latencies.get(topic, []), 95)
+                report = {"from": self.hostname, "pi_id": pi_id_from_topic(topic), "backlog": depths.get(topic, 0),
+                          "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                          "dropped": dropped - last_dropped[topic], "model_complexity": self.quality.level,
+                          "ts": time.time()}
+                last_dropped[topic] = dropped
+                client.publish(FEEDBACK_PREFIX + pi_id_from_topic(topic), json.dumps(report), qos=0)
+
+    def prepare_pool(self):
+        with PROFILE.phase("import_libs"):
+            load_libs()
+        with PROFILE.phase("pool_create"):
+            if TRACKING_MODE:
+                pools = [make_pool(1) for _ in range(NUM_WORKERS)]
+            else:
+                pools = [make_pool(NUM_WORKERS)]
+        with PROFILE.phase("pool_warm"):
+            n = sum(warm_pool(p, 1 if TRACKING_MODE else NUM_WORKERS) for p in pools)
+        LOGGER.info("🔥 Worker pool warm: %d/%d workers have a model loaded", n, NUM_WORKERS)
+        with PROFILE.phase("calibrate"):
+            self.quality = QualityController(resolve_complexity(pools[0], NUM_WORKERS))
+        self.annotator = make_annotation_pool(ANNOTATE_WORKERS)
+        if TRACKING_MODE:
+            self.pinned = PinnedPools(pools)
+        self.pool = pools[0]
+        PROFILE.satisfy("pool_warm")
+
+    def run(self):
+        LOGGER.info("🚀 Analyzer daemon on %s | MQTT %s:%s | topics=%s | workers=%d inflight=%d tracking=%s",
+                    self.hostname, BROKER, PORT, ANALYZER_TOPICS, NUM_WORKERS, MAX_INFLIGHT, TRACKING_MODE)
+        os.makedirs(OUTPUT_BASE, exist_ok=True)
+        analyzer_metrics.init_metrics()
+        start_ready_server()
+        PROFILE.require("pool_warm", "mqtt_connected")
+
+        # model/pool start overlaps with MQTT + DB connect; frames queue up meanwhile
+        prep = threading.Thread(target=self.prepare_pool, daemon=True)
+        prep.start()
+
+        # one client per broker these topics are sharded to (just BROKER without MQTT_BROKERS)
+        client = mqtt_client.ClientGroup([t for t, _ in self.subscriptions], BROKER, PORT)
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+        with PROFILE.phase("mqtt_connect"):
+            client.connect(60)
+        with PROFILE.phase("db_connect"):
+            self.db.connect()
+        self.db.start()
+
+        # start the network thread only after workers are forked
+        prep.join()
+        if self.pool is None:
+            LOGGER.error("❌ Worker pool failed to start; exiting.")
+            return
+        client.loop_start()
+
+        for target in (self.dispatch_loop, self.report_loop, self.metrics_loop):
+            threading.Thread(target=target, daemon=True).start()
+        if FEEDBACK_ENABLED:
+            threading.Thread(target=self.feedback_loop, args=(client,), daemon=True).start()
+
+        signal.signal(signal.SIGTERM, lambda *_: self.stop.set())
+        try:
+            while not self.stop.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop.set()
+            self.queues.close()
+            client.loop_stop()
+            client.disconnect()
+            if self.pinned is not None:
+                self.pinned.shutdown()
+            elif self.pool is not None:
+                self.pool.shutdown(wait=True, cancel_futures=True)
+            if self.annotator is not None:
+                self.annotator.shutdown(wait=True)
+            self.sink.close()
+
+if __name__ == "__main__":
+    AnalyzerDaemon().run()
@@ -0,0 +1,155 @@
+# analyzer_metrics.py — Prometheus metrics for the analyzers (served on READY_PORT /metrics).
+#
+# Pool workers are separate processes, so prometheus_client runs in multiprocess mode:
+# every process writes its samples to mmap'd files under PROMETHEUS_MULTIPROC_DIR and
+# /metrics aggregates them on scrape. Recording is a label lookup (cached here) plus an
+# mmap write — no locks shared between processes, no pipe traffic.
+#
+# Import this module (or call init_metrics()) BEFORE the pool is created so workers
+# inherit the directory. Without prometheus_client every call is a no-op.
+#
+# The legacy single-file analyzers (mqtt_posture_analyzer_with_db.py) ship a copy of this
+# module and ingest_queue.py; keep the copies identical.
+import os
+import re
+import glob
+import socket
+from typing import Dict, Tuple
+
+METRICS_DIR = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.environ.get("METRICS_DIR", "/tmp/posture-metrics"))
+NODE = os.environ.get("NODE_NAME", socket.gethostname())
+
+os.makedirs(METRICS_DIR, exist_ok=True)
+try:
+    from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+                                   start_http_server)
+    from prometheus_client import multiprocess
+except ImportError:  # optional dependency
+    multiprocess = None
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0, 10.0)
+
+if multiprocess is not None:
+    FRAMES = Counter("posture_frames_total", "Frames analyzed", ["pi_id", "node", "model_complexity", "status"])
+    DROPPED = Counter("posture_frames_dropped_total", "Frames shed by a full ingest queue", ["pi_id", "node", "policy"])
+    INFERENCE = Histogram("posture_inference_seconds", "Pose inference time per frame (worker)",
+                          ["node", "model_complexity"], buckets=_LATENCY_BUCKETS)
+    LATENCY = Histogram("posture_frame_latency_seconds", "MQTT receipt to analysis done",
+                        ["pi_id", "node", "model_complexity"], buckets=_LATENCY_BUCKETS)
+    DB_WRITE = Histogram("posture_db_write_seconds", "DB insert+commit time per batch", ["node"],
+                         buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+    QUEUE_DEPTH = Gauge("posture_queue_depth", "Frames waiting per topic", ["pi_id", "node"],
+                        multiprocess_mode="livesum")
+    INFLIGHT = Gauge("posture_inflight", "Frames submitted to the pool and not finished", ["node"],
+                     multiprocess_mode="livesum")
+    COMPLEXITY = Gauge("posture_model_complexity", "Current model complexity", ["node"],
+                       multiprocess_mode="liveall")
+
+_children: Dict[Tuple, object] = {}
+
+def _child(metric, *labels):
+    key = (id(metric),) + labels
+    c = _children.get(key)
+    if c is None:
+        c = _children[key] = metric.labels(*labels)
+    return c
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def init_metrics():
+    """
+    Remove sample files of processes that no longer exist (a previous run of this
+    container). Files of live processes stay, so scripts packed into one pod
+    (pack_runner.py) can share the directory and any one of them serves the total.
+    """
+    for f in glob.glob(os.path.join(METRICS_DIR, "*.db")):
+        m = re.search(r"_(\d+)\.db$", f)
+        if m and _pid_alive(int(m.group(1))):
+            continue
+        try:
+            os.remove(f)
+        except OSError:
+            pass
+
+def reap_dead():
+    """
+    mark_process_dead() every process whose live gauges are still on disk but that has
+    exited (a pool worker that died or was replaced when a pool was rebuilt), so
+    livesum/liveall gauges stop counting it. Counters and histograms of dead processes
+    are kept. Runs on every scrape.
+    """
+    if multiprocess is None:
+        return
+    for f in glob.glob(os.path.join(METRICS_DIR, "gauge_live*_*.db")):
+        m = re.search(r"_(\d+)\.db$", f)
+        if m and not _pid_alive(int(m.group(1))):
+            try:
+                multiprocess.mark_process_dead(int(m.group(1)), path=METRICS_DIR)
+            except OSError:
+                pass
+
+class _ReapingCollector:
+    """MultiProcessCollector that first drops the live gauges of exited processes."""
+    def __init__(self):
+        self.inner = multiprocess.MultiProcessCollector(None, path=METRICS_DIR)
+
+    def collect(self):
+        reap_dead()
+        return self.inner.collect()
+
+def _registry():
+    registry = CollectorRegistry()
+    registry.register(_ReapingCollector())
+    return registry
+
+def frame_done(pi_id: str, complexity, status: str, latency_s: float = None):
+    if multiprocess is None:
+        return
+    _child(FRAMES, pi_id, NODE, str(complexity), status or "Unknown").inc()
+    if latency_s is not None:
+        _child(LATENCY, pi_id, NODE, str(complexity)).observe(latency_s)
+
+def frame_dropped(pi_id: str, n: int = 1, policy: str = "drop_oldest"):
+    if multiprocess is not None and n > 0:
+        _child(DROPPED, pi_id, NODE, policy).inc(n)
+
+def inference(complexity, seconds: float):
+    """Called inside pool workers."""
+    if multiprocess is not None:
+        _child(INFERENCE, NODE, str(complexity)).observe(seconds)
+
+def db_write(seconds: float):
+    if multiprocess is not None:
+        _child(DB_WRITE, NODE).observe(seconds)
+
+def queue_depth(pi_id: str, depth: int):
+    if multiprocess is not None:
+        _child(QUEUE_DEPTH, pi_id, NODE).set(depth)
+
+def inflight(n: int):
+    if multiprocess is not None:
+        _child(INFLIGHT, NODE).set(n)
+
+def model_complexity(level: int):
+    if multiprocess is not None:
+        _child(COMPLEXITY, NODE).set(level)
+
+def serve(port: int):
+    """Standalone /metrics on `port` for analyzers without the readiness server (0 disables)."""
+    if multiprocess is None or port <= 0:
+        return
+    start_http_server(port, registry=_registry())
+
+def render() -> Tuple[int, bytes, str]:
+    """(status, body, content type) for GET /metrics."""
+    if multiprocess is None:
+        return 503, b"prometheus_client not installed\n", "text/plain"
+    return 200, generate_latest(_registry()), CONTENT_TYPE_LATEST
@@ -0,0 +1,129 @@
+# analyzer_startup.py — startup phase profiling and a readiness endpoint for analyzers.
+#
+#   STARTUP_PROFILE=true   log a per-phase timing table once the analyzer is ready
+#   STARTUP_PROFILE_PATH   also write it as JSON
+#   READY_PORT             HTTP port for /ready, /startup, /healthz, /metrics (0 disables)
+#
+# /ready returns 200 only after the worker pool is warm and MQTT is connected, so a
+# readinessProbe (or the releaser) can tell when a pod can actually take frames.
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+T0 = time.monotonic()  # as close to process start as an import can get
+
+STARTUP_PROFILE = os.environ.get("STARTUP_PROFILE", "false").lower() == "true"
+STARTUP_PROFILE_PATH = os.environ.get("STARTUP_PROFILE_PATH", "")
+READY_PORT = int(os.environ.get("READY_PORT", "8081"))
+
+LOGGER = logging.getLogger("posture_startup")
+
+class StartupProfile:
+    """Wall time per named phase (phases may overlap when run in threads) plus milestones."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases: Dict[str, float] = {}
+        self.marks: Dict[str, float] = {}
+        self.ready = threading.Event()
+        self.pending = set()
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = round(time.monotonic() - t0, 4)
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            self.phases[name] = round(seconds, 4)
+
+    def mark(self, name: str):
+        """Milestone measured from process start; first call wins."""
+        with self.lock:
+            self.marks.setdefault(name, round(time.monotonic() - T0, 4))
+
+    def require(self, *conditions: str):
+        with self.lock:
+            self.pending.update(conditions)
+
+    def satisfy(self, condition: str):
+        with self.lock:
+            self.pending.discard(condition)
+            done = not self.pending
+        self.mark(f"{condition}")
+        if done and not self.ready.is_set():
+            self.mark("ready")
+            self.ready.set()
+            self.report()
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {"ready": self.ready.is_set(), "waiting_for": sorted(self.pending),
+                    "phases_s": dict(self.phases), "since_start_s": dict(self.marks)}
+
+    def report(self):
+        if not STARTUP_PROFILE:
+            return
+        snap = self.snapshot()
+        for name, secs in snap["phases_s"].items():
+            LOGGER.info("⏱  phase %-16s %8.3fs", name, secs)
+        for name, secs in snap["since_start_s"].items():
+            LOGGER.info("⏱  t+%-18s %8.3fs", name, secs)
+        if STARTUP_PROFILE_PATH:
+            try:
+                with open(STARTUP_PROFILE_PATH, "w", encoding="utf-8") as f:
+                    json.dump(snap, f, indent=2)
+            except OSError as e:
+                LOGGER.warning("Could not write %s: %s", STARTUP_PROFILE_PATH, e)
+
+PROFILE = StartupProfile()
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/ready"):
+            ok = PROFILE.ready.is_set()
+            self._send(200 if ok else 503, {"ready": ok, "waiting_for": PROFILE.snapshot()["waiting_for"]})
+        elif self.path.startswith("/startup"):
+            self._send(200, PROFILE.snapshot())
+        elif self.path.startswith("/healthz"):
+            self._send(200, {"ok": True})
+        elif self.path.startswith("/metrics"):
+            import analyzer_metrics
+            code, data, ctype = analyzer_metrics.render()
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send(404, {"error": "not found"})
+
+    def _send(self, code: int, body: Dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+def start_ready_server(port: int = READY_PORT):
+    if port <= 0:
+        return None
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+    except OSError as e:
+        LOGGER.warning("Readiness server not started on :%d (%s)", port, e)
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -13,6 +13,8 @@ HTTP_PORT       = os.getenv("HTTP_PORT", "8088").strip()
 JOB_SELECTOR    = os.getenv("JOB_SELECTOR", "app=posture-queued").strip()
 ALLOWED_URL     = os.getenv("ALLOWED_URL", f"http://localhost:{HTTP_PORT}/allowed").strip()
 DOCKER_PLATFORM = os.getenv("DOCKER_PLATFORM", "linux/arm64/v8").strip()
+# "jobs": one queued Job per analyzer script (default); "daemon": one multi-topic analyzer per node
+DEPLOY_MODE     = os.getenv("DEPLOY_MODE", "jobs").strip().lower()
 
 ANALYZER_SCRIPTS = [
     "Images_From_Pi1.py",
@@ -31,6 +33,7 @@ ROOT = Path(__file__).resolve().parent
 LOGDIR = ROOT / "_logs"
 PIDFILE = ROOT / "_pids.json"
 JOBS_FILE = ROOT / "jobs-queue.yaml"
+DAEMON_FILE = ROOT / "analyzer-daemonset.yaml"
 PY = sys.executable
 
 def step(title):
@@ -52,6 +55,25 @@ def ensure_cli(name):
         print(f"ERROR: '{name}' not found in PATH.")
         sys.exit(1)
 
+def deploy_daemon():
+    """Build one image and run analyzer_daemon.py on every worker (replaces the 10 Jobs)."""
+    step("🔨 Building analyzer daemon image")
+    image = f"{REGISTRY_USER}/posture-analyzer-daemon:latest"
+    run([
+        "docker", "buildx", "build",
+        "--platform", DOCKER_PLATFORM,
+        "-f", "Dockerfile",
+        "--build-arg", "APP=analyzer_daemon.py",
+        "-t", image,
+        "--push",
+        "."
+    ])
+
+    step("📜 Applying analyzer DaemonSet")
+    run(["kubectl", "apply", "-n", NAMESPACE, "-f", str(DAEMON_FILE)])
+    print(f"\n✅ Daemon mode: one analyzer per node ({image})")
+    print(f"kubectl -n {NAMESPACE} get pods -l app=posture-daemon -o wide")
+
 def main():
     ensure_cli("kubectl"); ensure_cli("docker")
 
@@ -64,6 +86,9 @@ def main():
          "posture-external-scaler", "posture-controller",
          "--ignore-not-found", "--wait=false"], check=False)
 
+    run(["kubectl", "-n", NAMESPACE, "delete", "ds", "posture-analyzer-daemon",
+         "--ignore-not-found", "--wait=false"], check=False)
+
     # Delete Services that might be left over
     run(["kubectl", "-n", NAMESPACE, "delete", "svc",
          "posture-external-scaler", "posture-controller",
@@ -96,6 +121,10 @@ def main():
     run(["docker", "buildx", "use", "posturebuilder"], check=False)
     run(["bash", "-lc", "docker run --privileged --rm tonistiigi/binfmt --install all >/dev/null 2>&1 || true"], check=False)
 
+    if DEPLOY_MODE == "daemon":
+        deploy_daemon()
+        return
+
     # 4) Build analyzers
     step("🔨 Building analyzer images")
     for i, script in enumerate(ANALYZER_SCRIPTS):
@@ -130,7 +159,8 @@ def main():
     ctrl_env   = {**os.environ, "EXCLUDE_NODES": EXCLUDE_NODES, "PROM_URL": PROM_URL,
                   "CPU_THRESHOLD": CPU_THRESHOLD, "CONTROLLER_PORT": "8090"}
     rel_env    = {**os.environ, "NAMESPACE": NAMESPACE, "JOB_SELECTOR": JOB_SELECTOR,
-                  "ALLOWED_URL": ALLOWED_URL, "POLL_SECONDS": "5"}
+                  "ALLOWED_URL": ALLOWED_URL, "POLL_SECONDS": "5",
+                  "CONTROLLER_URL": "http://localhost:8090/last"}
 
     p_scaler = run_bg([PY, "external_scaler.py"], LOGDIR / f"external_scaler_{ts}.log", env=scaler_env)
     p_ctrl   = run_bg([PY, "controller.py"],      LOGDIR / f"controller_{ts}.log",      env=ctrl_env)
@@ -1,24 +1,47 @@
 # controller.py — Ranker (fixed to avoid labeling non-existent/excluded nodes)
-import os, threading, time, requests
-from typing import Dict, List
+import os, json, threading, time, requests
+from typing import Dict, List, Tuple
 from fastapi import FastAPI
 import uvicorn
 
 from kubernetes import client, config
 
+from mqtt_sharding import parse_brokers
+
 PROM_URL = os.getenv("PROM_URL", "http://localhost:9090")
 CPU_THRESHOLD = float(os.getenv("CPU_THRESHOLD", "0.70"))
 EXCLUDE_NODES = set(s.strip() for s in os.getenv("EXCLUDE_NODES", "localhost").split(",") if s.strip())
 POLL_SECONDS = float(os.getenv("POLL_SECONDS", "10"))
 
+# Rank stability (hysteresis)
+EWMA_ALPHA = float(os.getenv("EWMA_ALPHA", "0.3"))               # weight of the newest 30s sample
+RANK_MIN_DELTA = float(os.getenv("RANK_MIN_DELTA", "0.5"))       # free cores a node must gain to overtake
+RANK_DWELL_SECONDS = float(os.getenv("RANK_DWELL_SECONDS", "60")) # hold a rank at least this long
+EWMA_MAX_MISSES = int(os.getenv("EWMA_MAX_MISSES", "3"))         # scrapes a node may miss before its EWMA is dropped
+
+# Cluster-wide feedback for the Pi publishers (RaspberryPi_scripts/rate_control.py):
+# "overload" while no node is under CPU_THRESHOLD. Empty FEEDBACK_BROKER disables it; with
+# sharded brokers list them all ("host[:port],...") so every Pi hears it.
+FEEDBACK_BROKER = os.getenv("FEEDBACK_BROKER", "")
+FEEDBACK_PORT = int(os.getenv("FEEDBACK_PORT", "1883"))
+FEEDBACK_TOPIC = os.getenv("FEEDBACK_TOPIC", "control/cluster")
+
 PROMQL_30S_CPU = r'''1 - avg by (instance)(rate(node_cpu_seconds_total{mode="idle"}[30s]))'''
 
 app = FastAPI(title="Posture Controller (Ranker)")
 _last_state: Dict = {}
 
+# Ranker memory across ticks
+_ewma_cpu: Dict[str, float] = {}       # node -> smoothed utilization (0..1)
+_ewma_misses: Dict[str, int] = {}      # node -> consecutive scrapes without a sample
+_rank_order: List[str] = []            # current eligible order, rank 1 first
+_rank_changed_at: Dict[str, float] = {}  # node -> monotonic time of last rank change
+_rank_reason: Dict[str, str] = {}      # node -> why its rank last changed
+
 @app.get("/healthz")
 def healthz():
-    return {"ok": True, "threshold": CPU_THRESHOLD, "excluded": sorted(EXCLUDE_NODES)}
+    return {"ok": True, "threshold": CPU_THRESHOLD, "excluded": sorted(EXCLUDE_NODES),
+            "ewma_alpha": EWMA_ALPHA, "rank_min_delta": RANK_MIN_DELTA, "rank_dwell_s": RANK_DWELL_SECONDS}
 
 @app.get("/last")
 def last():
@@ -47,9 +70,9 @@ def load_kube():
     config.load_kube_config()  # running on NUC
     return client.CoreV1Api()
 
-def ip_to_nodename_map(v1: client.CoreV1Api) -> Dict[str, str]:
+def ip_to_nodename_map(nodes: List[client.V1Node]) -> Dict[str, str]:
     mapping: Dict[str, str] = {}
-    for n in v1.list_node().items:
+    for n in nodes:
         name = n.metadata.name
         addrs = n.status.addresses or []
         for a in addrs:
@@ -58,23 +81,123 @@ def ip_to_nodename_map(v1: client.CoreV1Api) -> Dict[str, str]:
         mapping[name] = name  # allow direct name match
     return mapping
 
-def label_node(v1: client.CoreV1Api, node: str, key: str, value: str):
-    body = {"metadata": {"labels": {key: value}}}
+def parse_cpu_quantity(q) -> float:
+    """'8' -> 8.0, '7500m' -> 7.5 (Kubernetes CPU quantity)."""
+    s = str(q or "0").strip()
+    if s.endswith("m"):
+        return float(s[:-1]) / 1000.0
+    return float(s)
+
+def node_cores_map(nodes: List[client.V1Node]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for n in nodes:
+        alloc = (n.status.allocatable or {}) if n.status else {}
+        try:
+            out[n.metadata.name] = parse_cpu_quantity(alloc.get("cpu"))
+        except ValueError:
+            out[n.metadata.name] = 0.0
+    return out
+
+def apply_node_labels(v1: client.CoreV1Api, node: str, eligible: str, rank: str, current: Dict[str, str]):
+    """Write posture/eligible + posture/rank in one patch, skipping nodes whose labels (current) already match."""
+    if current.get("posture/eligible") == eligible and current.get("posture/rank") == rank:
+        return
+    body = {"metadata": {"labels": {"posture/eligible": eligible, "posture/rank": rank}}}
     v1.patch_node(node, body)
 
+def update_ewma(cpu_by_node: Dict[str, float], k8s_nodes: set) -> Dict[str, float]:
+    """
+    Fold the latest 30s sample into the per-node EWMA. A node missing from one scrape keeps
+    its previous value; it is forgotten after EWMA_MAX_MISSES misses in a row or as soon as
+    it leaves the cluster.
+    """
+    for node, val in cpu_by_node.items():
+        prev = _ewma_cpu.get(node)
+        _ewma_cpu[node] = val if prev is None else EWMA_ALPHA * val + (1.0 - EWMA_ALPHA) * prev
+        _ewma_misses.pop(node, None)
+    for node in list(_ewma_cpu):
+        if node in cpu_by_node:
+            continue
+        _ewma_misses[node] = _ewma_misses.get(node, 0) + 1
+        if node not in k8s_nodes or _ewma_misses[node] > EWMA_MAX_MISSES:
+            del _ewma_cpu[node]
+            del _ewma_misses[node]
+    return dict(_ewma_cpu)
+
+def stable_rank(prev_order: List[str], scores: Dict[str, float], now: float) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Returns (order, reasons). Higher score ranks first, but:
+      - nodes keep their previous relative order unless the lower one leads by > RANK_MIN_DELTA
+      - a node whose rank changed less than RANK_DWELL_SECONDS ago is not moved by score
+    Newly eligible nodes are inserted by score; ineligible nodes drop out.
+    """
+    reasons: Dict[str, str] = {}
+    order = [n for n in prev_order if n in scores]
+    for n in prev_order:
+        if n not in scores:
+            reasons[n] = "no longer eligible"
+
+    for n in sorted((n for n in scores if n not in order), key=lambda x: -scores[x]):
+        pos = next((i for i, o in enumerate(order) if scores[n] > scores[o]), len(order))
+        order.insert(pos, n)
+        reasons[n] = f"newly eligible (score={scores[n]:.2f})"
+
+    def dwelling(n: str) -> bool:
+        return now - _rank_changed_at.get(n, float("-inf")) < RANK_DWELL_SECONDS
+
+    swapped = True
+    while swapped:
+        swapped = False
+        for i in range(len(order) - 1):
+            a, b = order[i], order[i + 1]
+            if scores[b] - scores[a] > RANK_MIN_DELTA and not dwelling(a) and not dwelling(b):
+                order[i], order[i + 1] = b, a
+                reasons[b] = f"overtook {a} ({scores[b]:.2f} > {scores[a]:.2f} + {RANK_MIN_DELTA})"
+                reasons.setdefault(a, f"overtaken by {b}")
+                swapped = True
+
+    prev_rank = {n: i for i, n in enumerate(prev_order, start=1)}
+    changes: Dict[str, str] = {}
+    for i, n in enumerate(order, start=1):
+        old = prev_rank.get(n)
+        if old != i:
+            changes[n] = f"{old or '-'} -> {i}: {reasons.get(n, 'shifted by a node above')}"
+    for n in prev_order:
+        if n not in scores:
+            changes[n] = f"{prev_rank[n]} -> -: {reasons[n]}"
+    return order, changes
+
+def feedback_clients():
+    brokers = parse_brokers(FEEDBACK_BROKER, FEEDBACK_PORT)
+    if not brokers:
+        return []
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError:
+        print("[ranker] FEEDBACK_BROKER set but paho-mqtt is not installed; feedback disabled")
+        return []
+    out = []
+    for host, port in brokers:
+        c = mqtt.Client()
+        c.connect_async(host, port, 60)
+        c.loop_start()
+        out.append(c)
+    return out
+
 def ranker_loop():
     global _last_state
     v1 = load_kube()
-
-    # NEW: cache the set of valid Kubernetes node names to avoid 404s
-    def current_node_name_set() -> set:
-        return {n.metadata.name for n in v1.list_node().items}
+    feedback = feedback_clients()
 
     while True:
         try:
             raw_cpu = get_cpu_map_from_prom()
-            ip2name = ip_to_nodename_map(v1)
-            k8s_nodes = current_node_name_set()
+            # one node list per tick: valid names (avoids 404s), addresses, cores and live
+            # labels, so hand edits and re-registered nodes are relabeled on the next tick
+            nodes = v1.list_node().items
+            ip2name = ip_to_nodename_map(nodes)
+            node_labels = {n.metadata.name: dict(n.metadata.labels or {}) for n in nodes}
+            k8s_nodes = set(node_labels)
 
             # Translate Prom hosts -> k8s node names; drop unknown hosts
             cpu_by_node: Dict[str, float] = {}
@@ -83,33 +206,59 @@ def ranker_loop():
                 if node and node in k8s_nodes:
                     cpu_by_node[node] = val
 
-            # Compute eligible set: under threshold, not excluded, and real k8s node
-            eligible_nodes = [n for n, v in cpu_by_node.items()
-                              if v < CPU_THRESHOLD and n not in EXCLUDE_NODES]
+            # Smooth utilization, then score by free cores (capacity-aware, not percent)
+            ewma = update_ewma(cpu_by_node, k8s_nodes)
+            cores = node_cores_map(nodes)
+            free_cores = {n: max(0.0, 1.0 - u) * cores.get(n, 0.0) for n, u in ewma.items()}
+
+            # Compute eligible set: smoothed CPU under threshold, not excluded, and real k8s node
+            eligible_scores = {n: free_cores[n] for n, u in ewma.items()
+                               if u < CPU_THRESHOLD and n not in EXCLUDE_NODES}
 
-            # Sort by CPU ascending for ranks
-            ranked = sorted(((n, cpu_by_node[n]) for n in eligible_nodes), key=lambda x: x[1])
+            # Rank with hysteresis (min delta + dwell) instead of re-sorting every tick
+            now = time.monotonic()
+            order, changes = stable_rank(_rank_order, eligible_scores, now)
+            for n, why in changes.items():
+                _rank_changed_at[n] = now
+                _rank_reason[n] = why
+            for n in set(_rank_changed_at) - k8s_nodes:  # left the cluster
+                _rank_changed_at.pop(n, None)
+                _rank_reason.pop(n, None)
+            _rank_order[:] = order
 
             # Apply labels — ONLY to real nodes and NOT excluded
-            for i, (node, _) in enumerate(ranked, start=1):
-                label_node(v1, node, "posture/eligible", "true")
-                label_node(v1, node, "posture/rank", str(i))
+            for i, node in enumerate(order, start=1):
+                apply_node_labels(v1, node, "true", str(i), node_labels[node])
 
             # For all other *real* nodes (including excluded or over-threshold):
-            for node in (k8s_nodes - {n for n, _ in ranked}):
+            for node in (k8s_nodes - set(order)):
                 # Skip labeling excluded nodes entirely (don’t touch control plane)
                 if node in EXCLUDE_NODES:
                     continue
-                label_node(v1, node, "posture/eligible", "false")
-                label_node(v1, node, "posture/rank", "9999")
+                apply_node_labels(v1, node, "false", "9999", node_labels[node])
 
             _last_state = {
-                "eligible_count": len(ranked),
-                "eligible_nodes": [n for n, _ in ranked],
+                "eligible_count": len(order),
+                "eligible_nodes": list(order),
                 "excluded": sorted(EXCLUDE_NODES),
                 "cpu_by_node": {n: round(v, 4) for n, v in sorted(cpu_by_node.items())},
+                "ewma_cpu_by_node": {n: round(v, 4) for n, v in sorted(ewma.items())},
+                "cores_by_node": {n: cores.get(n, 0.0) for n in sorted(ewma)},
+                "free_cores_by_node": {n: round(v, 3) for n, v in sorted(free_cores.items())},
+                "rank_changes": changes,
+                "last_rank_reason": {n: _rank_reason[n] for n in sorted(_rank_reason)},
+                "dwell_remaining_s": {n: round(max(0.0, RANK_DWELL_SECONDS - (now - _rank_changed_at[n])), 1)
+                                      for n in order if n in _rank_changed_at},
             }
-            print(f"[ranker] eligible={len(ranked)} nodes -> {', '.join(_last_state['eligible_nodes'])}")
+            if feedback:
+                report = json.dumps({
+                    "from": "controller", "overload": not order, "eligible": len(order),
+                    "max_ewma_cpu": round(max(ewma.values()), 4) if ewma else None, "ts": time.time()})
+                for c in feedback:
+                    c.publish(FEEDBACK_TOPIC, report)
+            for n, why in changes.items():
+                print(f"[ranker] rank {n}: {why}")
+            print(f"[ranker] eligible={len(order)} nodes -> {', '.join(_last_state['eligible_nodes'])}")
 
         except Exception as e:
             print(f"[ranker] error: {e}")
@@ -7,6 +7,7 @@
 # Core logic: "allowed" = number of nodes whose 30s CPU avg is below CPU_THRESHOLD,
 #             EXCLUDING any nodes listed in EXCLUDE_NODES (e.g., control plane).
 
+import json
 import os
 import threading
 import time
@@ -21,6 +22,7 @@ import external_scaler_pb2 as pb2
 import external_scaler_pb2_grpc as pb2_grpc
 
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 import uvicorn
 
 # --------------- Config ---------------
@@ -35,6 +37,11 @@ EXCLUDE_NODES = set(
     s.strip() for s in os.getenv("EXCLUDE_NODES", "localhost").split(",") if s.strip()
 )
 
+# How often the background refresher re-evaluates "allowed" for /allowed/stream subscribers
+ALLOWED_REFRESH_SECONDS = float(os.getenv("ALLOWED_REFRESH_SECONDS", "1"))
+# Keep-alive line interval on /allowed/stream when nothing changes
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+
 # 30s CPU utilization per node (1 - idle)
 PROMQL_30S_CPU = r'''1 - avg by (instance)(rate(node_cpu_seconds_total{mode="idle"}[30s]))'''
 
@@ -75,6 +82,43 @@ def compute_allowed_and_eligible() -> Tuple[int, List[str], Dict[str, float]]:
     eligible = [n for n in eligible if n not in EXCLUDE_NODES]
     return len(eligible), sorted(eligible), cpu_map
 
+# --------------- Allowed-count change feed ---------------
+class AllowedFeed:
+    """
+    Latest allowed/eligible snapshot plus a version counter.
+    A background thread refreshes it; subscribers block until the version moves.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._version = 0
+        self._snapshot: Dict = {}
+
+    def publish(self, allowed: int, eligible: List[str]):
+        with self._cond:
+            if self._snapshot.get("allowed") == allowed and self._snapshot.get("eligible") == eligible:
+                return
+            self._version += 1
+            self._snapshot = {"allowed": allowed, "eligible": eligible, "version": self._version,
+                              "ts": time.time()}
+            self._cond.notify_all()
+
+    def wait_newer(self, version: int, timeout: float) -> Dict:
+        """Return the snapshot once its version exceeds `version`, or the current one after timeout."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._version > version, timeout=timeout)
+            return dict(self._snapshot)
+
+_allowed_feed = AllowedFeed()
+
+def run_allowed_refresher():
+    while True:
+        try:
+            allowed, elig, _ = compute_allowed_and_eligible()
+            _allowed_feed.publish(allowed, elig)
+        except Exception as e:
+            print(f"[feed] refresh error: {e}")
+        time.sleep(ALLOWED_REFRESH_SECONDS)
+
 # --------------- gRPC External Scaler (KEDA) ---------------
 class ExternalScaler(pb2_grpc.ExternalScalerServicer):
     def IsActive(self, request, context):
@@ -137,6 +181,23 @@ def allowed():
     allowed, elig, _ = compute_allowed_and_eligible()
     return {"allowed": allowed, "eligible": elig, "threshold": CPU_THRESHOLD, "excluded": sorted(EXCLUDE_NODES)}
 
+@app.get("/allowed/stream")
+def allowed_stream():
+    """
+    NDJSON feed: one line immediately, then one per allowed/eligible change.
+    Lines with "heartbeat": true are keep-alives carrying the current snapshot.
+    """
+    def gen():
+        seen = 0
+        while True:
+            snap = _allowed_feed.wait_newer(seen, timeout=STREAM_HEARTBEAT_SECONDS)
+            if not snap:
+                continue
+            heartbeat = snap["version"] <= seen
+            seen = snap["version"]
+            yield json.dumps({**snap, "heartbeat": heartbeat}) + "\n"
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
+
 def run_grpc():
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
     pb2_grpc.add_ExternalScalerServicer_to_server(ExternalScaler(), server)
@@ -152,4 +213,5 @@ def run_http():
 if __name__ == "__main__":
     t = threading.Thread(target=run_grpc, daemon=True)
     t.start()
+    threading.Thread(target=run_allowed_refresher, daemon=True).start()
     run_http()
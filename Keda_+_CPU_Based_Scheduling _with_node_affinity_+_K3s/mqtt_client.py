@@ -0,0 +1,135 @@
+# mqtt_client.py — MQTT client construction shared by the analyzers.
+#
+# MQTT_PROTOCOL=5 (default) connects with MQTT v5; "3.1.1" keeps the old protocol for
+# brokers that predate v5. SHARE_GROUP=<name> turns every subscription into a shared
+# subscription ($share/<name>/<topic>): the broker hands each message to ONE member of
+# the group, so N analyzer pods load-balance one camera stream instead of each
+# receiving a copy. Leave it empty for fan-out (every subscriber gets every frame),
+# which is what the replication experiments use once the Pi publishes a single copy
+# (see Pi_Replications REPLICATION_MODE and MQTT_server_script/replication_bridge.py).
+#
+# Callbacks written as on_connect(client, userdata, flags, rc, properties=None) and
+# on_message(client, userdata, msg) work under both protocols.
+#
+# With several brokers (MQTT_BROKERS / MQTT_BROKERS_FILE, see mqtt_sharding.py)
+# ClientGroup holds one client per broker the subscribed cameras can be sharded to and
+# is used in place of a single client.
+import os
+import logging
+import threading
+from typing import Dict, Iterable
+
+import paho.mqtt.client as mqtt
+
+import mqtt_sharding
+
+LOGGER = logging.getLogger("mqtt_client")
+
+MQTT_PROTOCOL = os.environ.get("MQTT_PROTOCOL", "5")
+SHARE_GROUP = os.environ.get("SHARE_GROUP", "")
+
+def protocol() -> int:
+    return mqtt.MQTTv5 if MQTT_PROTOCOL.strip() in ("5", "v5", "5.0") else mqtt.MQTTv311
+
+def make_client(client_id: str = "") -> mqtt.Client:
+    return mqtt.Client(client_id=client_id, protocol=protocol())
+
+def connect(client: mqtt.Client, host: str, port: int, keepalive: int = 60):
+    if protocol() == mqtt.MQTTv5:
+        client.connect(host, port, keepalive, clean_start=True)
+    else:
+        client.connect(host, port, keepalive)
+
+def subscription(topic: str) -> str:
+    """Topic filter to subscribe with: shared when SHARE_GROUP is set."""
+    if not SHARE_GROUP or topic.startswith("$share/"):
+        return topic
+    return f"$share/{SHARE_GROUP}/{topic}"
+
+def connected(rc) -> bool:
+    """rc is an int (v3.1.1) or a ReasonCodes object (v5)."""
+    return getattr(rc, "value", rc) == 0
+
+class ClientGroup:
+    """
+    Looks like one paho client to the analyzers: set on_connect / on_message, connect(),
+    loop_start(), publish(), loop_stop(), disconnect(). Every member subscribes to all of
+    the analyzer's topics (on_connect runs per broker); topics whose camera is sharded
+    elsewhere simply stay quiet until that camera fails over here.
+    """
+    def __init__(self, topics: Iterable[str], host: str, port: int, client_id: str = ""):
+        self.topics = list(topics)
+        self.client_id = client_id
+        self.keepalive = 60
+        self.on_connect = None
+        self.on_message = None
+        self.clients: Dict[mqtt_sharding.Broker, mqtt.Client] = {}
+        self.looping = False
+        self.lock = threading.Lock()
+        self.watcher = mqtt_sharding.RingWatcher(host, port, self._rebalance)
+
+    def _add(self, broker) -> mqtt.Client:
+        c = make_client(self.client_id)
+        c.on_connect = self.on_connect
+        c.on_message = self.on_message
+        self.clients[broker] = c
+        return c
+
+    def connect(self, keepalive: int = 60):
+        """Blocking connect to every broker; raises only if none is reachable."""
+        self.keepalive = keepalive
+        brokers = sorted(self.watcher.ring.brokers_for(self.topics))
+        errors = []
+        for b in brokers:
+            c = self._add(b)
+            try:
+                connect(c, b[0], b[1], keepalive)
+            except OSError as e:
+                errors.append(e)
+                LOGGER.warning("⚠️ MQTT %s unreachable (%s); retrying in the background", mqtt_sharding.label(b), e)
+                c.connect_async(b[0], b[1], keepalive)
+        if len(errors) == len(brokers):
+            raise errors[0]
+        if len(brokers) > 1:
+            LOGGER.info("🔀 Sharded MQTT: %s", [mqtt_sharding.label(b) for b in brokers])
+
+    def _rebalance(self, ring: mqtt_sharding.BrokerRing):
+        wanted = ring.brokers_for(self.topics)
+        with self.lock:
+            for b in wanted - set(self.clients):
+                c = self._add(b)
+                c.connect_async(b[0], b[1], self.keepalive)
+                if self.looping:
+                    c.loop_start()
+            for b in set(self.clients) - wanted:
+                c = self.clients.pop(b)
+                c.disconnect()
+                c.loop_stop()
+
+    def loop_start(self):
+        with self.lock:
+            for c in self.clients.values():
+                c.loop_start()
+            self.looping = True
+        self.watcher.start()
+
+    def loop_stop(self):
+        self.watcher.stop()
+        with self.lock:
+            for c in self.clients.values():
+                c.loop_stop()
+            self.looping = False
+
+    def disconnect(self):
+        with self.lock:
+            for c in self.clients.values():
+                c.disconnect()
+
+    def publish(self, topic: str, payload, qos: int = 0):
+        """To every connected candidate broker of the topic's camera (control messages are
+        tiny; the publisher listens on whichever one it is attached to)."""
+        with self.lock:
+            for b in self.watcher.ring.owners(mqtt_sharding.shard_key(topic)):
+                c = self.clients.get(b)
+                if c is not None and c.is_connected():
+                    c.publish(topic, payload, qos=qos)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# pack_runner.py — run several analyzer scripts inside one pod (packed wave release).
+#
+#   python /app/pack_runner.py Images_From_Pi1.py Images_From_Pi1_3.py ...
+#
+# NUM_WORKERS (set by queue_releaser from the node's free cores) is the pool size
+# for EACH script. Exits non-zero if any script fails so the Job reports failure.
+#
+# The runner owns READY_PORT: script i serves its own endpoints on READY_PORT + 1 + i,
+# and the runner's /ready is 200 only once every script is ready. /metrics needs no
+# merging — the scripts share PROMETHEUS_MULTIPROC_DIR, so one render covers them all.
+import os, json, signal, subprocess, sys, threading
+import urllib.error, urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, APP_DIR)
+import analyzer_metrics  # sets PROMETHEUS_MULTIPROC_DIR before the scripts start
+
+READY_PORT = int(os.getenv("READY_PORT", "8081"))
+
+def child_status(port: int, path: str):
+    """(HTTP status, JSON body) from one script's endpoint; (None, None) if it does not answer."""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=2) as r:
+            code, data = r.status, r.read()
+    except urllib.error.HTTPError as e:  # 503 while the script is still warming up
+        code, data = e.code, e.read()
+    except OSError:
+        return None, None
+    try:
+        return code, json.loads(data or b"{}")
+    except ValueError:
+        return code, {}
+
+def serve(children):
+    """children: [(script, port)]. Combined /ready, /startup, /healthz, /metrics on READY_PORT."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/ready") or self.path.startswith("/startup"):
+                path = "/ready" if self.path.startswith("/ready") else "/startup"
+                per_script = {}
+                for script, port in children:
+                    code, body = child_status(port, path)
+                    per_script[script] = body if body is not None else {"ready": False, "error": "no answer"}
+                    per_script[script]["status"] = code
+                ok = all(b["status"] == 200 for b in per_script.values())
+                if path == "/ready":
+                    self._send(200 if ok else 503, {"ready": ok, "scripts": per_script})
+                else:
+                    self._send(200, {"scripts": per_script})
+            elif self.path.startswith("/healthz"):
+                self._send(200, {"ok": True})
+            elif self.path.startswith("/metrics"):
+                code, data, ctype = analyzer_metrics.render()
+                self._write(code, data, ctype)
+            else:
+                self._send(404, {"error": "not found"})
+
+        def _send(self, code, body):
+            self._write(code, json.dumps(body).encode(), "application/json")
+
+        def _write(self, code, data, ctype):
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", READY_PORT), Handler)
+    except OSError as e:
+        print(f"[pack] readiness server not started on :{READY_PORT} ({e})", flush=True)
+        return
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+def main():
+    scripts = sys.argv[1:]
+    if not scripts:
+        print("usage: pack_runner.py SCRIPT [SCRIPT ...]")
+        sys.exit(2)
+
+    procs, children = [], []
+    for i, script in enumerate(scripts):
+        path = script if os.path.isabs(script) else os.path.join(APP_DIR, script)
+        env = dict(os.environ)
+        if READY_PORT > 0:
+            env["READY_PORT"] = str(READY_PORT + 1 + i)
+            children.append((script, READY_PORT + 1 + i))
+        print(f"[pack] starting {path} (NUM_WORKERS={os.getenv('NUM_WORKERS', 'auto')}, "
+              f"READY_PORT={env.get('READY_PORT', '0')})", flush=True)
+        procs.append((script, subprocess.Popen([sys.executable, "-u", path], env=env)))
+    if READY_PORT > 0:
+        serve(children)
+
+    def forward(signum, _frame):
+        for _, p in procs:
+            if p.poll() is None:
+                p.send_signal(signum)
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    failed = []
+    for script, p in procs:
+        rc = p.wait()
+        print(f"[pack] {script} exited rc={rc}", flush=True)
+        if rc != 0:
+            failed.append(script)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+# posture_analysis.py — MediaPipe pose analysis shared by the benchmark scripts
+# (Images_From_Pi1*.py) and analyzer_daemon.py.
+#
+# Functions here run inside ProcessPoolExecutor workers: build pools with make_pool()
+# so every worker process builds its Pose model(s) once; get_pose() keeps one per
+# model_complexity so the level can change per task.
+#
+# Tracking mode: per-stream Pose(static_image_mode=False) instances reuse the previous
+# frame's landmarks instead of re-running person detection. They only make sense when
+# every frame of a stream reaches the SAME worker process, in order — analyzer_daemon
+# pins topics to single-worker pools for that (TRACKING_MODE=true).
+#
+# ROI_ENABLED=true crops each camera's frame to the last known person box and downscales
+# it before inference; landmarks are mapped back to full-frame coordinates so angles,
+# drawing and the DB see the same values as a full-frame pass.
+#
+# Output: OUTPUT_POLICY decides which frames get an annotated JPEG. With
+# defer_output=True the worker only returns metrics + landmarks and the caller hands
+# annotation/encoding to make_annotation_pool() (a niced pool) via annotate_and_save().
+# With ARCHIVE_FORMAT=segments (default) an output folder is a frame_archive.py archive:
+# each process appends JPEGs to its own segment and identical copies are stored once;
+# ARCHIVE_FORMAT=files writes one JPEG per frame as before. Filenames stay the frame ids.
+#
+# cv2 / numpy / mediapipe are imported lazily (load_libs) so a process can connect to
+# MQTT and the DB while the heavy imports happen; make_pool() does them once in the
+# parent and forks, so workers share those pages copy-on-write.
+import os
+import glob
+import time
+import base64
+import logging
+import math as m
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+
+LOGGER = logging.getLogger("posture_analysis")
+
+import analyzer_metrics  # sets PROMETHEUS_MULTIPROC_DIR before any worker is forked
+import trace_context
+from frame_archive import ARCHIVE_FORMAT, archive_for
+
+# 0 (lite), 1 (full), 2 (heavy) or "auto" (pick from a startup calibration, see choose_complexity)
+MODEL_COMPLEXITY_SETTING = os.environ.get("MODEL_COMPLEXITY", "2").strip().lower()
+MODEL_COMPLEXITY = 2 if MODEL_COMPLEXITY_SETTING == "auto" else int(MODEL_COMPLEXITY_SETTING)
+# Node-wide frames/sec the chosen complexity must sustain
+TARGET_FPS = float(os.environ.get("TARGET_FPS", "2"))
+CALIBRATION_IMAGE = os.environ.get("CALIBRATION_IMAGE", "")
+CALIBRATION_RUNS = int(os.environ.get("CALIBRATION_RUNS", "5"))
+# Tracking mode (analyze_payload(..., stream=topic)): a stream silent for longer than this
+# gets a fresh tracker, i.e. full person detection on its next frame
+TRACK_RESET_SECONDS = float(os.environ.get("TRACK_RESET_SECONDS", "2"))
+# ROI stage: crop to the last person box (plus margin) and downscale before inference
+ROI_ENABLED = os.environ.get("ROI_ENABLED", "false").lower() == "true"
+ROI_MARGIN = float(os.environ.get("ROI_MARGIN", "0.25"))        # fraction of box size, each side
+ROI_INPUT_SIZE = int(os.environ.get("ROI_INPUT_SIZE", "384"))   # longer side of the crop fed to Pose
+FULL_INPUT_SIZE = int(os.environ.get("FULL_INPUT_SIZE", "640")) # longer side of full-frame scans
+ROI_RESCAN_SECONDS = float(os.environ.get("ROI_RESCAN_SECONDS", "5"))  # full-frame scan at least this often
+# Which frames get an annotated JPEG: full | sample | bad | metrics (none)
+OUTPUT_POLICY = os.environ.get("OUTPUT_POLICY", "full").strip().lower()
+OUTPUT_SAMPLE_RATE = float(os.environ.get("OUTPUT_SAMPLE_RATE", "0.05"))  # for OUTPUT_POLICY=sample
+ANNOTATE_NICE = int(os.environ.get("ANNOTATE_NICE", "10"))  # niceness of the annotation pool
+# "fork": import libs + warm model files in the parent, then fork workers (default)
+# "spawn": fresh interpreter per worker (slower start, no shared pages)
+POOL_START_METHOD = os.environ.get("POOL_START_METHOD", "fork")
+
+cv2 = None
+np = None
+mp = None
+geometry = None  # posture_geometry (imports numpy)
+
+def load_libs():
+    """Import cv2/numpy/mediapipe on first use; returns seconds spent (0 if already loaded)."""
+    global cv2, np, mp, geometry, font
+    if mp is not None:
+        return 0.0
+    t0 = time.monotonic()
+    import cv2 as _cv2
+    import numpy as _np
+    import mediapipe as _mp
+    import posture_geometry as _geometry
+    cv2, np, mp, geometry = _cv2, _np, _mp, _geometry
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    return time.monotonic() - t0
+
+def warm_model_files(complexity: int = MODEL_COMPLEXITY) -> int:
+    """Read the pose .tflite files once so every worker maps them from page cache; returns bytes."""
+    load_libs()
+    names = {0: "pose_landmark_lite", 1: "pose_landmark_full", 2: "pose_landmark_heavy"}
+    root = os.path.dirname(mp.__file__)
+    paths = glob.glob(os.path.join(root, "modules", "pose_detection", "*.tflite"))
+    paths += glob.glob(os.path.join(root, "modules", "pose_landmark", f"{names.get(complexity, 'pose_landmark_heavy')}.tflite"))
+    total = 0
+    for p in paths:
+        try:
+            with open(p, "rb") as f:
+                total += len(f.read())
+        except OSError:
+            pass
+    return total
+
+# ---------------------------
+# Per-process state (for workers)
+# ---------------------------
+font = None
+colors = {
+    "light_blue": (255, 200, 100),
+    "light_green": (127, 233, 100),
+    "yellow": (0, 255, 255),
+    "pink": (255, 0, 255)
+}
+
+# globals for worker processes (initialized in _worker_init)
+_poses = {}  # model_complexity -> Pose, built on first use
+_trackers = {}  # stream -> {"pose", "complexity", "last_seen"}
+_rois = {}  # camera -> {"box": (x0, y0, x1, y1) or None, "last_full": monotonic}
+_mp_pose = None
+_mp_drawing = None
+_mp_styles = None
+
+def _init_mp_modules():
+    global _mp_pose, _mp_drawing, _mp_styles
+    load_libs()
+    _mp_pose = mp.solutions.pose
+    _mp_drawing = mp.solutions.drawing_utils
+    _mp_styles = mp.solutions.drawing_styles
+
+def _worker_init():
+    _init_mp_modules()
+    get_pose(MODEL_COMPLEXITY)
+
+def _annotator_init():
+    try:
+        os.nice(ANNOTATE_NICE)
+    except (AttributeError, OSError):
+        pass
+    _init_mp_modules()
+
+def get_pose(complexity: int):
+    pose = _poses.get(complexity)
+    if pose is None:
+        pose = _poses[complexity] = _mp_pose.Pose(static_image_mode=True, model_complexity=complexity)
+    return pose
+
+def get_tracker(stream: str, complexity: int):
+    """Tracking-mode Pose for `stream`; returns (pose, fresh) — fresh means it will detect."""
+    now = time.monotonic()
+    t = _trackers.get(stream)
+    if t is not None and (t["complexity"] != complexity or now - t["last_seen"] > TRACK_RESET_SECONDS):
+        t["pose"].close()
+        t = None
+    fresh = t is None
+    if fresh:
+        t = _trackers[stream] = {
+            "pose": _mp_pose.Pose(static_image_mode=False, model_complexity=complexity, smooth_landmarks=True),
+            "complexity": complexity,
+        }
+    t["last_seen"] = now
+    return t["pose"], fresh
+
+# ---------------------------
+# ROI crop / downscale
+# ---------------------------
+def select_region(camera: str, w: int, h: int, allow_crop: bool = True):
+    """(x0, y0, x1, y1) in full-frame pixels: the last person box, or the whole frame on rescan."""
+    st = _rois.setdefault(camera, {"box": None, "last_full": 0.0})
+    now = time.monotonic()
+    if not allow_crop or st["box"] is None or now - st["last_full"] >= ROI_RESCAN_SECONDS:
+        st["last_full"] = now
+        return (0, 0, w, h)
+    return st["box"]
+
+def prepare_input(img_bgr, region):
+    """Crop + resize in BGR, then convert: the colour conversion only touches the small buffer."""
+    x0, y0, x1, y1 = region
+    crop = img_bgr[y0:y1, x0:x1]
+    full = (x0, y0) == (0, 0) and (x1, y1) == (img_bgr.shape[1], img_bgr.shape[0])
+    limit = FULL_INPUT_SIZE if full else ROI_INPUT_SIZE
+    scale = limit / float(max(crop.shape[:2]))
+    if scale < 1.0:
+        crop = cv2.resize(crop, (max(1, int(crop.shape[1] * scale)), max(1, int(crop.shape[0] * scale))),
+                          interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+
+def remap_landmarks(lms, region, w: int, h: int):
+    """Rewrite crop-normalized landmarks in place as full-frame-normalized ones."""
+    x0, y0, x1, y1 = region
+    cw, ch = x1 - x0, y1 - y0
+    if (cw, ch) == (w, h):
+        return
+    for lm in lms:
+        lm.x = (x0 + lm.x * cw) / w
+        lm.y = (y0 + lm.y * ch) / h
+        lm.z = lm.z * cw / w
+
+def update_roi(camera: str, lms, w: int, h: int, min_visibility: float = 0.5):
+    """Next frame's box from this frame's (full-frame) landmarks; None forces a full scan."""
+    st = _rois.setdefault(camera, {"box": None, "last_full": 0.0})
+    pts = [(lm.x * w, lm.y * h) for lm in lms or () if getattr(lm, "visibility", 0.0) >= min_visibility]
+    if len(pts) < 4:
+        st["box"] = None
+        return
+    xs, ys = [p[0] for p in pts], [p[1] for p in pts]
+    mx = (max(xs) - min(xs)) * ROI_MARGIN
+    my = (max(ys) - min(ys)) * ROI_MARGIN
+    x0, y0 = max(0, int(min(xs) - mx)), max(0, int(min(ys) - my))
+    x1, y1 = min(w, int(max(xs) + mx)), min(h, int(max(ys) + my))
+    st["box"] = (x0, y0, x1, y1) if x1 - x0 >= 32 and y1 - y0 >= 32 else None
+
+# ---------------------------
+# Complexity calibration
+# ---------------------------
+def _calibration_frame():
+    if CALIBRATION_IMAGE:
+        img = cv2.imread(CALIBRATION_IMAGE, cv2.IMREAD_COLOR)
+        if img is not None:
+            return img
+        LOGGER.warning("CALIBRATION_IMAGE %s unreadable; using a synthetic frame", CALIBRATION_IMAGE)
+    # Without a person in frame only the detector runs, so a real capture gives truer numbers
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 255, size=(720, 1280, 3), dtype=np.uint8)
+
+def calibrate(runs: int = CALIBRATION_RUNS):
+    """Seconds per frame for each model_complexity, measured in this worker."""
+    rgb = cv2.cvtColor(_calibration_frame(), cv2.COLOR_BGR2RGB)
+    out = {}
+    for c in (0, 1, 2):
+        pose = get_pose(c)
+        pose.process(rgb)  # first call includes graph start-up
+        t0 = time.perf_counter()
+        for _ in range(max(1, runs)):
+            pose.process(rgb)
+        out[c] = (time.perf_counter() - t0) / max(1, runs)
+    return out
+
+def choose_complexity(sec_per_frame, workers: int, target_fps: float = TARGET_FPS) -> int:
+    """Heaviest model whose node throughput (workers / sec_per_frame) still meets target_fps."""
+    for c in (2, 1, 0):
+        spf = sec_per_frame.get(c)
+        if spf and workers / spf >= target_fps:
+            return c
+    return 0
+
+def resolve_complexity(pool: ProcessPoolExecutor, workers: int) -> int:
+    """MODEL_COMPLEXITY, or with MODEL_COMPLEXITY=auto the calibrated choice."""
+    if MODEL_COMPLEXITY_SETTING != "auto":
+        return MODEL_COMPLEXITY
+    spf = pool.submit(calibrate).result()
+    chosen = choose_complexity(spf, workers)
+    LOGGER.warning("Calibration (s/frame per worker): %s -> model_complexity=%d for %.1f fps on %d workers",
+                   {c: round(v, 4) for c, v in spf.items()}, chosen, TARGET_FPS, workers)
+    return chosen
+
+# ---------------------------
+# Utilities
+# ---------------------------
+def findDistance(x1, y1, x2, y2):
+    return m.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+
+def findAngle(x1, y1, x2, y2):
+    try:
+        a = [x1, y1]; b = [x2, y2]; vertical = [x1, y1 - 100]
+        ab = [b[0] - a[0], b[1] - a[1]]
+        av = [vertical[0] - a[0], vertical[1] - a[1]]
+        dot = ab[0] * av[0] + ab[1] * av[1]
+        mag_ab = m.sqrt(ab[0] ** 2 + ab[1] ** 2)
+        mag_av = m.sqrt(av[0] ** 2 + av[1] ** 2)
+        if mag_ab == 0 or mag_av == 0:
+            return 0
+        cosang = max(-1.0, min(1.0, dot / (mag_ab * mag_av)))
+        ang = m.degrees(m.acos(cosang))
+        return int(ang)
+    except Exception:
+        return 0
+
+def _ready_probe():
+    """Runs once per worker during warm_pool(); the initializer has already built the model."""
+    time.sleep(0.05)  # hold this worker so the next probe lands on another process
+    return os.getpid()
+
+def make_pool(num_workers: int) -> ProcessPoolExecutor:
+    """
+    Pool whose workers inherit the parent's imported libraries (fork-after-load).
+    MediaPipe graphs own native threads that do not survive fork, so each worker still
+    constructs its own Pose in _worker_init — but all workers do it in parallel and
+    without re-importing anything.
+    """
+    if POOL_START_METHOD == "fork":
+        load_libs()
+        warm_model_files()
+    ctx = multiprocessing.get_context(POOL_START_METHOD)
+    return ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx, initializer=_worker_init)
+
+def warm_pool(pool: ProcessPoolExecutor, num_workers: int, timeout: float = None) -> int:
+    """Start every worker and wait until each has built its model; returns distinct workers seen."""
+    futures = [pool.submit(_ready_probe) for _ in range(num_workers)]
+    done, _ = wait(futures, timeout=timeout)
+    return len({f.result() for f in done if not f.exception()})
+
+def decode_image(payload: bytes):
+    load_libs()
+    _, payload = trace_context.unwrap(payload)  # traced payloads carry a header line
+    # try base64 first
+    try:
+        data = base64.b64decode(payload, validate=True)
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if img is not None:
+            return img, "base64"
+    except Exception:
+        pass
+
+    # try raw bytes
+    try:
+        img = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+        if img is not None:
+            return img, "raw"
+    except Exception:
+        pass
+
+    return None, "unknown"
+
+def wants_output(posture_status: str, policy: str = None) -> bool:
+    """Apply OUTPUT_POLICY to one analyzed frame."""
+    policy = OUTPUT_POLICY if policy is None else policy
+    if policy == "full":
+        return True
+    if policy == "bad":
+        return posture_status == "Bad"
+    if policy == "sample":
+        return random.random() < OUTPUT_SAMPLE_RATE
+    return False
+
+def annotate_and_save(frame, landmarks, result, fpath, timings=None):
+    """
+    Draw landmarks/angles for an analyzed frame and store it as JPEG at fpath (in the folder's
+    archive with ARCHIVE_FORMAT=segments); returns True if written.
+    frame: BGR ndarray or the raw MQTT payload. landmarks: full-frame normalized
+    (x, y, z, visibility) tuples from the analysis, or None.
+    timings: optional dict that receives "annotate" and "write" seconds.
+    """
+    t0 = time.perf_counter()
+    if _mp_pose is None:
+        _init_mp_modules()
+    if isinstance(frame, (bytes, bytearray)):
+        frame, _ = decode_image(frame)
+        if frame is None:
+            return False
+    image = frame.copy()
+    status = result.get("posture_status")
+    if result.get("landmarks_detected") and landmarks:
+        from mediapipe.framework.formats import landmark_pb2
+        lm_list = landmark_pb2.NormalizedLandmarkList(landmark=[
+            landmark_pb2.NormalizedLandmark(x=x, y=y, z=z, visibility=v) for x, y, z, v in landmarks
+        ])
+        _mp_drawing.draw_landmarks(
+            image,
+            lm_list,
+            _mp_pose.POSE_CONNECTIONS,
+            landmark_drawing_spec=_mp_styles.get_default_pose_landmarks_style()
+        )
+        cv2.putText(image, f"Neck Angle: {result.get('neck_angle')} deg", (10, 30), font, 1, colors["light_blue"], 2)
+        cv2.putText(image, f"Body Angle: {result.get('body_angle')} deg", (10, 70), font, 1, colors["light_green"], 2)
+        if status == "Bad":
+            cv2.putText(image, "Bad_Posture", (10, 110), font, 1, colors["pink"], 2)
+    elif status == "Insufficient_Landmarks":
+        cv2.putText(image, "Insufficient landmarks/visibility", (10, 30), font, 1, colors["yellow"], 2)
+    else:
+        cv2.putText(image, "No pose landmarks detected", (10, 30), font, 1, colors["yellow"], 2)
+    t1 = time.perf_counter()
+    if ARCHIVE_FORMAT == "segments":
+        ok, buf = cv2.imencode(".jpg", image)
+        if ok:
+            archive_for(os.path.dirname(fpath)).put(os.path.basename(fpath), buf.tobytes())
+        ok = bool(ok)
+    else:
+        ok = bool(cv2.imwrite(fpath, image))
+    if timings is not None:
+        timings["annotate"] = t1 - t0
+        timings["write"] = time.perf_counter() - t1
+    return ok
+
+def make_annotation_pool(num_workers: int = 1) -> ProcessPoolExecutor:
+    """Low-priority pool for annotate_and_save(); niced so it only uses cycles inference leaves idle."""
+    load_libs()
+    ctx = multiprocessing.get_context(POOL_START_METHOD)
+    return ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx, initializer=_annotator_init)
+
+def analyze_and_save(copy_idx, img_bgr, w, h, prefix, unique_id, output_folder, complexity=None, stream=None,
+                     defer_output=False):
+    """
+    Analyze one frame. The JPEG is written inline, or with defer_output=True left to the
+    caller: the result then carries annotate_pending/landmarks and the planned filename.
+    result["timings"] has per-stage seconds (inference, rules, annotate, write).
+    """
+    # Copy & prepare
+    complexity = MODEL_COMPLEXITY if complexity is None else complexity
+    result = {
+        "saved": False,
+        "filename": None,
+        "neck_angle": None,
+        "body_angle": None,
+        "posture_status": "Unknown",
+        "landmarks_detected": False,
+        "model_complexity": complexity,
+        "tracked": False,
+        "roi": False,
+        "annotate_pending": False,
+        "landmarks": None,
+        "timings": {}
+    }
+    timings = result["timings"]
+    try:
+        t0 = time.perf_counter()
+        if stream is None:
+            pose = get_pose(complexity)
+        else:
+            pose, fresh = get_tracker(stream, complexity)
+            result["tracked"] = not fresh
+        if ROI_ENABLED:
+            # a tracker already crops to the person internally; only downscale its input
+            region = select_region(stream or prefix, w, h, allow_crop=stream is None)
+            res = pose.process(prepare_input(img_bgr, region))
+            if res.pose_landmarks:
+                remap_landmarks(res.pose_landmarks.landmark, region, w, h)
+            update_roi(stream or prefix, res.pose_landmarks.landmark if res.pose_landmarks else None, w, h)
+            result["roi"] = region != (0, 0, w, h)
+        else:
+            res = pose.process(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
+        t1 = time.perf_counter()
+        timings["inference"] = t1 - t0
+        analyzer_metrics.inference(complexity, t1 - t0)
+        if res.pose_landmarks:
+            # one (33, 4) array; rules are evaluated in posture_geometry
+            arr = geometry.landmarks_to_array(res.pose_landmarks.landmark)
+            metrics = geometry.posture_metrics(arr, w, h)
+            posture_status = str(geometry.classify(metrics))
+            result["landmarks_detected"] = posture_status != "Insufficient_Landmarks"
+            result.update({
+                "side": str(metrics["side"]),
+                "knee_angle": int(metrics["knee_angle"]),
+                "shoulder_offset": float(metrics["shoulder_offset"]),
+                "side_aligned": bool(geometry.side_aligned(metrics)),
+            })
+            if result["landmarks_detected"]:
+                neck_angle, body_angle = int(metrics["neck_angle"]), int(metrics["body_angle"])
+            else:
+                neck_angle, body_angle = 0, 0
+        else:
+            arr = None
+            neck_angle, body_angle = 0, 0
+            posture_status = "No_Landmarks"
+
+        result.update({
+            "neck_angle": neck_angle,
+            "body_angle": body_angle,
+            "posture_status": posture_status
+        })
+        timings["rules"] = time.perf_counter() - t1
+
+        if wants_output(posture_status):
+            landmarks = arr.tolist() if arr is not None else None
+            fname = f"{prefix}_{unique_id}_{copy_idx + 1}.jpg"
+            if defer_output:
+                result.update({"annotate_pending": True, "landmarks": landmarks, "filename": fname})
+            else:
+                ok = annotate_and_save(img_bgr, landmarks, result, os.path.join(output_folder, fname), timings)
+                result.update({"saved": ok, "filename": fname if ok else None})
+    except Exception as e:
+        # keep result fields as default; log
+        LOGGER.exception("analyze_and_save error: %s", e)
+    return result
+
+def analyze_payload(payload: bytes, prefix, unique_id, output_folder, copy_idx: int = 0, complexity=None,
+                    stream=None, defer_output=False):
+    """
+    Decode an MQTT payload inside the worker and analyze it (keeps decoded frames off the pipe).
+    stream: topic name to analyze in tracking mode (caller must pin the topic to this worker).
+    """
+    t0 = time.perf_counter()
+    img, enc = decode_image(payload)
+    decode_s = time.perf_counter() - t0
+    if img is None:
+        LOGGER.error("Could not decode image for %s (enc=%s)", prefix, enc)
+        return {"saved": False, "filename": None, "neck_angle": None, "body_angle": None,
+                "posture_status": "Undecodable", "landmarks_detected": False, "model_complexity": complexity,
+                "tracked": False, "roi": False, "annotate_pending": False, "landmarks": None,
+                "timings": {"decode": decode_s}}
+    h, w = img.shape[:2]
+    result = analyze_and_save(copy_idx, img, w, h, prefix, unique_id, output_folder, complexity, stream,
+                              defer_output)
+    result["timings"]["decode"] = decode_s
+    return result
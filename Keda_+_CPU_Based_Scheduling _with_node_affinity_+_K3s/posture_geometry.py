@@ -0,0 +1,118 @@
+# posture_geometry.py — vectorized landmark geometry and posture rules.
+#
+# Landmarks are (33, 4) float64 arrays of [x, y, z, visibility] (MediaPipe order,
+# normalized to the frame); a batch is (N, 33, 4). Every function works on either,
+# so N analyzed frames are classified with a handful of NumPy ops instead of
+# per-landmark Python attribute lookups.
+#
+# Angles follow posture_analysis.findAngle: degrees between the segment a->b and the
+# upward vertical through a, on integer pixel coordinates, truncated to int. Everything
+# stays float64 (Python float) so pixels and angles match the scalar code exactly.
+import os
+from typing import Dict
+
+import numpy as np
+
+# MediaPipe Pose landmark indices used by the rules
+NOSE = 0
+LEFT_EAR, RIGHT_EAR = 7, 8
+LEFT_SHOULDER, RIGHT_SHOULDER = 11, 12
+LEFT_HIP, RIGHT_HIP = 23, 24
+LEFT_KNEE, RIGHT_KNEE = 25, 26
+NUM_LANDMARKS = 33
+
+SIDES = {
+    "left": {"ear": LEFT_EAR, "shoulder": LEFT_SHOULDER, "hip": LEFT_HIP, "knee": LEFT_KNEE},
+    "right": {"ear": RIGHT_EAR, "shoulder": RIGHT_SHOULDER, "hip": RIGHT_HIP, "knee": RIGHT_KNEE},
+}
+
+# ---------------------------
+# Rule set (env overrides); defaults reproduce the original left-side rule
+# ---------------------------
+RULE_SIDE = os.environ.get("RULE_SIDE", "left").strip().lower()   # left | right | auto (most visible side)
+NECK_MIN = float(os.environ.get("RULE_NECK_MIN", "10"))
+NECK_MAX = float(os.environ.get("RULE_NECK_MAX", "50"))
+BODY_MAX = float(os.environ.get("RULE_BODY_MAX", "20"))
+# Optional hip->knee limit (degrees from vertical); <= 0 disables
+KNEE_MAX = float(os.environ.get("RULE_KNEE_MAX", "0"))
+# Shoulder offset (px) above which the camera is not side-on and angles are unreliable
+SHOULDER_OFFSET_MAX = float(os.environ.get("RULE_SHOULDER_OFFSET_MAX", "100"))
+MIN_REQUIRED_VISIBILITY = float(os.environ.get("RULE_MIN_REQUIRED_VISIBILITY", "0.01"))
+HIGH_VISIBILITY = float(os.environ.get("RULE_HIGH_VISIBILITY", "0.9"))
+MIN_HIGH_VISIBILITY_COUNT = int(os.environ.get("RULE_MIN_HIGH_VISIBILITY_COUNT", "20"))
+
+def landmarks_to_array(landmarks) -> np.ndarray:
+    """MediaPipe landmark list (or iterable of (x, y, z, visibility)) -> (33, 4) float64."""
+    if landmarks is None:
+        return np.zeros((NUM_LANDMARKS, 4), dtype=np.float64)
+    if hasattr(landmarks, "landmark"):
+        landmarks = landmarks.landmark
+    rows = [(lm.x, lm.y, lm.z, lm.visibility) if hasattr(lm, "x") else tuple(lm) for lm in landmarks]
+    return np.asarray(rows, dtype=np.float64).reshape(-1, 4)
+
+def stack_landmarks(items) -> np.ndarray:
+    """Batch of landmark lists (None for frames without a pose) -> (N, 33, 4); missing rows are zeros."""
+    return np.stack([landmarks_to_array(x) for x in items]) if items else np.zeros((0, NUM_LANDMARKS, 4), np.float64)
+
+def to_pixels(arr: np.ndarray, w: int, h: int) -> np.ndarray:
+    """(..., 33, 4) -> (..., 33, 2) integer pixel coordinates (truncated like int())."""
+    return np.trunc(arr[..., :2].astype(np.float64) * np.array([w, h], dtype=np.float64))
+
+def vertical_angle(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Degrees between a->b and the upward vertical at a; (..., 2) inputs; 0 where a == b."""
+    d = b - a
+    # same operations as findAngle (vertical of length 100) so rounding matches bit for bit
+    mag = np.sqrt(d[..., 0] ** 2 + d[..., 1] ** 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cos = np.where(mag > 0, (-100.0 * d[..., 1]) / (mag * 100.0), 1.0)
+    return np.trunc(np.degrees(np.arccos(np.clip(cos, -1.0, 1.0))))
+
+def distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Like posture_analysis.findDistance."""
+    d = b - a
+    return np.sqrt(d[..., 0] ** 2 + d[..., 1] ** 2)
+
+def _side_metrics(px: np.ndarray, vis: np.ndarray, side: str) -> Dict[str, np.ndarray]:
+    s = SIDES[side]
+    ear, sh, hip, knee = px[..., s["ear"], :], px[..., s["shoulder"], :], px[..., s["hip"], :], px[..., s["knee"], :]
+    return {
+        "neck_angle": vertical_angle(sh, ear),
+        "body_angle": vertical_angle(hip, sh),
+        "knee_angle": vertical_angle(hip, knee),
+        "required_visible": (vis[..., [s["ear"], s["shoulder"], s["hip"]]] >= MIN_REQUIRED_VISIBILITY).all(axis=-1),
+        "side_visibility": vis[..., [s["ear"], s["shoulder"], s["hip"]]].mean(axis=-1),
+    }
+
+def posture_metrics(arr: np.ndarray, w: int, h: int, side: str = None) -> Dict[str, np.ndarray]:
+    """
+    All rule inputs for (33, 4) or (N, 33, 4) landmarks: per-side angles, the chosen side's
+    neck/body/knee angle, shoulder offset (px) and visibility counts.
+    """
+    side = RULE_SIDE if side is None else side
+    px = to_pixels(arr, w, h)
+    vis = arr[..., 3]
+    left = _side_metrics(px, vis, "left")
+    right = _side_metrics(px, vis, "right")
+    if side == "auto":
+        use_right = right["side_visibility"] > left["side_visibility"]
+    else:
+        use_right = np.full(vis.shape[:-1], side == "right")
+    out = {k: np.where(use_right, right[k], left[k]) for k in left}
+    out.update({f"{k}_left": v for k, v in left.items() if k.endswith("angle")})
+    out.update({f"{k}_right": v for k, v in right.items() if k.endswith("angle")})
+    out["side"] = np.where(use_right, "right", "left")
+    out["shoulder_offset"] = distance(px[..., LEFT_SHOULDER, :], px[..., RIGHT_SHOULDER, :])
+    out["high_visibility_count"] = (vis >= HIGH_VISIBILITY).sum(axis=-1)
+    return out
+
+def classify(metrics: Dict[str, np.ndarray]) -> np.ndarray:
+    """Posture status per frame: Good | Bad | Insufficient_Landmarks."""
+    usable = metrics["required_visible"] & (metrics["high_visibility_count"] >= MIN_HIGH_VISIBILITY_COUNT)
+    good = (metrics["neck_angle"] > NECK_MIN) & (metrics["neck_angle"] < NECK_MAX) & (metrics["body_angle"] < BODY_MAX)
+    if KNEE_MAX > 0:
+        good &= metrics["knee_angle"] <= KNEE_MAX
+    return np.where(usable, np.where(good, "Good", "Bad"), "Insufficient_Landmarks")
+
+def side_aligned(metrics: Dict[str, np.ndarray]) -> np.ndarray:
+    """True where shoulders overlap enough (side-on camera) for the angles to be trusted."""
+    return metrics["shoulder_offset"] <= SHOULDER_OFFSET_MAX
@@ -0,0 +1,184 @@
+# posture_rollups.py — per-minute / per-hour aggregates of posture_log for dashboards.
+#
+# posture_rollup_minute and posture_rollup_hour hold one row per
+# (pi_id, bucket, node, posture_status): frames, frames with landmarks, angle sums and
+# analysis latency (analyzed_time - received_time). A statement-level AFTER INSERT trigger
+# on posture_log folds every inserted batch into both tables with an upsert, so they stay
+# current without a batch job. Buckets come from received_time, which means late rows
+# (e.g. frames replayed from a Pi's outbox) land in their original minute.
+#
+# Views for dashboards, one row per (bucket, pi_id):
+#   posture_minute / posture_hour   frames, good, bad, good_ratio, mean_neck_angle,
+#                                   mean_body_angle, mean_latency_s, max_latency_s
+# Query the rollup tables directly to break down by node or status. Raw rows stay in
+# posture_log (see posture_schema.py) for drill-down over short ranges; retention drops
+# old raw partitions but leaves their rollup rows alone.
+#
+# ensure_rollups(cur) is called from posture_schema.ensure_schema(). When it creates the
+# rollup tables it also folds in every existing posture_log row, so dashboards keep their
+# history. To rebuild by hand (e.g. after editing rows):
+#   python posture_rollups.py backfill [SINCE]            (e.g. 2025-01-01; default: all)
+#   python posture_rollups.py query hour pi1 [SINCE [UNTIL]]
+import os
+import sys
+import csv
+from typing import List, Optional, Tuple
+
+ROLLUPS_ENABLED = os.environ.get("ROLLUPS_ENABLED", "true").lower() == "true"
+
+RESOLUTIONS = ("minute", "hour")
+
+_TABLE = """
+CREATE TABLE IF NOT EXISTS posture_rollup_{res} (
+    pi_id TEXT NOT NULL,
+    bucket TIMESTAMPTZ NOT NULL,
+    node TEXT NOT NULL,
+    posture_status TEXT NOT NULL,
+    frames BIGINT NOT NULL,
+    angle_frames BIGINT NOT NULL,
+    sum_neck BIGINT NOT NULL,
+    sum_body BIGINT NOT NULL,
+    sum_latency_s DOUBLE PRECISION NOT NULL,
+    max_latency_s DOUBLE PRECISION,
+    PRIMARY KEY (pi_id, bucket, node, posture_status)
+);
+"""
+
+# aggregate of {src} rows into {res} buckets; ORDER BY keeps lock order stable across writers
+_AGGREGATE = """
+SELECT COALESCE(pi_id, 'unknown'), date_trunc('{res}', received_time), COALESCE(processed_by, 'unknown'),
+       COALESCE(posture_status, 'Unknown'),
+       COUNT(*),
+       COUNT(*) FILTER (WHERE landmarks_detected),
+       COALESCE(SUM(neck_angle) FILTER (WHERE landmarks_detected), 0),
+       COALESCE(SUM(body_angle) FILTER (WHERE landmarks_detected), 0),
+       COALESCE(SUM(EXTRACT(EPOCH FROM analyzed_time - received_time)), 0),
+       MAX(EXTRACT(EPOCH FROM analyzed_time - received_time))
+FROM {src}
+WHERE received_time IS NOT NULL {where}
+GROUP BY 1, 2, 3, 4
+ORDER BY 1, 2, 3, 4
+"""
+
+_UPSERT = """
+INSERT INTO posture_rollup_{res} AS r
+    (pi_id, bucket, node, posture_status, frames, angle_frames, sum_neck, sum_body, sum_latency_s, max_latency_s)
+{aggregate}
+ON CONFLICT (pi_id, bucket, node, posture_status) DO UPDATE SET
+    frames = r.frames + EXCLUDED.frames,
+    angle_frames = r.angle_frames + EXCLUDED.angle_frames,
+    sum_neck = r.sum_neck + EXCLUDED.sum_neck,
+    sum_body = r.sum_body + EXCLUDED.sum_body,
+    sum_latency_s = r.sum_latency_s + EXCLUDED.sum_latency_s,
+    max_latency_s = GREATEST(r.max_latency_s, EXCLUDED.max_latency_s);
+"""
+
+_VIEW = """
+CREATE OR REPLACE VIEW posture_{res} AS
+SELECT bucket, pi_id,
+       SUM(frames) AS frames,
+       COALESCE(SUM(frames) FILTER (WHERE posture_status = 'Good'), 0) AS good,
+       COALESCE(SUM(frames) FILTER (WHERE posture_status = 'Bad'), 0) AS bad,
+       (SUM(frames) FILTER (WHERE posture_status = 'Good'))::float
+           / NULLIF(SUM(frames) FILTER (WHERE posture_status IN ('Good', 'Bad')), 0) AS good_ratio,
+       SUM(sum_neck)::float / NULLIF(SUM(angle_frames), 0) AS mean_neck_angle,
+       SUM(sum_body)::float / NULLIF(SUM(angle_frames), 0) AS mean_body_angle,
+       SUM(sum_latency_s) / NULLIF(SUM(frames), 0) AS mean_latency_s,
+       MAX(max_latency_s) AS max_latency_s
+FROM posture_rollup_{res}
+GROUP BY bucket, pi_id;
+"""
+
+def _upsert(res: str, src: str, where: str = "") -> str:
+    return _UPSERT.format(res=res, aggregate=_AGGREGATE.format(res=res, src=src, where=where))
+
+def ensure_rollups(cur):
+    """Rollup tables, views and trigger; safe to run from every pod."""
+    if not ROLLUPS_ENABLED:
+        return
+    # analyzers start together; serialize the DDL instead of racing on CREATE OR REPLACE
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('posture_rollups'))")
+    cur.execute("SELECT to_regclass('posture_rollup_hour') IS NULL")
+    first = cur.fetchone()[0]
+    for res in RESOLUTIONS:
+        cur.execute(_TABLE.format(res=res))
+        cur.execute(_VIEW.format(res=res))
+    cur.execute(
+        "CREATE OR REPLACE FUNCTION posture_rollup_insert() RETURNS trigger LANGUAGE plpgsql AS $$\n"
+        "BEGIN\n" + "".join(_upsert(res, "new_rows") for res in RESOLUTIONS) + "RETURN NULL;\nEND $$;"
+    )
+    cur.execute(
+        """
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                           WHERE tgname = 'posture_rollup' AND tgrelid = 'posture_log'::regclass) THEN
+                CREATE TRIGGER posture_rollup AFTER INSERT ON posture_log
+                    REFERENCING NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION posture_rollup_insert();
+            END IF;
+        END $$;
+        """
+    )
+    if first:
+        # same transaction as the trigger: no insert is counted twice or missed
+        backfill(cur)
+
+def backfill(cur, since: Optional[str] = None):
+    """Recompute rollups from raw rows (all, or buckets from `since` on); blocks inserts meanwhile."""
+    cur.execute("LOCK TABLE posture_log IN SHARE MODE")
+    for res in RESOLUTIONS:
+        if since is None:
+            cur.execute(f"DELETE FROM posture_rollup_{res}")
+            cur.execute(_upsert(res, "posture_log"))
+        else:
+            cur.execute(f"DELETE FROM posture_rollup_{res} WHERE bucket >= date_trunc('{res}', %s::timestamptz)",
+                        (since,))
+            cur.execute(_upsert(res, "posture_log", f"AND received_time >= date_trunc('{res}', %s::timestamptz)"),
+                        (since,))
+
+def query(cur, resolution: str, pi_id: Optional[str] = None, since: Optional[str] = None,
+          until: Optional[str] = None) -> Tuple[List[str], List[tuple]]:
+    """(column names, rows) from posture_<resolution>, oldest bucket first."""
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"resolution must be one of {RESOLUTIONS}, got {resolution!r}")
+    where, args = [], []
+    for cond, value in (("pi_id = %s", pi_id), ("bucket >= %s", since), ("bucket < %s", until)):
+        if value:
+            where.append(cond)
+            args.append(value)
+    cur.execute(f"SELECT * FROM posture_{resolution}"
+                + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY bucket, pi_id", args)
+    return [d[0] for d in cur.description], cur.fetchall()
+
+def _connect():
+    import psycopg2
+    return psycopg2.connect(host=os.environ.get("DB_HOST", "aws-0-eu-north-1.pooler.supabase.com"),
+                            dbname=os.environ.get("DB_NAME", "postgres"),
+                            user=os.environ.get("DB_USER", "postgres.yvqqpgixkwsiychmwvkc"),
+                            password=os.environ.get("DB_PASSWORD", ""),
+                            port=int(os.environ.get("DB_PORT", "5432")),
+                            sslmode=os.environ.get("DB_SSLMODE", "require"))
+
+def main(argv: List[str]) -> int:
+    if not argv or argv[0] not in ("backfill", "query") or (argv[0] == "query" and len(argv) < 2):
+        print("usage: posture_rollups.py backfill [SINCE] | query minute|hour [PI_ID [SINCE [UNTIL]]]")
+        return 2
+    conn = _connect()
+    try:
+        with conn.cursor() as cur:
+            if argv[0] == "backfill":
+                ensure_rollups(cur)
+                backfill(cur, argv[1] if len(argv) > 1 else None)
+                conn.commit()
+                print("✅ Rollups rebuilt" + (f" from {argv[1]}" if len(argv) > 1 else ""))
+            else:
+                names, rows = query(cur, *argv[1:5])
+                w = csv.writer(sys.stdout)
+                w.writerow(names)
+                w.writerows(rows)
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
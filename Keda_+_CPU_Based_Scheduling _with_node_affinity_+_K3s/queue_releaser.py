@@ -1,11 +1,32 @@
-import os, time, random, requests
-from typing import List
-from kubernetes import client, config
+import os, sys, time, json, threading, requests
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from kubernetes import client, config, watch
 
 NAMESPACE = os.getenv("NAMESPACE", "posture")
 LABEL_SELECTOR = os.getenv("JOB_SELECTOR", "app=posture-queued")
 ALLOWED_URL = os.getenv("ALLOWED_URL", "http://localhost:8088/allowed")
+ALLOWED_STREAM_URL = os.getenv("ALLOWED_STREAM_URL", ALLOWED_URL.rstrip("/") + "/stream")
+# Safety-net full resync; normal operation is event driven
 POLL_SECONDS = float(os.getenv("POLL_SECONDS", "5"))
+# "priority" (annotation posture/priority, higher first, then FIFO) or "fifo" (creation time)
+RELEASE_ORDER = os.getenv("RELEASE_ORDER", "priority").strip().lower()
+PRIORITY_ANNOTATION = os.getenv("PRIORITY_ANNOTATION", "posture/priority")
+# Coalesce bursts of watch events into one reconcile
+DEBOUNCE_SECONDS = float(os.getenv("DEBOUNCE_SECONDS", "0.2"))
+# An admission whose pod never reaches Running is still counted until this expires
+ADMIT_TIMEOUT_SECONDS = float(os.getenv("ADMIT_TIMEOUT_SECONDS", "300"))
+
+# Wave mode: release a batch with one planned node assignment (controller ranks + free cores)
+RELEASE_MODE = os.getenv("RELEASE_MODE", "single").strip().lower()   # "single" | "wave"
+CONTROLLER_URL = os.getenv("CONTROLLER_URL", "http://localhost:8090/last")
+# Packing: on nodes with enough free cores, run several analyzer scripts in one pod
+PACK_ENABLED = os.getenv("PACK_ENABLED", "false").lower() == "true"
+CORES_PER_WORKER = float(os.getenv("CORES_PER_WORKER", "2"))
+PACK_MAX_PER_POD = int(os.getenv("PACK_MAX_PER_POD", "4"))
+PACK_RUNNER = os.getenv("PACK_RUNNER", "/app/pack_runner.py")
+PACKED_ANNOTATION = "posture/packed-jobs"
+HOSTNAME_LABEL = "kubernetes.io/hostname"
 
 def load_kube():
     config.load_kube_config()  # running on NUC
@@ -15,10 +36,20 @@ def is_completed(j) -> bool:
     conds = j.status.conditions or []
     return any(c.type == "Complete" and c.status == "True" for c in conds)
 
+def is_failed(j) -> bool:
+    conds = j.status.conditions or []
+    return any(c.type == "Failed" and c.status == "True" for c in conds)
+
+def is_finished(j) -> bool:
+    return is_completed(j) or is_failed(j)
+
 def is_suspended(j) -> bool:
     # Job.spec.suspend is a boolean
     return bool(j.spec.suspend)
 
+def is_deleting(j) -> bool:
+    return j.metadata.deletion_timestamp is not None
+
 def list_jobs(batch) -> List[client.V1Job]:
     return batch.list_namespaced_job(NAMESPACE, label_selector=LABEL_SELECTOR).items
 
@@ -34,31 +65,347 @@ def get_allowed() -> int:
     except Exception:
         return 0
 
-def reconcile(batch):
-    jobs = list_jobs(batch)
-    running = [j for j in jobs if (not is_suspended(j)) and (not is_completed(j))]
-    queued  = [j for j in jobs if is_suspended(j) and (not is_completed(j))]
+def job_priority(j) -> int:
+    ann = j.metadata.annotations or {}
+    try:
+        return int(ann.get(PRIORITY_ANNOTATION, "0"))
+    except ValueError:
+        return 0
 
-    allowed = get_allowed()
-    need = max(0, allowed - len(running))
+def release_sort_key(j):
+    created = j.metadata.creation_timestamp or datetime.max.replace(tzinfo=timezone.utc)
+    if RELEASE_ORDER == "fifo":
+        return (created, j.metadata.name)
+    return (-job_priority(j), created, j.metadata.name)
 
-    if need > 0 and queued:
-        random.shuffle(queued)  # randomize release order (tie-breaks)
-        to_release = queued[:need]
-        for j in to_release:
-            patch_suspend(batch, j.metadata.name, False)
-        print(f"[releaser] allowed={allowed} running={len(running)} queued={len(queued)} -> released {len(to_release)}")
-    else:
-        print(f"[releaser] allowed={allowed} running={len(running)} queued={len(queued)} -> no change")
+def pod_job_name(p) -> Optional[str]:
+    labels = p.metadata.labels or {}
+    return labels.get("batch.kubernetes.io/job-name") or labels.get("job-name")
 
-def main():
-    batch = load_kube()
-    while True:
+def pod_is_live(p) -> bool:
+    return bool(p.status) and p.status.phase not in ("Succeeded", "Failed")
+
+def job_weight(j) -> int:
+    """Analyzers a job runs: the member count of a packed job, otherwise 1."""
+    packed = (j.metadata.annotations or {}).get(PACKED_ANNOTATION, "")
+    return max(1, len([n for n in packed.split(",") if n]))
+
+def job_script(j) -> Optional[str]:
+    """The analyzer script a queued job runs, e.g. 'Images_From_Pi1_3.py'."""
+    for c in j.spec.template.spec.containers or []:
+        for arg in (c.args or []) + (c.command or []):
+            if arg.endswith(".py"):
+                return os.path.basename(arg)
+    return None
+
+# ---------- wave planning / bulk admission ----------
+def get_ranked_capacity() -> Tuple[List[str], Dict[str, float]]:
+    """(eligible nodes in rank order, free cores per node) from the controller's /last."""
+    r = requests.get(CONTROLLER_URL, timeout=3)
+    r.raise_for_status()
+    data = r.json()
+    return list(data.get("eligible_nodes", [])), dict(data.get("free_cores_by_node", {}))
+
+def node_slots(free_cores: float, pack: bool) -> int:
+    if not pack:
+        return 1
+    return max(1, min(PACK_MAX_PER_POD, int(free_cores // CORES_PER_WORKER)))
+
+def plan_wave(queued: List[client.V1Job], ranked_nodes: List[str], free_cores: Dict[str, float],
+              occupied: set, pods: int, pack: bool = PACK_ENABLED) -> List[Tuple[str, List[client.V1Job]]]:
+    """
+    Assign up to `pods` pods to free eligible nodes in rank order.
+    Each pod takes one queued job, or up to node_slots() jobs when packing.
+    `queued` must already be in release order.
+    """
+    plan: List[Tuple[str, List[client.V1Job]]] = []
+    it = iter(queued)
+    for node in ranked_nodes:
+        if len(plan) >= pods:
+            break
+        if node in occupied:
+            continue
+        group = [j for _, j in zip(range(node_slots(free_cores.get(node, 0.0), pack)), it)]
+        if not group:
+            break
+        plan.append((node, group))
+    return plan
+
+def release_on_node(batch, name: str, node: str):
+    """Unsuspend and pin in one patch (scheduling directives are mutable while a Job is suspended)."""
+    body = {"spec": {"suspend": False,
+                     "template": {"spec": {"nodeSelector": {HOSTNAME_LABEL: node}}}}}
+    batch.patch_namespaced_job(name, NAMESPACE, body)
+
+def create_packed_job(batch, node: str, group: List[client.V1Job], free_cores: float) -> client.V1Job:
+    """
+    Replace `group` with one Job on `node` whose pod runs every group member's script
+    through pack_runner.py. All analyzer images contain every script (COPY . /app).
+    """
+    first = group[0]
+    template = batch.api_client.sanitize_for_serialization(first.spec.template)
+    labels = {k: v for k, v in (template.get("metadata", {}).get("labels") or {}).items()
+              if k not in ("job-name", "controller-uid") and not k.startswith("batch.kubernetes.io/")}
+    template.setdefault("metadata", {})["labels"] = {**labels, "posture/packed": "true"}
+    pod_spec = template["spec"]
+    pod_spec["nodeSelector"] = {HOSTNAME_LABEL: node}
+    # pool size per script: the node's free cores split across the group, CORES_PER_WORKER each
+    workers = max(1, int(free_cores // (len(group) * CORES_PER_WORKER)))
+    container = pod_spec["containers"][0]
+    container["command"] = ["python"]
+    container["args"] = [PACK_RUNNER] + [job_script(j) for j in group]
+    container["env"] = [e for e in container.get("env") or [] if e.get("name") != "NUM_WORKERS"] + [
+        {"name": "NUM_WORKERS", "value": str(workers)}]
+
+    name = f"{first.metadata.name}-pack{len(group)}"
+    body = {
+        "apiVersion": "batch/v1",
+        "kind": "Job",
+        "metadata": {
+            "name": name,
+            "labels": dict(first.metadata.labels or {}),
+            "annotations": {PACKED_ANNOTATION: ",".join(j.metadata.name for j in group)},
+        },
+        "spec": {"ttlSecondsAfterFinished": first.spec.ttl_seconds_after_finished or 600,
+                 "template": template},
+    }
+    packed = batch.create_namespaced_job(NAMESPACE, body)
+    for j in group:
+        batch.delete_namespaced_job(j.metadata.name, NAMESPACE, propagation_policy="Background")
+    return packed
+
+def apply_wave(batch, plan: List[Tuple[str, List[client.V1Job]]], free_cores: Dict[str, float]
+               ) -> Tuple[Dict[str, str], List[Tuple[client.V1Job, List[client.V1Job]]]]:
+    """Execute a planned wave; returns ({released job name: node}, [(packed job, replaced members)])."""
+    released: Dict[str, str] = {}
+    packed: List[Tuple[client.V1Job, List[client.V1Job]]] = []
+    for node, group in plan:
+        if len(group) > 1 and all(job_script(j) for j in group):
+            try:
+                job = create_packed_job(batch, node, group, free_cores.get(node, 0.0))
+                packed.append((job, group))
+                released[job.metadata.name] = node
+            except Exception as e:
+                print(f"[releaser] packed release on {node} failed: {e}")
+            continue
+        # not packable: only one member fits on the node (queued pods are anti-affine per
+        # hostname); the rest stay queued for a later wave
+        j = group[0]
         try:
-            reconcile(batch)
+            release_on_node(batch, j.metadata.name, node)
+            released[j.metadata.name] = node
         except Exception as e:
-            print(f"[releaser] error: {e}")
-        time.sleep(POLL_SECONDS)
+            print(f"[releaser] wave release of {j.metadata.name} on {node} failed: {e}")
+    return released, packed
+
+class Releaser:
+    """
+    Event-driven admission control for suspended posture Jobs.
+
+    State is fed by three threads (Job watch, Pod watch, allowed-count stream);
+    each event sets `wake` and the main loop reconciles. A job counts against
+    `allowed` from the moment we unsuspend it until it finishes: while its pod
+    is not yet Running it is tracked as an in-flight admission, so a release
+    is never repeated just because the watch has not caught up.
+    """
+    def __init__(self, batch, core):
+        self.batch = batch
+        self.core = core
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.jobs: Dict[str, client.V1Job] = {}
+        self.running_pods: Dict[str, str] = {}   # pod name -> job name (phase Running)
+        self.pod_nodes: Dict[str, str] = {}      # pod name -> node (live, bound pods)
+        self.inflight_nodes: Dict[str, str] = {} # job name -> node planned by a wave
+        self.inflight: Dict[str, float] = {}     # job name -> monotonic release time
+        self.allowed: Optional[int] = None
+        self.last_summary = None
+
+    # ---------- feeds ----------
+    def _watch(self, list_fn, on_event, on_relist, what: str):
+        w = watch.Watch()
+        while True:
+            try:
+                items = list_fn(NAMESPACE, label_selector=LABEL_SELECTOR)
+                on_relist(items.items)
+                self.wake.set()
+                for event in w.stream(list_fn, NAMESPACE, label_selector=LABEL_SELECTOR,
+                                      resource_version=items.metadata.resource_version,
+                                      timeout_seconds=300):
+                    on_event(event["type"], event["object"])
+                    self.wake.set()
+            except Exception as e:
+                print(f"[releaser] {what} watch error: {e}; relisting in 2s")
+                time.sleep(2)
+
+    def _job_relist(self, items):
+        with self.lock:
+            self.jobs = {j.metadata.name: j for j in items}
+
+    def _job_event(self, kind: str, j):
+        with self.lock:
+            if kind == "DELETED":
+                self.jobs.pop(j.metadata.name, None)
+                self.inflight.pop(j.metadata.name, None)
+                self.inflight_nodes.pop(j.metadata.name, None)
+            else:
+                self.jobs[j.metadata.name] = j
+
+    def _pod_relist(self, items):
+        with self.lock:
+            self.running_pods = {p.metadata.name: pod_job_name(p) for p in items
+                                 if p.status and p.status.phase == "Running"}
+            self.pod_nodes = {p.metadata.name: p.spec.node_name for p in items
+                              if pod_is_live(p) and p.spec.node_name}
+
+    def _pod_event(self, kind: str, p):
+        with self.lock:
+            if kind != "DELETED" and p.status and p.status.phase == "Running":
+                self.running_pods[p.metadata.name] = pod_job_name(p)
+            else:
+                self.running_pods.pop(p.metadata.name, None)
+            if kind != "DELETED" and pod_is_live(p) and p.spec.node_name:
+                self.pod_nodes[p.metadata.name] = p.spec.node_name
+            else:
+                self.pod_nodes.pop(p.metadata.name, None)
+
+    def _allowed_stream(self):
+        while True:
+            try:
+                with requests.get(ALLOWED_STREAM_URL, stream=True, timeout=(3, 60)) as r:
+                    r.raise_for_status()
+                    for line in r.iter_lines():
+                        if not line:
+                            continue
+                        allowed = int(json.loads(line).get("allowed", 0))
+                        if allowed != self.allowed:
+                            self.allowed = allowed
+                            self.wake.set()
+            except Exception as e:
+                # Fall back to one plain GET so a scaler without /allowed/stream still works
+                print(f"[releaser] allowed stream error: {e}; polling {ALLOWED_URL}")
+                self.allowed = get_allowed()
+                self.wake.set()
+                time.sleep(POLL_SECONDS)
+
+    # ---------- admission ----------
+    def reconcile(self):
+        now = time.monotonic()
+        with self.lock:
+            jobs = list(self.jobs.values())
+            running_jobs = set(self.running_pods.values())
+            for name in list(self.inflight):
+                j = self.jobs.get(name)
+                if (j is None or is_finished(j) or name in running_jobs
+                        or now - self.inflight[name] > ADMIT_TIMEOUT_SECONDS):
+                    del self.inflight[name]
+                    self.inflight_nodes.pop(name, None)
+            inflight = set(self.inflight)
+            occupied = set(self.pod_nodes.values()) | set(self.inflight_nodes.values())
+
+        active = [j for j in jobs if not is_finished(j)
+                  and (not is_suspended(j) or j.metadata.name in inflight)]
+        running = [j for j in active if j.metadata.name in running_jobs]
+        starting = len(active) - len(running)
+        # members replaced by a packed job linger (suspended, deleting) until their DELETED event
+        queued = sorted((j for j in jobs if is_suspended(j) and not is_finished(j) and not is_deleting(j)
+                         and j.metadata.name not in inflight), key=release_sort_key)
+
+        allowed = self.allowed if self.allowed is not None else get_allowed()
+        # `allowed` counts analyzers, and a packed job runs one per member
+        need = max(0, allowed - sum(job_weight(j) for j in active))
+
+        if need > 0 and queued:
+            if RELEASE_MODE == "wave":
+                released = self.release_wave(queued, need, occupied)
+            else:
+                released = self.release_each(queued[:need])
+            self.last_summary = None
+            print(f"[releaser] allowed={allowed} running={len(running)} starting={starting} "
+                  f"queued={len(queued)} -> released {len(released)} ({', '.join(released)})")
+        else:
+            summary = (allowed, len(running), starting, len(queued))
+            if summary != self.last_summary:
+                print(f"[releaser] allowed={allowed} running={len(running)} starting={starting} "
+                      f"queued={len(queued)} -> no change")
+            self.last_summary = summary
+
+    def release_each(self, jobs: List[client.V1Job]) -> List[str]:
+        released = []
+        for j in jobs:
+            try:
+                patch_suspend(self.batch, j.metadata.name, False)
+            except Exception as e:
+                print(f"[releaser] release {j.metadata.name} failed: {e}")
+                continue
+            with self.lock:
+                self.inflight[j.metadata.name] = time.monotonic()
+            released.append(j.metadata.name)
+        return released
+
+    def release_wave(self, queued: List[client.V1Job], pods: int, occupied: set) -> List[str]:
+        try:
+            ranked, free = get_ranked_capacity()
+        except Exception as e:
+            print(f"[releaser] controller unavailable ({e}); releasing without a plan")
+            return self.release_each(queued[:pods])
+        # `pods` is the analyzer headroom; packing may not release more jobs than that
+        plan = plan_wave(queued[:pods], ranked, free, occupied, pods)
+        for node, group in plan:
+            print(f"[releaser] wave plan: {node} <- {', '.join(j.metadata.name for j in group)}")
+        released, packed = apply_wave(self.batch, plan, free)
+        with self.lock:
+            # until the watch catches up: the packed job must count (and hold its node), and its
+            # members must not be planned again
+            for job, group in packed:
+                self.jobs[job.metadata.name] = job
+                for j in group:
+                    self.jobs.pop(j.metadata.name, None)
+            for name, node in released.items():
+                self.inflight[name] = time.monotonic()
+                self.inflight_nodes[name] = node
+        return list(released)
+
+    def run(self):
+        feeds = [
+            (self._watch, (self.batch.list_namespaced_job, self._job_event, self._job_relist, "job")),
+            (self._watch, (self.core.list_namespaced_pod, self._pod_event, self._pod_relist, "pod")),
+            (self._allowed_stream, ()),
+        ]
+        for target, args in feeds:
+            threading.Thread(target=target, args=args, daemon=True).start()
+
+        while True:
+            self.wake.wait(timeout=POLL_SECONDS)
+            time.sleep(DEBOUNCE_SECONDS)
+            self.wake.clear()
+            try:
+                self.reconcile()
+            except Exception as e:
+                print(f"[releaser] error: {e}")
+
+def release_wave_once(batch, core, pods: int, pack: bool = PACK_ENABLED) -> Dict[str, str]:
+    """One-shot bulk admission: plan and release `pods` pods now, ignoring `allowed`."""
+    jobs = list_jobs(batch)
+    queued = sorted((j for j in jobs if is_suspended(j) and not is_finished(j) and not is_deleting(j)),
+                    key=release_sort_key)
+    occupied = {p.spec.node_name for p in core.list_namespaced_pod(NAMESPACE, label_selector=LABEL_SELECTOR).items
+                if pod_is_live(p) and p.spec.node_name}
+    ranked, free = get_ranked_capacity()
+    plan = plan_wave(queued, ranked, free, occupied, pods, pack=pack)
+    for node, group in plan:
+        print(f"[releaser] wave plan: {node} <- {', '.join(j.metadata.name for j in group)}")
+    return apply_wave(batch, plan, free)[0]
+
+def main():
+    batch = load_kube()
+    # `python queue_releaser.py wave N [--pack]` releases one planned wave and exits
+    if len(sys.argv) >= 3 and sys.argv[1] == "wave":
+        released = release_wave_once(batch, client.CoreV1Api(), int(sys.argv[2]),
+                                     pack=PACK_ENABLED or "--pack" in sys.argv[3:])
+        print(f"[releaser] wave released {len(released)}: {released}")
+        return
+    Releaser(batch, client.CoreV1Api()).run()
 
 if __name__ == "__main__":
     main()
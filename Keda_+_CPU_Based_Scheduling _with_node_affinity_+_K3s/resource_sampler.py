@@ -0,0 +1,306 @@
+# resource_sampler.py — GPU/CPU/RAM sampling for the benchmark loops on any node type.
+#
+# Backends (SAMPLER_BACKENDS=auto or a comma list of names):
+#   psutil     system cpu/ram %, plus this process + its children (the pool workers)
+#   sysfs_gpu  Jetson GPU load from /sys/devices/gpu.0/load (no subprocess)
+#   tegrastats Jetson GPU/CPU/RAM by parsing `tegrastats` (used when sysfs_gpu is absent)
+#   cgroup     cgroup v2 cpu.stat / memory.current: what the pod itself used
+#
+# Samples land in a preallocated ring buffer; stop_and_summary() returns avg/p50/p95/max
+# per metric (avg_gpu_pct / avg_cpu_pct / avg_ram_pct keep the old CSV meaning).
+import os
+import re
+import glob
+import math
+import time
+import shutil
+import logging
+import threading
+import subprocess
+from array import array
+from typing import Dict, List, Optional
+
+from task_timing import percentile
+
+LOGGER = logging.getLogger("resource_sampler")
+
+SAMPLER_BACKENDS = os.environ.get("SAMPLER_BACKENDS", "auto")
+SAMPLER_CAPACITY = int(os.environ.get("SAMPLER_CAPACITY", "4096"))
+CGROUP_ROOT = os.environ.get("CGROUP_ROOT", "/sys/fs/cgroup")
+
+METRICS = ("gpu_pct", "cpu_pct", "ram_pct", "proc_cpu_pct", "proc_rss_mb", "pod_cpu_cores", "pod_mem_mb")
+
+# ---------------------------
+# Ring buffer
+# ---------------------------
+class RingBuffer:
+    """Fixed-size float columns, one per metric; NaN marks 'not reported in this sample'."""
+    def __init__(self, fields, capacity: int = SAMPLER_CAPACITY):
+        self.capacity = capacity
+        self.cols = {f: array("d", [math.nan]) * capacity for f in fields}
+        self.n = 0
+
+    def append(self, sample: Dict[str, float]):
+        i = self.n % self.capacity
+        for f, col in self.cols.items():
+            v = sample.get(f)
+            col[i] = math.nan if v is None else float(v)
+        self.n += 1
+
+    def values(self, field: str) -> List[float]:
+        col = self.cols[field]
+        return [v for v in col[:min(self.n, self.capacity)] if not math.isnan(v)]
+
+# ---------------------------
+# Backends
+# ---------------------------
+class Backend:
+    name = "base"
+
+    @classmethod
+    def available(cls) -> bool:
+        return False
+
+    def start(self):
+        pass
+
+    def sample(self) -> Dict[str, float]:
+        return {}
+
+    def stop(self):
+        pass
+
+class PsutilBackend(Backend):
+    name = "psutil"
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            import psutil  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def start(self):
+        import psutil
+        self.psutil = psutil
+        self.me = psutil.Process()
+        psutil.cpu_percent(None)
+        self.me.cpu_percent(None)
+        self.children = {}
+
+    def sample(self) -> Dict[str, float]:
+        ps = self.psutil
+        out = {"cpu_pct": ps.cpu_percent(None), "ram_pct": ps.virtual_memory().percent}
+        cpu, rss = self.me.cpu_percent(None), self.me.memory_info().rss
+        try:
+            kids = self.me.children(recursive=True)
+        except ps.Error:
+            kids = []
+        seen = {}
+        for k in kids:
+            p = self.children.get(k.pid) or k
+            try:
+                if k.pid not in self.children:
+                    p.cpu_percent(None)  # first call primes the counter
+                else:
+                    cpu += p.cpu_percent(None)
+                rss += p.memory_info().rss
+                seen[k.pid] = p
+            except ps.Error:
+                pass
+        self.children = seen
+        out["proc_cpu_pct"] = cpu  # % of one core, summed over the process tree
+        out["proc_rss_mb"] = rss / (1024 * 1024)
+        return out
+
+class SysfsGpuBackend(Backend):
+    name = "sysfs_gpu"
+    PATHS = ("/sys/devices/gpu.0/load", "/sys/devices/platform/gpu.0/load",
+             "/sys/devices/platform/bus@0/17000000.gpu/load")
+
+    @classmethod
+    def _path(cls) -> Optional[str]:
+        for p in cls.PATHS + tuple(glob.glob("/sys/devices/platform/*gpu*/load")):
+            if os.path.exists(p):
+                return p
+        return None
+
+    @classmethod
+    def available(cls) -> bool:
+        return cls._path() is not None
+
+    def start(self):
+        self.path = self._path()
+
+    def sample(self) -> Dict[str, float]:
+        try:
+            with open(self.path) as f:
+                return {"gpu_pct": int(f.read().strip()) / 10.0}  # 0..1000
+        except (OSError, ValueError):
+            return {}
+
+class TegrastatsBackend(Backend):
+    """
+    Parses `tegrastats` lines in a reader thread; sample() returns the latest line.
+    - GPU:  GR3D_FREQ X%
+    - CPU:  average of all core samples like '5%@', '12%@', ...
+    - RAM:  RAM used/totalMB|MiB|GB|GiB -> used/total * 100
+    """
+    name = "tegrastats"
+    re_gpu = re.compile(r"GR3D_FREQ\s+(\d+)%")
+    re_cpu_all = re.compile(r"(\d+)%@")
+    re_ram = re.compile(r"RAM\s+(\d+(?:\.\d+)?)/(\d+(?:\.\d+)?)(?:\s*)([MG]i?B)")
+
+    def __init__(self, interval_ms: int = 200):
+        self.interval_ms = interval_ms
+        self.proc = None
+        self.latest: Dict[str, float] = {}
+
+    @classmethod
+    def available(cls) -> bool:
+        return shutil.which("tegrastats") is not None
+
+    @classmethod
+    def parse(cls, line: str) -> Dict[str, float]:
+        out = {}
+        m_gpu = cls.re_gpu.search(line)
+        if m_gpu:
+            out["gpu_pct"] = float(m_gpu.group(1))
+        cores = [float(v) for v in cls.re_cpu_all.findall(line)]
+        if cores:
+            out["cpu_pct"] = sum(cores) / len(cores)
+        m_ram = cls.re_ram.search(line)
+        if m_ram and float(m_ram.group(2)) > 0:
+            out["ram_pct"] = float(m_ram.group(1)) / float(m_ram.group(2)) * 100.0
+        return out
+
+    def start(self):
+        self.proc = subprocess.Popen(["tegrastats", "--interval", str(self.interval_ms)],
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        threading.Thread(target=self._reader, daemon=True).start()
+
+    def _reader(self):
+        for raw in iter(self.proc.stdout.readline, ""):
+            parsed = self.parse(raw.strip())
+            if parsed:
+                self.latest = parsed
+
+    def sample(self) -> Dict[str, float]:
+        return dict(self.latest)
+
+    def stop(self):
+        if self.proc:
+            try:
+                self.proc.terminate()
+                self.proc.wait(timeout=1.5)
+            except Exception:
+                pass
+
+class CgroupV2Backend(Backend):
+    """Pod/container-scoped usage: cpu.stat usage_usec rate (cores) and memory.current."""
+    name = "cgroup"
+
+    @classmethod
+    def available(cls) -> bool:
+        return os.path.exists(os.path.join(CGROUP_ROOT, "cpu.stat"))
+
+    def _usage_usec(self) -> Optional[int]:
+        try:
+            with open(os.path.join(CGROUP_ROOT, "cpu.stat")) as f:
+                for line in f:
+                    if line.startswith("usage_usec"):
+                        return int(line.split()[1])
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def start(self):
+        self.prev = (time.monotonic(), self._usage_usec())
+
+    def sample(self) -> Dict[str, float]:
+        out = {}
+        now, usage = time.monotonic(), self._usage_usec()
+        t0, u0 = self.prev
+        if usage is not None and u0 is not None and now > t0:
+            out["pod_cpu_cores"] = (usage - u0) / 1e6 / (now - t0)
+        self.prev = (now, usage)
+        try:
+            with open(os.path.join(CGROUP_ROOT, "memory.current")) as f:
+                out["pod_mem_mb"] = int(f.read().strip()) / (1024 * 1024)
+        except (OSError, ValueError):
+            pass
+        return out
+
+BACKENDS = {b.name: b for b in (PsutilBackend, SysfsGpuBackend, TegrastatsBackend, CgroupV2Backend)}
+
+def select_backends(spec: str = SAMPLER_BACKENDS, interval_ms: int = 200) -> List[Backend]:
+    if spec.strip().lower() == "auto":
+        names = [n for n in ("psutil", "sysfs_gpu", "cgroup") if BACKENDS[n].available()]
+        # tegrastats only fills what the cheaper backends could not
+        if TegrastatsBackend.available() and ("sysfs_gpu" not in names or "psutil" not in names):
+            names.append("tegrastats")
+    else:
+        names = [n.strip() for n in spec.split(",") if n.strip()]
+    out = []
+    for n in names:
+        cls = BACKENDS.get(n)
+        if cls is None or not cls.available():
+            LOGGER.warning("Sampler backend %s unavailable; skipping", n)
+            continue
+        out.append(cls(interval_ms) if cls is TegrastatsBackend else cls())
+    return out
+
+# ---------------------------
+# Sampler
+# ---------------------------
+class ResourceSampler:
+    """Polls the selected backends every interval_ms into a ring buffer while running."""
+    def __init__(self, interval_ms: int = 200, backends: Optional[List[Backend]] = None):
+        self.interval = interval_ms / 1000.0
+        self.backends = backends if backends is not None else select_backends(interval_ms=interval_ms)
+        self.buf = RingBuffer(METRICS)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        started = []
+        for b in self.backends:
+            try:
+                b.start()
+                started.append(b)
+            except Exception as e:
+                LOGGER.warning("Sampler backend %s failed to start: %s", b.name, e)
+        self.backends = started
+        if not self.backends:
+            LOGGER.warning("No resource sampler backend available; sampling disabled for this run.")
+            return self
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            sample = {}
+            for b in self.backends:
+                try:
+                    for k, v in b.sample().items():
+                        sample.setdefault(k, v)  # earlier (cheaper/direct) backends win
+                except Exception:
+                    pass
+            self.buf.append(sample)
+
+    def stop_and_summary(self) -> Dict[str, object]:
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=1.5)
+        for b in self.backends:
+            b.stop()
+        out: Dict[str, object] = {"backends": ",".join(b.name for b in self.backends), "samples": self.buf.n}
+        for m in METRICS:
+            vals = sorted(self.buf.values(m))
+            out[f"avg_{m}"] = round(sum(vals) / len(vals), 6) if vals else None
+            out[f"p50_{m}"] = round(percentile(vals, 50), 6) if vals else None
+            out[f"p95_{m}"] = round(percentile(vals, 95), 6) if vals else None
+            out[f"max_{m}"] = round(vals[-1], 6) if vals else None
+        return out
@@ -0,0 +1,58 @@
+# task_timing.py — per-task enqueue/start/end accounting for pool workers.
+#
+# Submit work as pool.submit(timed_task, fn, time.monotonic(), *args): the worker stamps
+# start/end with the same monotonic clock (CLOCK_MONOTONIC is system-wide on Linux, so
+# parent and worker stamps are comparable) and returns (result, TaskTimes). From those:
+#   queue_wait = started - enqueued      (time behind earlier copies in the pool)
+#   service    = finished - started      (compute only)
+#   latency    = finished - received     (end-to-end from MQTT receipt / source read)
+import math
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+class TaskTimes(NamedTuple):
+    enqueued: float
+    started: float
+    finished: float
+
+def timed_task(fn, enqueued: float, *args, **kwargs):
+    """Worker-side wrapper: returns (fn(*args), TaskTimes)."""
+    started = time.monotonic()
+    result = fn(*args, **kwargs)
+    return result, TaskTimes(enqueued, started, time.monotonic())
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile (q in 0..100); None for no data."""
+    if not values:
+        return None
+    s = sorted(values)
+    k = (len(s) - 1) * q / 100.0
+    lo, hi = int(math.floor(k)), int(math.ceil(k))
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+def _dist(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "mean": (sum(values) / len(values)) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+def summarize(times: List[TaskTimes], received: Optional[float] = None) -> Dict[str, object]:
+    """
+    Service / queue-wait / latency distributions and throughput for one batch (loop).
+    received: monotonic time the input arrived; defaults to the first enqueue.
+    """
+    if not times:
+        return {"count": 0, "service_s": _dist([]), "queue_wait_s": _dist([]), "latency_s": _dist([]),
+                "throughput_fps": 0.0, "span_s": 0.0}
+    origin = min(t.enqueued for t in times) if received is None else received
+    span = max(t.finished for t in times) - min(t.enqueued for t in times)
+    return {
+        "count": len(times),
+        "service_s": _dist([t.finished - t.started for t in times]),
+        "queue_wait_s": _dist([t.started - t.enqueued for t in times]),
+        "latency_s": _dist([t.finished - origin for t in times]),
+        "throughput_fps": len(times) / span if span > 0 else 0.0,
+        "span_s": span,
+    }
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# trace_report.py — latency breakdown from a TRACE_SINK JSONL file (TRACE_FORMAT=jsonl).
+#
+#   python trace_report.py /var/lib/posture/traces.jsonl [--json]
+#
+# For every frame the spans are ordered by start time. Reported per hop:
+#   <span>          time spent inside a hop (capture, encode, relay, worker, db_commit, ...)
+#   <a> -> <b>      gap between one hop ending and the next starting (Wi-Fi + broker for
+#                   publish -> mqtt_receive / relay, etc.)
+#   end_to_end      capture to the last span's end
+import sys
+import json
+import collections
+from typing import Dict, List
+
+from task_timing import percentile
+
+def load(path: str) -> List[Dict]:
+    frames = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                ctx = json.loads(line)
+            except ValueError:
+                continue
+            if "spans" in ctx:
+                frames.append(ctx)
+    return frames
+
+def breakdown(frames: List[Dict]) -> Dict[str, List[float]]:
+    """Name -> list of milliseconds over all frames."""
+    out: Dict[str, List[float]] = collections.defaultdict(list)
+    for ctx in frames:
+        spans = sorted(ctx["spans"], key=lambda s: (s["start_ns"], s["end_ns"]))
+        if not spans:
+            continue
+        for s in spans:
+            if s["end_ns"] > s["start_ns"]:
+                out[s["name"]].append((s["end_ns"] - s["start_ns"]) / 1e6)
+        for a, b in zip(spans, spans[1:]):
+            out[f"{a['name']} -> {b['name']}"].append((b["start_ns"] - a["end_ns"]) / 1e6)
+        out["end_to_end"].append((spans[-1]["end_ns"] - ctx.get("t_capture_ns", spans[0]["start_ns"])) / 1e6)
+    return out
+
+def summarize(rows: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    return {name: {"n": len(v), "mean_ms": sum(v) / len(v), "p50_ms": percentile(v, 50),
+                   "p95_ms": percentile(v, 95), "p99_ms": percentile(v, 99)}
+            for name, v in rows.items() if v}
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if not args:
+        print("usage: trace_report.py TRACES.jsonl [--json]")
+        sys.exit(2)
+    frames = load(args[0])
+    stats = summarize(breakdown(frames))
+    if "--json" in sys.argv:
+        print(json.dumps({"frames": len(frames), "hops": stats}, indent=2))
+        return
+    print(f"📊 {len(frames)} traced frames from {args[0]}")
+    print(f"{'hop':<34}{'n':>7}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}   (ms)")
+    # largest median first, end_to_end last
+    order = sorted(stats, key=lambda k: (k == "end_to_end", -stats[k]["p50_ms"]))
+    for name in order:
+        s = stats[name]
+        print(f"{name:<34}{s['n']:>7}{s['mean_ms']:>10.1f}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,9 @@ import logging
 import paho.mqtt.client as mqtt
 import base64
 import warnings
+import time
+import trace_context
+from frame_archive import ARCHIVE_FORMAT, archive_for
 
 # Suppress non-critical DeprecationWarnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -17,6 +20,9 @@ image_publish_topic_jetson = 'images/jetson_orin'  # Topic for sending images to
 image_directory_pi1 = './images_from_pi1/'
 image_directory_pi2 = './images_from_pi2/'
 image_directory_pi3 = './images_from_pi3/'
+# ARCHIVE_FORMAT=segments (default) keeps each directory as one frame_archive.py archive
+# (a few segment files + index) instead of one file per frame; "files" is the old layout
+next_numbers = {}
 
 # Set up logging
 logging.basicConfig(filename='logs/image_receiver.log', level=logging.INFO,
@@ -35,7 +41,10 @@ def on_connect(client, userdata, flags, rc):
 def on_message(client, userdata, msg):
     try:
         topic = msg.topic
-        image_data = base64.b64decode(msg.payload)
+        recv_ns = time.time_ns()
+        # traced frames carry a header line (see trace_context.py); relay it with our span added
+        ctx, payload = trace_context.unwrap(msg.payload)
+        image_data = base64.b64decode(payload)
 
         # Determine the correct directory and prefix based on the topic
         if topic == image_topic_pi1:
@@ -56,21 +65,31 @@ def on_message(client, userdata, msg):
         image_path = os.path.join(image_directory, f"{prefix}{image_number:02d}.jpg")
 
         # Save the image
-        os.makedirs(image_directory, exist_ok=True)
-        with open(image_path, 'wb') as file:
-            file.write(image_data)
+        if ARCHIVE_FORMAT == "segments":
+            archive_for(image_directory).put(os.path.basename(image_path), image_data)
+        else:
+            os.makedirs(image_directory, exist_ok=True)
+            with open(image_path, 'wb') as file:
+                file.write(image_data)
 
         logging.info(f"Image received and saved to {image_path}")
 
         # Publish the image to the Jetson Orin
         encoded_image = base64.b64encode(image_data).decode('utf-8')
-        client.publish(image_publish_topic_jetson, encoded_image)
+        trace_context.add_span(ctx, "relay", recv_ns, topic=topic)
+        client.publish(image_publish_topic_jetson, trace_context.wrap(encoded_image, ctx))
         logging.info(f"Image forwarded to Jetson Orin on topic {image_publish_topic_jetson}")
 
     except Exception as e:
         logging.error(f"Failed to process message: {e}")
 
 def get_next_image_number(directory, prefix):
+    if ARCHIVE_FORMAT == "segments":
+        # counted once from the index, then in memory (no directory listing per frame)
+        if directory not in next_numbers:
+            next_numbers[directory] = archive_for(directory).count(prefix)
+        next_numbers[directory] += 1
+        return next_numbers[directory]
     try:
         files = os.listdir(directory)
     except FileNotFoundError:
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# replication_bridge.py — mosquitto config that duplicates one Pi topic into N replica topics.
+#
+# With Pi_Replications REPLICATION_MODE=single the Pi publishes each frame once to
+# images/pi2. If the analyzers still expect one topic per replica (images/pi2,
+# images/pi2_1 ... images/pi2_9), the broker makes the copies: each replica gets a
+# loopback bridge connection that subscribes to the base topic and republishes it under
+# the replica name on the same broker. The Pi uplink carries one copy; only the
+# broker -> analyzer side carries N.
+#
+#   python replication_bridge.py images/pi2 10 > /etc/mosquitto/conf.d/replication.conf
+#   sudo systemctl restart mosquitto
+#
+# Analyzers that only need load balancing (not duplication) do not need this: subscribe
+# them with SHARE_GROUP=<group> (MQTT v5 shared subscription $share/<group>/images/pi2).
+import sys
+
+def bridge_config(base: str, replicas: int, host: str = "127.0.0.1", port: int = 1883, qos: int = 0) -> str:
+    """One bridge connection per extra replica: base -> base_1 ... base_{replicas-1}."""
+    lines = [f"# generated by replication_bridge.py: {base} -> {replicas - 1} replica topics", ""]
+    for i in range(1, replicas):
+        name = base.replace("/", "_")
+        lines += [
+            f"connection replicate_{name}_{i}",
+            f"address {host}:{port}",
+            f"clientid replicate_{name}_{i}",
+            "cleansession true",
+            "try_private false",
+            # empty pattern: remap the whole topic string (local base -> remote base_i)
+            f'topic "" out {qos} {base} {base}_{i}',
+            "",
+        ]
+    return "\n".join(lines)
+
+def main():
+    if len(sys.argv) < 3:
+        print("usage: replication_bridge.py BASE_TOPIC REPLICAS [HOST] [PORT] [QOS]")
+        sys.exit(2)
+    base, replicas = sys.argv[1], int(sys.argv[2])
+    host = sys.argv[3] if len(sys.argv) > 3 else "127.0.0.1"
+    port = int(sys.argv[4]) if len(sys.argv) > 4 else 1883
+    qos = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+    print(bridge_config(base, replicas, host, port, qos))
+
+if __name__ == "__main__":
+    main()
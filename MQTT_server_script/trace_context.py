@@ -0,0 +1,107 @@
+# trace_context.py — per-frame trace context carried inside the MQTT payload.
+#
+# Copies of this file live next to the Pi publisher (RaspberryPi_scripts/), the relay
+# (MQTT_server_script/) and the analyzers; keep them identical.
+#
+# A traced payload is   b"TRC1" + <json header> + b"\n" + <original payload>
+# where the header is {"frame_id", "t_capture_ns", "spans": [...]}. Each hop appends a
+# span {"name", "host", "start_ns", "end_ns"} (wall clock, time.time_ns(); hosts need
+# NTP for cross-host gaps to be meaningful). Untraced payloads pass through unchanged,
+# so tracing can be switched on per Pi with TRACE_ENABLED=true.
+#
+# The last hop hands the context to TraceSink, which appends one JSON line per frame
+# (TRACE_FORMAT=jsonl) or an OTLP/JSON ResourceSpans object (TRACE_FORMAT=otlp) to
+# TRACE_SINK. trace_report.py turns the JSONL into a per-hop latency breakdown.
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+
+MAGIC = b"TRC1"
+TRACE_ENABLED = os.environ.get("TRACE_ENABLED", "false").lower() == "true"
+TRACE_SINK = os.environ.get("TRACE_SINK", "")  # file path; empty disables the sink
+TRACE_FORMAT = os.environ.get("TRACE_FORMAT", "jsonl").lower()
+HOST = os.environ.get("NODE_NAME", socket.gethostname())
+
+def new_context(source: str, t_capture_ns: Optional[int] = None) -> Dict:
+    return {
+        "frame_id": f"{source}-{uuid.uuid4().hex[:12]}",
+        "t_capture_ns": t_capture_ns if t_capture_ns is not None else time.time_ns(),
+        "spans": [],
+    }
+
+def add_span(ctx: Optional[Dict], name: str, start_ns: int, end_ns: Optional[int] = None, **attrs) -> None:
+    """Append a span; end_ns defaults to now. No-op for ctx=None (untraced frame)."""
+    if ctx is None:
+        return
+    span = {"name": name, "host": HOST, "start_ns": int(start_ns),
+            "end_ns": int(end_ns if end_ns is not None else time.time_ns())}
+    if attrs:
+        span["attrs"] = attrs
+    ctx["spans"].append(span)
+
+def wrap(payload, ctx: Optional[Dict]) -> bytes:
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if ctx is None:
+        return payload
+    return MAGIC + json.dumps(ctx, separators=(",", ":")).encode() + b"\n" + payload
+
+def unwrap(payload: bytes) -> Tuple[Optional[Dict], bytes]:
+    """(ctx, original payload); ctx is None for untraced payloads."""
+    if not payload.startswith(MAGIC):
+        return None, payload
+    nl = payload.find(b"\n")
+    if nl < 0:
+        return None, payload
+    try:
+        return json.loads(payload[len(MAGIC):nl]), payload[nl + 1:]
+    except ValueError:
+        return None, payload
+
+def mono_to_ns(t_monotonic: float) -> int:
+    """Wall-clock ns for a time.monotonic() stamp taken on this host."""
+    return time.time_ns() - int((time.monotonic() - t_monotonic) * 1e9)
+
+def to_otlp(ctx: Dict, service: str = "posture") -> Dict:
+    """OTLP/JSON ResourceSpans for one frame (trace id derived from frame_id)."""
+    trace_id = hashlib.sha256(ctx["frame_id"].encode()).hexdigest()[:32]
+    spans = []
+    for i, s in enumerate(ctx["spans"]):
+        attrs = [{"key": "host.name", "value": {"stringValue": s["host"]}},
+                 {"key": "frame.id", "value": {"stringValue": ctx["frame_id"]}}]
+        for k, v in (s.get("attrs") or {}).items():
+            attrs.append({"key": k, "value": {"stringValue": str(v)}})
+        spans.append({
+            "traceId": trace_id,
+            "spanId": hashlib.sha256(f"{ctx['frame_id']}/{i}".encode()).hexdigest()[:16],
+            "name": s["name"],
+            "startTimeUnixNano": str(s["start_ns"]),
+            "endTimeUnixNano": str(s["end_ns"]),
+            "attributes": attrs,
+        })
+    return {"resourceSpans": [{"resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+                               "scopeSpans": [{"scope": {"name": "trace_context"}, "spans": spans}]}]}
+
+class TraceSink:
+    """Append-only file sink; one line per finished frame."""
+    def __init__(self, path: str = TRACE_SINK, fmt: str = TRACE_FORMAT):
+        self.path = path
+        self.fmt = fmt
+        self.lock = threading.Lock()
+        self.f = open(path, "a", buffering=1, encoding="utf-8") if path else None
+
+    def emit(self, ctx: Optional[Dict]) -> None:
+        if self.f is None or ctx is None:
+            return
+        line = json.dumps(to_otlp(ctx) if self.fmt == "otlp" else ctx, separators=(",", ":"))
+        with self.lock:
+            self.f.write(line + "\n")
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
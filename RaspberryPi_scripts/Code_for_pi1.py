@@ -2,9 +2,11 @@ import os
 import logging
 import paho.mqtt.client as mqtt
 import time
-import base64
 import cv2
-import datetime
+from publisher_pipeline import PUBLISH_WINDOW, LazyCounter, PublisherPipeline
+from rate_control import FEEDBACK_ENABLED, RateController
+from outbox import open_outbox
+from mqtt_sharding import Failover, label
 
 # Configuration
 broker = '192.168.1.79'
@@ -13,6 +15,11 @@ topic = 'images/pi1'
 image_counter_file = 'image_counter.txt'
 image_directory = './'
 processed_folder = 'received_images'
+# Cluster feedback (rate_control.py); set in main() when FEEDBACK_ENABLED
+rate = None
+# Broker choice for this camera (mqtt_sharding.py: MQTT_BROKERS, failover); set in main()
+failover = None
+ARCHIVE_ENABLED = os.environ.get("ARCHIVE_ENABLED", "true").lower() == "true"  # keep a copy of every sent JPEG
 
 # Set up logging
 logging.basicConfig(filename='image_capture_mqtt.log', level=logging.INFO,
@@ -21,61 +28,29 @@ logging.basicConfig(filename='image_capture_mqtt.log', level=logging.INFO,
 # MQTT callbacks
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
-        logging.info(f"Connected to broker {broker}:{port} with result code {rc}")
-        print(f"Connected to broker {broker}:{port} with result code {rc}")
+        logging.info(f"Connected to broker {label(failover.current)} with result code {rc}")
+        print(f"Connected to broker {label(failover.current)} with result code {rc}")
+        if rate is not None:
+            rate.subscribe(client)
     else:
-        logging.error(f"Failed to connect to broker {broker}:{port} with result code {rc}")
-        print(f"Failed to connect to broker {broker}:{port} with result code {rc}")
-
-def on_publish(client, userdata, mid):
-    logging.info(f"Message published with mid {mid}")
-
-# Publish image
-def publish_image(client, image_path):
-    try:
-        with open(image_path, 'rb') as file:
-            image_data = base64.b64encode(file.read()).decode()
-
-        result = client.publish(topic, image_data, qos=1)
-        if result.rc == mqtt.MQTT_ERR_SUCCESS:
-            logging.info(f"Image {image_path} published successfully.")
-        else:
-            logging.error(f"Failed to publish image {image_path}. Error code: {result.rc}")
-
-        os.makedirs(processed_folder, exist_ok=True)
-        os.rename(image_path, os.path.join(processed_folder, os.path.basename(image_path)))
-
-    except Exception as e:
-        logging.error(f"Failed to publish image: {e}")
-
-# Get next image number
-def get_next_image_number(counter_file):
-    try:
-        with open(counter_file, 'r') as file:
-            number = int(file.read().strip())
-    except FileNotFoundError:
-        number = 1
-    return number
-
-# Update image number
-def update_image_number(counter_file, number):
-    with open(counter_file, 'w') as file:
-        file.write(str(number))
+        logging.error(f"Failed to connect to broker {label(failover.current)} with result code {rc}")
+        print(f"Failed to connect to broker {label(failover.current)} with result code {rc}")
 
 # Main function
 def main():
+    global rate, failover
+    if FEEDBACK_ENABLED:
+        rate = RateController([topic.split('/')[-1]]).start()
     client = mqtt.Client()
     client.on_connect = on_connect
-    client.on_publish = on_publish
-
-    logging.info(f"Connecting to broker {broker}:{port}")
-    try:
-        client.connect(broker, port, 60)
-    except Exception as e:
-        logging.error(f"Connection failed: {e}")
-        print(f"Connection failed: {e}")
-        return
-
+    client.max_inflight_messages_set(PUBLISH_WINDOW)
+
+    # connect in the background and keep retrying; until the broker is reachable the
+    # pipeline spools frames to the outbox (outbox.py) instead of stopping. With
+    # MQTT_BROKERS set the camera's shard broker is used and a replica takes over if it
+    # stays down; without it this is just `broker`.
+    client.reconnect_delay_set(min_delay=1, max_delay=30)
+    failover = Failover(client, topic, broker, port).start()
     client.loop_start()
 
     # Initialize camera once
@@ -84,48 +59,16 @@ def main():
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
     time.sleep(0.1)  # Allow camera to warm up
 
-    while True:
-        try:
-            loop_start_time = time.time()
-
-            image_number = get_next_image_number(image_counter_file)
-            image_path = os.path.join(image_directory, f"image_{image_number:04d}.jpg")
-
-            # 1. Capture image
-            t1 = time.time()
-            ret, frame = cap.read()
-            if ret:
-                cv2.imwrite(image_path, frame)
-                logging.info(f"Image captured and saved to {image_path}")
-            else:
-                logging.error("Failed to read from camera")
-            t2 = time.time()
-            logging.info(f"Capture time: {t2 - t1:.4f} seconds")
-
-            # 2. Publish image
-            t3 = time.time()
-            publish_image(client, image_path)
-            t4 = time.time()
-            logging.info(f"Publish + Move time: {t4 - t3:.4f} seconds")
-
-            # 3. Update counter
-            image_number += 1
-            update_image_number(image_counter_file, image_number)
-
-            loop_end_time = time.time()
-            logging.info(f"Total loop time: {loop_end_time - loop_start_time:.4f} seconds")
-
-            time.sleep(0.5)
-
-        except KeyboardInterrupt:
-            logging.info("Keyboard interrupt detected. Stopping the script.")
-            break
-        except Exception as e:
-            logging.error(f"Unexpected error occurred: {e}")
-            print(f"Unexpected error occurred: {e}")
-            time.sleep(60)
+    # capture / encode / publish overlap on their own threads (see publisher_pipeline.py)
+    pipeline = PublisherPipeline(client, [topic], cap, LazyCounter(os.path.join(image_directory, image_counter_file)),
+                                 source=topic.split('/')[-1],
+                                 archive_folder=processed_folder if ARCHIVE_ENABLED else None, rate=rate,
+                                 outbox=open_outbox())
+    client.on_publish = pipeline.on_publish
+    pipeline.start().run_forever()
 
     cap.release()
+    failover.stop()
     client.loop_stop()
     client.disconnect()
 
@@ -0,0 +1,184 @@
+# frame_archive.py — append-only, content-addressed frame storage (instead of one JPEG per file).
+#
+# An archive is a directory holding a few large segment files and one index:
+#   seg-<start ns>-<pid>.far   append-only records: b"FAR1" | u32 size | sha256 (32 bytes) | data
+#   index.sqlite3              frame id -> content hash -> (segment, offset, size)
+# Identical payloads (the COPIES_PER_MESSAGE copies of one frame, a Pi re-sending the same
+# JPEG) are stored once and every frame id points at the same blob. A writer rotates to a
+# new segment after ARCHIVE_SEGMENT_MB or ARCHIVE_SEGMENT_SECONDS, so closed segments never
+# change and backups copy a handful of big files instead of tens of thousands of inodes.
+# Each process writes its own segments; the index (SQLite, WAL) is shared, so analyzer pool
+# workers can archive into the same directory.
+#
+#   python frame_archive.py DIR stats
+#   python frame_archive.py DIR ls [PREFIX]
+#   python frame_archive.py DIR get ID > frame.jpg
+#   python frame_archive.py DIR export OUTDIR [PREFIX]     write frames back out as files
+import os
+import sys
+import time
+import struct
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+ARCHIVE_FORMAT = os.environ.get("ARCHIVE_FORMAT", "segments").lower()   # segments | files
+ARCHIVE_SEGMENT_MB = float(os.environ.get("ARCHIVE_SEGMENT_MB", "256"))
+ARCHIVE_SEGMENT_SECONDS = float(os.environ.get("ARCHIVE_SEGMENT_SECONDS", "3600"))
+
+MAGIC = b"FAR1"
+HEADER = struct.Struct(">4sI32s")
+INDEX_NAME = "index.sqlite3"
+
+class FrameArchive:
+    """Thread-safe writer and reader for one archive directory."""
+    def __init__(self, path: str, segment_mb: float = ARCHIVE_SEGMENT_MB,
+                 segment_seconds: float = ARCHIVE_SEGMENT_SECONDS):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segment_bytes = int(segment_mb * 1024 * 1024)
+        self.segment_seconds = segment_seconds
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(path, INDEX_NAME), timeout=30, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash BLOB PRIMARY KEY, segment TEXT NOT NULL, offset INTEGER NOT NULL, size INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS frames (
+                id TEXT PRIMARY KEY, hash BLOB NOT NULL, stored_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS segments (
+                name TEXT PRIMARY KEY, created REAL NOT NULL, closed REAL);
+        """)
+        self.segment: Optional[str] = None
+        self.f = None
+        self.opened = 0.0
+        self.readers: Dict[str, object] = {}
+
+    # writing
+    def _rotate(self):
+        if self.f is not None:
+            self.f.close()
+            self.db.execute("UPDATE segments SET closed = ? WHERE name = ?", (time.time(), self.segment))
+        self.segment = f"seg-{time.time_ns()}-{os.getpid()}.far"
+        self.f = open(os.path.join(self.path, self.segment), "ab")
+        self.opened = time.monotonic()
+        self.db.execute("INSERT INTO segments (name, created) VALUES (?, ?)", (self.segment, time.time()))
+
+    def put(self, frame_id: str, data: bytes) -> bool:
+        """Store data under frame_id; False if an identical blob was already archived (dedup)."""
+        digest = hashlib.sha256(data).digest()
+        with self.lock:
+            stored = self.db.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone() is None
+            if stored:
+                if (self.f is None or self.f.tell() >= self.segment_bytes
+                        or time.monotonic() - self.opened >= self.segment_seconds):
+                    self._rotate()
+                offset = self.f.tell()
+                self.f.write(HEADER.pack(MAGIC, len(data), digest))
+                self.f.write(data)
+                self.f.flush()
+                # another process may have stored the same blob meanwhile; its copy wins
+                self.db.execute("INSERT OR IGNORE INTO blobs (hash, segment, offset, size) VALUES (?,?,?,?)",
+                                (digest, self.segment, offset, len(data)))
+            self.db.execute("INSERT OR REPLACE INTO frames (id, hash, stored_at) VALUES (?,?,?)",
+                            (frame_id, digest, time.time()))
+        return stored
+
+    # reading
+    def get(self, frame_id: str) -> Optional[bytes]:
+        with self.lock:
+            row = self.db.execute("SELECT b.segment, b.offset, b.size, b.hash FROM frames f "
+                                  "JOIN blobs b ON b.hash = f.hash WHERE f.id = ?", (frame_id,)).fetchone()
+            if row is None:
+                return None
+            segment, offset, size, digest = row
+            f = self.readers.get(segment)
+            if f is None:
+                f = self.readers[segment] = open(os.path.join(self.path, segment), "rb")
+            f.seek(offset)
+            magic, n, h = HEADER.unpack(f.read(HEADER.size))
+            data = f.read(n)
+        if magic != MAGIC or n != size or h != digest or hashlib.sha256(data).digest() != digest:
+            raise IOError(f"Corrupt record for {frame_id} in {segment} at {offset}")
+        return data
+
+    def ids(self, prefix: str = "") -> List[str]:
+        with self.lock:
+            rows = self.db.execute("SELECT id FROM frames WHERE id >= ? AND id < ? ORDER BY id",
+                                   (prefix, prefix + "\U0010ffff")).fetchall()
+        return [r[0] for r in rows]
+
+    def frames(self, prefix: str = "") -> Iterator[Tuple[str, bytes]]:
+        for frame_id in self.ids(prefix):
+            data = self.get(frame_id)
+            if data is not None:
+                yield frame_id, data
+
+    def count(self, prefix: str = "") -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM frames WHERE id >= ? AND id < ?",
+                                   (prefix, prefix + "\U0010ffff")).fetchone()[0]
+
+    def stats(self) -> Dict[str, object]:
+        with self.lock:
+            frames = self.db.execute("SELECT COUNT(*) FROM frames").fetchone()[0]
+            blobs, stored = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            logical = self.db.execute("SELECT COALESCE(SUM(b.size), 0) FROM frames f "
+                                      "JOIN blobs b ON b.hash = f.hash").fetchone()[0]
+            segments = self.db.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        return {"frames": frames, "blobs": blobs, "segments": segments, "stored_mb": round(stored / 1e6, 1),
+                "dedup_ratio": round(logical / stored, 2) if stored else None}
+
+    def close(self):
+        with self.lock:
+            if self.f is not None:
+                self.f.close()
+                self.db.execute("UPDATE segments SET closed = ? WHERE name = ?", (time.time(), self.segment))
+                self.f = None
+            for f in self.readers.values():
+                f.close()
+            self.readers.clear()
+            self.db.close()
+
+_open: Dict[Tuple[int, str], FrameArchive] = {}
+_open_lock = threading.Lock()
+
+def archive_for(path: str) -> FrameArchive:
+    """One FrameArchive per directory per process (safe to call from forked pool workers)."""
+    key = (os.getpid(), os.path.abspath(path))
+    with _open_lock:
+        if key not in _open:
+            _open[key] = FrameArchive(path)
+        return _open[key]
+
+def main(argv: List[str]):
+    if len(argv) < 2 or argv[1] not in ("stats", "ls", "get", "export"):
+        print("usage: frame_archive.py DIR stats | ls [PREFIX] | get ID | export OUTDIR [PREFIX]")
+        return 2
+    archive = FrameArchive(argv[0])
+    cmd, rest = argv[1], argv[2:]
+    if cmd == "stats":
+        print(archive.stats())
+    elif cmd == "ls":
+        print("\n".join(archive.ids(rest[0] if rest else "")))
+    elif cmd == "get":
+        data = archive.get(rest[0])
+        if data is None:
+            print(f"{rest[0]}: not in archive", file=sys.stderr)
+            return 1
+        sys.stdout.buffer.write(data)
+    else:
+        os.makedirs(rest[0], exist_ok=True)
+        n = 0
+        for frame_id, data in archive.frames(rest[1] if len(rest) > 1 else ""):
+            with open(os.path.join(rest[0], frame_id), "wb") as f:
+                f.write(data)
+            n += 1
+        print(f"exported {n} frames to {rest[0]}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,208 @@
+# jpeg_encoder.py — pluggable JPEG encode for the Pi publisher.
+#
+# ENCODER=auto | opencv | simplejpeg | mjpeg
+#   opencv      cv2.imencode (libjpeg bundled with OpenCV)
+#   simplejpeg  libjpeg-turbo via `pip install simplejpeg`; usually the fastest on ARM
+#   mjpeg       camera's own MJPEG stream passed through untouched (no CPU encode). Frames
+#               are re-encoded with the best software backend only when the rate
+#               controller asks for a smaller size or lower quality.
+#   auto        micro-benchmark the available software backends on a real frame at
+#               startup and keep the fastest (mjpeg is never picked implicitly: it
+#               changes what the camera delivers)
+#
+#   python jpeg_encoder.py [image.jpg]     # print the benchmark table for this device
+import os
+import sys
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+ENCODER = os.environ.get("ENCODER", "auto").lower()
+JPEG_QUALITY = int(os.environ.get("JPEG_QUALITY", "95"))
+JPEG_SUBSAMPLING = os.environ.get("JPEG_SUBSAMPLING", "420")        # 420 | 422 | 444
+JPEG_PROGRESSIVE = os.environ.get("JPEG_PROGRESSIVE", "false").lower() == "true"
+JPEG_OPTIMIZE = os.environ.get("JPEG_OPTIMIZE", "false").lower() == "true"   # optimized Huffman tables
+JPEG_FASTDCT = os.environ.get("JPEG_FASTDCT", "true").lower() == "true"      # simplejpeg only
+ENCODER_BENCH_RUNS = int(os.environ.get("ENCODER_BENCH_RUNS", "15"))
+
+class Encoder:
+    name = "base"
+
+    def __init__(self, subsampling: str = JPEG_SUBSAMPLING, progressive: bool = JPEG_PROGRESSIVE,
+                 optimize: bool = JPEG_OPTIMIZE):
+        self.subsampling = subsampling
+        self.progressive = progressive
+        self.optimize = optimize
+
+    @classmethod
+    def available(cls) -> bool:
+        return False
+
+    def prepare(self, cap):
+        """Configure the camera before the first read (only mjpeg needs this)."""
+
+    def _encode(self, image, quality: int) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def encode(self, image, size: Optional[Tuple[int, int]] = None, quality: int = JPEG_QUALITY) -> Optional[bytes]:
+        """BGR frame -> JPEG bytes, downscaled to size (w, h) first when it is smaller."""
+        if size and image.shape[1] > size[0]:
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return self._encode(image, quality)
+
+    def describe(self) -> str:
+        return f"{self.name} subsampling={self.subsampling} progressive={self.progressive} optimize={self.optimize}"
+
+class OpenCVEncoder(Encoder):
+    name = "opencv"
+    # constants exist from OpenCV 4.5.5; older builds silently keep libjpeg's 4:2:0
+    SAMPLING = {"420": "IMWRITE_JPEG_SAMPLING_FACTOR_420", "422": "IMWRITE_JPEG_SAMPLING_FACTOR_422",
+                "444": "IMWRITE_JPEG_SAMPLING_FACTOR_444"}
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.extra: List[int] = []
+        if self.progressive:
+            self.extra += [int(cv2.IMWRITE_JPEG_PROGRESSIVE), 1]
+        if self.optimize:
+            self.extra += [int(cv2.IMWRITE_JPEG_OPTIMIZE), 1]
+        factor = getattr(cv2, self.SAMPLING.get(self.subsampling, ""), None)
+        if hasattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR") and factor is not None:
+            self.extra += [int(cv2.IMWRITE_JPEG_SAMPLING_FACTOR), int(factor)]
+
+    def _encode(self, image, quality: int) -> Optional[bytes]:
+        ok, buf = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), quality] + self.extra)
+        return buf.tobytes() if ok else None
+
+class SimpleJpegEncoder(Encoder):
+    name = "simplejpeg"
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            import simplejpeg  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        import simplejpeg
+        self.simplejpeg = simplejpeg
+        if self.progressive or self.optimize:
+            logging.warning("simplejpeg ignores JPEG_PROGRESSIVE / JPEG_OPTIMIZE")
+
+    def _encode(self, image, quality: int) -> Optional[bytes]:
+        return self.simplejpeg.encode_jpeg(np.ascontiguousarray(image), quality=quality, colorspace='BGR',
+                                           colorsubsampling=self.subsampling, fastdct=JPEG_FASTDCT)
+
+class MjpegPassthrough(Encoder):
+    """
+    Asks V4L2 for MJPEG and skips RGB conversion, so cap.read() returns the camera's
+    JPEG as a 1-D/1xN uint8 buffer. Quality is the camera's; downscale or lower quality
+    requests decode and re-encode with `fallback`.
+    """
+    name = "mjpeg"
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def __init__(self, fallback: Encoder, quality_max: int = JPEG_QUALITY):
+        super().__init__(fallback.subsampling, fallback.progressive, fallback.optimize)
+        self.fallback = fallback
+        self.quality_max = quality_max
+        self.reencoded = 0
+
+    def prepare(self, cap):
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+        if not cap.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+            logging.warning("Camera backend ignored CONVERT_RGB=0; MJPEG frames will be re-encoded")
+
+    def encode(self, image, size: Optional[Tuple[int, int]] = None, quality: int = JPEG_QUALITY) -> Optional[bytes]:
+        raw = image.ndim == 1 or (image.ndim == 2 and image.shape[0] == 1)
+        if not raw:  # backend decoded anyway
+            return self.fallback.encode(image, size, quality)
+        if size is None and quality >= self.quality_max:
+            return image.tobytes()
+        self.reencoded += 1
+        decoded = cv2.imdecode(image.reshape(-1), cv2.IMREAD_COLOR)
+        return self.fallback.encode(decoded, size, quality) if decoded is not None else None
+
+    def describe(self) -> str:
+        return f"mjpeg passthrough (re-encode: {self.fallback.describe()})"
+
+SOFTWARE = {c.name: c for c in (SimpleJpegEncoder, OpenCVEncoder)}
+
+# ---------------------------
+# Micro-benchmark
+# ---------------------------
+def synthetic_frame(w: int = 1280, h: int = 720):
+    """Gradient + noise; compresses roughly like an office scene (used without a camera frame)."""
+    rng = np.random.default_rng(0)
+    base = np.linspace(0, 255, w, dtype=np.float32)[None, :, None].repeat(h, 0).repeat(3, 2)
+    return np.clip(base + rng.normal(0, 12, (h, w, 3)), 0, 255).astype(np.uint8)
+
+def benchmark(encoders: List[Encoder], frame, runs: int = ENCODER_BENCH_RUNS,
+              quality: int = JPEG_QUALITY) -> List[Dict[str, object]]:
+    """Median encode time and output size per encoder, fastest first."""
+    rows = []
+    for enc in encoders:
+        enc.encode(frame, None, quality)  # warm-up (allocations, lazy init)
+        times = []
+        out = b""
+        for _ in range(max(1, runs)):
+            t0 = time.perf_counter()
+            out = enc.encode(frame, None, quality) or b""
+            times.append(time.perf_counter() - t0)
+        times.sort()
+        rows.append({"encoder": enc.name, "median_ms": round(times[len(times) // 2] * 1000, 2),
+                     "kb": round(len(out) / 1024, 1)})
+    return sorted(rows, key=lambda r: r["median_ms"])
+
+def make_encoder(name: str = ENCODER, cap=None, sample=None) -> Encoder:
+    """
+    Build the configured encoder. For auto, `sample` (or one frame read from `cap`, or a
+    synthetic frame) is used to benchmark the software backends.
+    """
+    software = [cls() for n, cls in SOFTWARE.items() if cls.available()]
+    if name in SOFTWARE:
+        if not SOFTWARE[name].available():
+            logging.warning(f"Encoder {name} unavailable; using opencv")
+            return OpenCVEncoder()
+        return SOFTWARE[name]()
+    if name != "auto" and name != "mjpeg":
+        logging.warning(f"Unknown ENCODER={name}; using auto")
+    if len(software) > 1:
+        if sample is None and cap is not None:
+            ok, sample = cap.read()
+            sample = sample if ok else None
+        rows = benchmark(software, sample if sample is not None else synthetic_frame())
+        logging.info(f"⏱️ Encoder benchmark: {rows}")
+        best = next(e for e in software if e.name == rows[0]["encoder"])
+    else:
+        best = software[0]
+    if name == "mjpeg":
+        enc = MjpegPassthrough(best)
+        if cap is not None:
+            enc.prepare(cap)
+        return enc
+    return best
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    frame = cv2.imread(sys.argv[1]) if len(sys.argv) > 1 else synthetic_frame()
+    if frame is None:
+        sys.exit(f"cannot read {sys.argv[1]}")
+    encs = [cls() for cls in SOFTWARE.values() if cls.available()]
+    print(f"{frame.shape[1]}x{frame.shape[0]} quality={JPEG_QUALITY} subsampling={JPEG_SUBSAMPLING} "
+          f"progressive={JPEG_PROGRESSIVE} optimize={JPEG_OPTIMIZE}")
+    for row in benchmark(encs, frame):
+        print(f"  {row['encoder']:<12}{row['median_ms']:>9.2f} ms{row['kb']:>9.1f} KB")
@@ -0,0 +1,213 @@
+# mqtt_sharding.py — spread camera streams over several Mosquitto brokers.
+#
+# MQTT_BROKERS="10.0.0.5:1883,10.0.0.6:1883,10.0.0.7" lists the brokers (port defaults
+# to 1883); MQTT_BROKERS_FILE names a file with the same list (one per line or comma
+# separated, e.g. a mounted ConfigMap) and wins when set. With neither, the script's own
+# single broker is used, i.e. the old behaviour.
+#
+# Each camera's pi_id is consistently hashed onto a ring of brokers (SHARD_VNODES points
+# per broker), so adding a broker moves only ~1/N of the cameras. The replica topics of
+# one camera (images/pi2_3 -> pi2) stay on the camera's broker, since it publishes them.
+# owners(pi_id) is the ordered candidate list: the primary and SHARD_REPLICAS - 1
+# fallbacks.
+#   publishers  connect to the first candidate; after FAILOVER_SECONDS without a
+#               connection they move to the next one, every FAILBACK_SECONDS they probe
+#               the primary and return to it, and when the broker list changes
+#               (re-read every BROKERS_RELOAD_SECONDS) they move to the new primary.
+#   subscribers connect to every candidate broker of their topics (all brokers for a
+#               wildcard), so frames are received wherever the publisher currently is.
+# This module has no paho dependency; the same file lives next to the Pi publishers and
+# the analyzers.
+import os
+import re
+import time
+import bisect
+import socket
+import hashlib
+import logging
+import threading
+from typing import Callable, Iterable, List, Set, Tuple
+
+MQTT_BROKERS = os.environ.get("MQTT_BROKERS", "")
+MQTT_BROKERS_FILE = os.environ.get("MQTT_BROKERS_FILE", "")
+SHARD_REPLICAS = int(os.environ.get("SHARD_REPLICAS", "2"))
+SHARD_VNODES = int(os.environ.get("SHARD_VNODES", "64"))
+FAILOVER_SECONDS = float(os.environ.get("FAILOVER_SECONDS", "15"))
+FAILBACK_SECONDS = float(os.environ.get("FAILBACK_SECONDS", "60"))
+BROKERS_RELOAD_SECONDS = float(os.environ.get("BROKERS_RELOAD_SECONDS", "30"))
+
+Broker = Tuple[str, int]
+
+def parse_brokers(spec: str, default_port: int = 1883) -> List[Broker]:
+    """'a:1883, b' -> [('a', 1883), ('b', 1883)]; duplicates dropped, order kept."""
+    out: List[Broker] = []
+    for part in re.split(r"[,\s]+", spec):
+        host, _, port = part.strip().partition(":")
+        if host and not host.startswith("#"):
+            b = (host, int(port) if port.isdigit() else default_port)
+            if b not in out:
+                out.append(b)
+    return out
+
+def configured_brokers(default_host: str, default_port: int = 1883) -> List[Broker]:
+    if MQTT_BROKERS_FILE:
+        try:
+            with open(MQTT_BROKERS_FILE, encoding="utf-8") as f:
+                brokers = parse_brokers(f.read(), default_port)
+            if brokers:
+                return brokers
+        except OSError as e:
+            logging.warning(f"Cannot read MQTT_BROKERS_FILE {MQTT_BROKERS_FILE}: {e}")
+    return parse_brokers(MQTT_BROKERS, default_port) or [(default_host, default_port)]
+
+def shard_key(topic: str) -> str:
+    """images/pi2_3 -> pi2, control/pi1 -> pi1: the camera a topic belongs to."""
+    parts = topic.split("/")
+    pi_id = parts[1] if len(parts) > 1 else topic
+    return re.sub(r"_\d+$", "", pi_id)
+
+def is_wildcard(topic: str) -> bool:
+    return "#" in topic or "+" in topic
+
+def label(broker: Broker) -> str:
+    return f"{broker[0]}:{broker[1]}"
+
+class BrokerRing:
+    """Consistent-hash ring of brokers."""
+    def __init__(self, brokers: List[Broker], vnodes: int = SHARD_VNODES):
+        self.brokers = list(brokers)
+        points = []
+        for b in self.brokers:
+            for i in range(max(1, vnodes)):
+                points.append((self._hash(f"{label(b)}#{i}"), b))
+        points.sort()
+        self.hashes = [h for h, _ in points]
+        self.nodes = [b for _, b in points]
+
+    @staticmethod
+    def _hash(s: str) -> int:
+        return int.from_bytes(hashlib.md5(s.encode("utf-8")).digest()[:8], "big")
+
+    def owners(self, key: str, n: int = SHARD_REPLICAS) -> List[Broker]:
+        """Primary broker for key, then up to n - 1 distinct fallbacks, in ring order."""
+        n = min(max(1, n), len(self.brokers))
+        out: List[Broker] = []
+        i = bisect.bisect(self.hashes, self._hash(key))
+        while len(out) < n:
+            b = self.nodes[i % len(self.nodes)]
+            if b not in out:
+                out.append(b)
+            i += 1
+        return out
+
+    def brokers_for(self, topics: Iterable[str], n: int = SHARD_REPLICAS) -> Set[Broker]:
+        """Every broker a subscriber of these topics must be connected to."""
+        out: Set[Broker] = set()
+        for t in topics:
+            if is_wildcard(shard_key(t)):
+                return set(self.brokers)
+            out.update(self.owners(shard_key(t), n))
+        return out
+
+class RingWatcher:
+    """Re-reads the broker list every BROKERS_RELOAD_SECONDS and calls on_change(ring)."""
+    def __init__(self, default_host: str, default_port: int, on_change: Callable[[BrokerRing], None]):
+        self.default = (default_host, default_port)
+        self.on_change = on_change
+        self.ring = BrokerRing(configured_brokers(*self.default))
+        self.stop_event = threading.Event()
+
+    def check(self):
+        brokers = configured_brokers(*self.default)
+        if sorted(brokers) != sorted(self.ring.brokers):
+            logging.info(f"🔀 Broker list changed: {[label(b) for b in self.ring.brokers]} -> "
+                         f"{[label(b) for b in brokers]}")
+            self.ring = BrokerRing(brokers)
+            self.on_change(self.ring)
+
+    def run(self):
+        while not self.stop_event.wait(BROKERS_RELOAD_SECONDS):
+            try:
+                self.check()
+            except Exception as e:
+                logging.warning(f"Broker list reload failed: {e}")
+
+    def start(self):
+        if MQTT_BROKERS_FILE:  # an env list cannot change while the process runs
+            threading.Thread(target=self.run, name="broker-watch", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+def reachable(broker: Broker, timeout: float = 2.0) -> bool:
+    try:
+        socket.create_connection(broker, timeout=timeout).close()
+        return True
+    except OSError:
+        return False
+
+class Failover:
+    """
+    Keeps one publisher client (paho, loop_start()ed) on the best broker for its camera.
+    start() replaces client.connect_async(); paho's own reconnect loop keeps retrying
+    whichever broker was chosen last.
+    """
+    def __init__(self, client, topic: str, default_host: str, default_port: int = 1883, keepalive: int = 60):
+        self.client = client
+        self.key = shard_key(topic)
+        self.keepalive = keepalive
+        self.watcher = RingWatcher(default_host, default_port, self._rebalance)
+        self.candidates = self.watcher.ring.owners(self.key)
+        self.current: Broker = self.candidates[0]
+        self.last_ok = time.monotonic()
+        self.last_probe = time.monotonic()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def _switch(self, broker: Broker, why: str):
+        logging.info(f"🔀 MQTT {label(self.current)} -> {label(broker)} ({why})")
+        was_connected = self.client.is_connected()
+        self.current = broker
+        self.last_ok = time.monotonic()
+        self.client.connect_async(broker[0], broker[1], self.keepalive)
+        if was_connected:
+            # drop the healthy session now; paho's loop reconnects to the new host
+            try:
+                self.client.reconnect()
+            except OSError as e:
+                logging.warning(f"Connect to {label(broker)} failed ({e}); paho keeps retrying")
+
+    def _rebalance(self, ring: BrokerRing):
+        with self.lock:
+            self.candidates = ring.owners(self.key)
+            if self.current != self.candidates[0]:
+                self._switch(self.candidates[0], "rebalance")
+
+    def tick(self, now: float):
+        with self.lock:
+            if self.client.is_connected():
+                self.last_ok = now
+                if self.current != self.candidates[0] and now - self.last_probe >= FAILBACK_SECONDS:
+                    self.last_probe = now
+                    if reachable(self.candidates[0]):
+                        self._switch(self.candidates[0], "primary back")
+            elif now - self.last_ok >= FAILOVER_SECONDS and len(self.candidates) > 1:
+                i = self.candidates.index(self.current) if self.current in self.candidates else -1
+                self._switch(self.candidates[(i + 1) % len(self.candidates)], "failover")
+
+    def run(self):
+        while not self.stop_event.wait(1.0):
+            self.tick(time.monotonic())
+
+    def start(self):
+        logging.info(f"Broker for {self.key}: {label(self.current)} "
+                     f"(fallbacks {[label(b) for b in self.candidates[1:]]})")
+        self.client.connect_async(self.current[0], self.current[1], self.keepalive)
+        self.watcher.start()
+        threading.Thread(target=self.run, name="mqtt-failover", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.watcher.stop()
@@ -0,0 +1,117 @@
+# outbox.py — persistent store-and-forward queue for frames the broker could not take.
+#
+# While the client is disconnected (or a publish fails) the publisher spools the wrapped
+# payload here instead of dropping it; capture keeps running. After reconnect a drain
+# thread republishes the backlog oldest-first at OUTBOX_DRAIN_RATE messages/s (scaled
+# down while the rate controller is backing off), deleting a row only once its PUBACK
+# arrives. Replayed frames carry a trace header with their original capture time and
+# "replayed": true, so analyzers can file them under the time they were taken.
+#
+# Storage is SQLite in WAL mode (one file + -wal, survives power loss at a frame
+# boundary). OUTBOX_MAX_MB caps the payload bytes kept; OUTBOX_EVICT decides what goes
+# when full: "oldest" (default, keep the most recent outage window) or "newest"
+# (keep the start of the outage, refuse new frames).
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+import trace_context
+
+OUTBOX_ENABLED = os.environ.get("OUTBOX_ENABLED", "true").lower() == "true"
+OUTBOX_PATH = os.environ.get("OUTBOX_PATH", "outbox.sqlite3")
+OUTBOX_MAX_MB = float(os.environ.get("OUTBOX_MAX_MB", "512"))
+OUTBOX_EVICT = os.environ.get("OUTBOX_EVICT", "oldest").lower()
+OUTBOX_DRAIN_RATE = float(os.environ.get("OUTBOX_DRAIN_RATE", "5"))
+
+class Outbox:
+    def __init__(self, path: str = OUTBOX_PATH, max_mb: float = OUTBOX_MAX_MB, evict: str = OUTBOX_EVICT):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.evict = evict
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                t_capture_ns INTEGER NOT NULL,
+                t_queued_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            )""")
+        self.count, self.bytes = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM outbox").fetchone()
+        self.evicted = 0
+        self.refused = 0
+        if self.count:
+            logging.info(f"📦 Outbox {path}: {self.count} frames ({self.bytes / 1e6:.1f} MB) from a previous run")
+
+    def put(self, topic: str, payload: bytes, t_capture_ns: int) -> bool:
+        size = len(payload)
+        with self.lock:
+            if self.bytes + size > self.max_bytes:
+                if self.evict == "newest":
+                    self.refused += 1
+                    return False
+                self._evict_oldest(self.bytes + size - self.max_bytes)
+            self.db.execute("INSERT INTO outbox (topic, payload, t_capture_ns, t_queued_ns, size) VALUES (?,?,?,?,?)",
+                            (topic, payload, t_capture_ns, time.time_ns(), size))
+            self.count += 1
+            self.bytes += size
+            return True
+
+    def _evict_oldest(self, need: int):
+        freed, ids = 0, []
+        for rid, size in self.db.execute("SELECT id, size FROM outbox ORDER BY id"):
+            ids.append(rid)
+            freed += size
+            if freed >= need:
+                break
+        self.db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+        self.count -= len(ids)
+        self.bytes -= freed
+        self.evicted += len(ids)
+
+    def peek(self, n: int, exclude=()) -> List[Tuple[int, str, bytes, int, int]]:
+        """Oldest n rows not in `exclude` (ids already in flight)."""
+        with self.lock:
+            rows = self.db.execute("SELECT id, topic, payload, t_capture_ns, t_queued_ns FROM outbox "
+                                   "ORDER BY id LIMIT ?", (n + len(exclude),)).fetchall()
+        return [r for r in rows if r[0] not in exclude][:n]
+
+    def delete(self, rid: int):
+        with self.lock:
+            row = self.db.execute("SELECT size FROM outbox WHERE id = ?", (rid,)).fetchone()
+            if row is None:
+                return
+            self.db.execute("DELETE FROM outbox WHERE id = ?", (rid,))
+            self.count -= 1
+            self.bytes -= row[0]
+
+    def stats(self):
+        return {"frames": self.count, "mb": round(self.bytes / 1e6, 1), "evicted": self.evicted, "refused": self.refused}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def mark_replayed(topic: str, payload: bytes, t_capture_ns: int, t_queued_ns: int) -> bytes:
+    """Re-wrap a spooled payload with replayed=true, its capture time and an 'outbox' span."""
+    ctx, raw = trace_context.unwrap(payload)
+    if ctx is None:
+        ctx = {"frame_id": f"{topic.split('/')[-1]}-r{t_capture_ns}", "t_capture_ns": t_capture_ns, "spans": []}
+    ctx["replayed"] = True
+    trace_context.add_span(ctx, "outbox", t_queued_ns)
+    return trace_context.wrap(raw, ctx)
+
+def open_outbox() -> Optional[Outbox]:
+    if not OUTBOX_ENABLED:
+        return None
+    try:
+        return Outbox()
+    except sqlite3.Error as e:
+        logging.error(f"Outbox unavailable ({e}); frames published while offline will be lost")
+        return None
@@ -0,0 +1,422 @@
+# publisher_pipeline.py — overlapped capture -> encode -> publish for the Pi scripts.
+#
+#   capture thread   cap.read() paced to PIPELINE_FPS, frames into a small ring buffer
+#                    (oldest frame dropped when the encoder falls behind)
+#   encode thread    in-memory JPEG (jpeg_encoder.py backend) + base64, no SD-card round trip
+#   publish thread   QoS1 publish with at most PUBLISH_WINDOW unacked messages; the
+#                    window refills from on_publish (PUBACK), so a slow broker/Wi-Fi
+#                    backs pressure up to the ring instead of growing paho's queue
+#   archiver thread  optional: archives the JPEG bytes in received_images/ off the hot path
+#                    (segments + index, see frame_archive.py; ARCHIVE_FORMAT=files for one file each)
+#   drain thread     optional: with an Outbox (outbox.py), frames that could not be sent
+#                    while the broker was unreachable are spooled to disk and replayed
+#                    oldest-first after reconnect
+#
+# With a RateController (rate_control.py) the capture interval, output resolution and
+# JPEG quality follow cluster feedback instead of the fixed PIPELINE_FPS / JPEG_QUALITY.
+#
+# The image counter lives in memory; image_counter.txt holds the end of the block of
+# COUNTER_FLUSH_EVERY numbers reserved ahead of use (the exact value on stop()), so a
+# crash skips numbers but never reissues one.
+import os
+import time
+import queue
+import base64
+import logging
+import threading
+import collections
+from typing import Dict, List, NamedTuple, Optional
+
+import paho.mqtt.client as mqtt
+
+import trace_context
+from jpeg_encoder import JPEG_QUALITY, Encoder, make_encoder
+from outbox import OUTBOX_DRAIN_RATE, Outbox, mark_replayed
+from frame_archive import ARCHIVE_FORMAT, FrameArchive
+
+PIPELINE_FPS = float(os.environ.get("PIPELINE_FPS", "2"))        # capture rate; 0 = as fast as the camera
+RING_SIZE = int(os.environ.get("RING_SIZE", "4"))                  # captured frames waiting for the encoder
+PUBLISH_QOS = int(os.environ.get("PUBLISH_QOS", "1"))
+PUBLISH_WINDOW = int(os.environ.get("PUBLISH_WINDOW", "8"))        # unacked QoS1 messages
+ACK_TIMEOUT = float(os.environ.get("ACK_TIMEOUT", "10"))           # seconds before an unacked mid is written off
+ARCHIVE_QUEUE = int(os.environ.get("ARCHIVE_QUEUE", "32"))
+COUNTER_FLUSH_EVERY = int(os.environ.get("COUNTER_FLUSH_EVERY", "50"))
+STATS_SECONDS = float(os.environ.get("STATS_SECONDS", "30"))
+
+class Frame(NamedTuple):
+    number: int
+    image: object            # BGR ndarray
+    t_capture_ns: int
+    ctx: Optional[Dict]      # trace context (TRACE_ENABLED) or None
+
+# ---------------------------
+# Ring buffer
+# ---------------------------
+class FrameRing:
+    """Fixed-capacity FIFO; put() overwrites the oldest frame when full."""
+    def __init__(self, capacity: int = RING_SIZE):
+        self.buf = collections.deque(maxlen=max(1, capacity))
+        self.cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self.cond:
+            if len(self.buf) == self.buf.maxlen:
+                self.dropped += 1
+            self.buf.append(item)
+            self.cond.notify()
+
+    def get(self, timeout: float = 0.5):
+        with self.cond:
+            if not self.buf:
+                self.cond.wait(timeout)
+            return self.buf.popleft() if self.buf else None
+
+# ---------------------------
+# Lazy counter
+# ---------------------------
+class LazyCounter:
+    """
+    image_counter.txt kept in memory. Numbers are handed out from a block reserved on disk
+    first (atomic replace), so after a crash the next run starts past anything issued.
+    """
+    def __init__(self, path: str, flush_every: int = COUNTER_FLUSH_EVERY):
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        try:
+            with open(path, "r") as f:
+                self.value = int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            self.value = 1
+        self.lock = threading.Lock()
+        self._write(self.value + self.flush_every)
+
+    def next(self) -> int:
+        with self.lock:
+            if self.value >= self.flushed:
+                self._write(self.value + self.flush_every)
+            n = self.value
+            self.value += 1
+            return n
+
+    def _write(self, value: int):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(value))
+        os.replace(tmp, self.path)
+        self.flushed = value
+
+    def flush(self):
+        """Clean shutdown: store the exact next number, releasing the rest of the block."""
+        with self.lock:
+            if self.value != self.flushed:
+                self._write(self.value)
+
+# ---------------------------
+# QoS1 in-flight window
+# ---------------------------
+class InflightWindow:
+    """Counts unacked mids; acquire() blocks while `size` are outstanding."""
+    def __init__(self, size: int = PUBLISH_WINDOW, ack_timeout: float = ACK_TIMEOUT):
+        self.size = max(1, size)
+        self.ack_timeout = ack_timeout
+        self.cond = threading.Condition()
+        self.pending: Dict[int, float] = {}
+        self.early = set()   # PUBACK handled before publish() returned the mid
+        self.acked = 0
+        self.expired = 0
+        self.ack_latency = collections.deque(maxlen=256)
+
+    def _expire(self, now: float):
+        for mid, t in list(self.pending.items()):
+            if now - t > self.ack_timeout:
+                del self.pending[mid]
+                self.expired += 1
+
+    def acquire(self, stop: threading.Event, ready=None) -> bool:
+        """False if stopped, or if ready() turns false (disconnected) while waiting."""
+        with self.cond:
+            while len(self.pending) >= self.size:
+                if stop.is_set() or (ready is not None and not ready()):
+                    return False
+                self.cond.wait(0.5)
+                self._expire(time.monotonic())
+            return True
+
+    def sent(self, mid: int):
+        with self.cond:
+            if mid in self.early:
+                self.early.discard(mid)
+                self.acked += 1
+                return
+            self.pending[mid] = time.monotonic()
+
+    def ack(self, mid: int):
+        with self.cond:
+            t = self.pending.pop(mid, None)
+            if t is None:
+                if len(self.early) > 1024:  # acks for mids already written off
+                    self.early.clear()
+                self.early.add(mid)
+                return
+            self.acked += 1
+            self.ack_latency.append(time.monotonic() - t)
+            self.cond.notify()
+
+    def inflight(self) -> int:
+        with self.cond:
+            return len(self.pending)
+
+# ---------------------------
+# Archiver
+# ---------------------------
+class Archiver:
+    """Background JPEG writer; frames are dropped (not blocked on) when the SD card lags."""
+    def __init__(self, folder: str, maxsize: int = ARCHIVE_QUEUE):
+        self.folder = folder
+        self.archive = FrameArchive(folder) if ARCHIVE_FORMAT == "segments" else None
+        self.q: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.written = 0
+        os.makedirs(folder, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name="archiver", daemon=True)
+        self.thread.start()
+
+    def put(self, filename: str, data: bytes):
+        try:
+            self.q.put_nowait((filename, data))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self.q.get()
+            if item is None:
+                return
+            filename, data = item
+            try:
+                if self.archive is not None:
+                    self.archive.put(filename, data)
+                else:
+                    with open(os.path.join(self.folder, filename), "wb") as f:
+                        f.write(data)
+                self.written += 1
+            except Exception as e:
+                logging.error(f"Archive write failed for {filename}: {e}")
+
+    def close(self):
+        self.q.put(None)
+        self.thread.join(timeout=5)
+        if self.archive is not None and not self.thread.is_alive():
+            self.archive.close()
+
+# ---------------------------
+# Pipeline
+# ---------------------------
+class PublisherPipeline:
+    """
+    Runs capture, encode and publish on their own threads. Wire client.on_publish to
+    pipeline.on_publish so the QoS1 window refills. Every topic in `topics` gets the
+    same payload (one encode per frame).
+    """
+    def __init__(self, client: mqtt.Client, topics: List[str], cap, counter: LazyCounter,
+                 source: str, archive_folder: Optional[str] = None,
+                 encoder: Optional[Encoder] = None, fps: float = PIPELINE_FPS, rate=None,
+                 outbox: Optional[Outbox] = None):
+        self.client = client
+        self.topics = topics
+        self.cap = cap
+        self.counter = counter
+        self.source = source
+        self.encoder = encoder or make_encoder(cap=cap)
+        self.period = 1.0 / fps if fps > 0 else 0.0
+        self.rate = rate
+        self.ring = FrameRing()
+        self.outq: "queue.Queue" = queue.Queue(maxsize=max(2, PUBLISH_WINDOW))
+        self.window = InflightWindow()
+        self.archiver = Archiver(archive_folder) if archive_folder else None
+        self.outbox = outbox
+        self.drain_lock = threading.Lock()
+        self.draining: Dict[int, tuple] = {}  # mid -> (outbox row id, monotonic sent)
+        self.drain_early = set()  # PUBACKs that arrived before their mid was in draining
+        self.stop_event = threading.Event()
+        self.threads: List[threading.Thread] = []
+        self.captured = self.encoded = self.published = self.failed = 0
+        self.spooled = self.replayed = 0
+
+    # paho callback (network thread)
+    def on_publish(self, client, userdata, mid):
+        self.window.ack(mid)
+        if self.outbox is not None:
+            # never block on the drain thread here: paho holds its out-message lock around this
+            # callback, and publish() takes the same lock
+            with self.drain_lock:
+                entry = self.draining.pop(mid, None)
+                if entry is None:
+                    if len(self.drain_early) > 1024:  # live-frame acks; a lost one only means a resend
+                        self.drain_early.clear()
+                    self.drain_early.add(mid)
+            if entry is not None:
+                self.outbox.delete(entry[0])
+
+    def start(self):
+        stages = [("capture", self._capture_loop), ("encode", self._encode_loop), ("publish", self._publish_loop)]
+        if self.outbox is not None:
+            stages.append(("drain", self._drain_loop))
+        for name, fn in stages:
+            t = threading.Thread(target=fn, name=name, daemon=True)
+            t.start()
+            self.threads.append(t)
+        logging.info(f"🚀 Pipeline started: topics={self.topics} fps={1 / self.period if self.period else 'max'} "
+                     f"ring={self.ring.buf.maxlen} window={self.window.size} archive={self.archiver is not None} "
+                     f"encoder={self.encoder.describe()}")
+        return self
+
+    def _capture_loop(self):
+        next_t = time.monotonic()
+        while not self.stop_event.is_set():
+            t0_ns = time.time_ns()
+            ret, image = self.cap.read()
+            if not ret:
+                logging.error("Failed to read from camera")
+                self.stop_event.wait(0.5)
+                continue
+            ctx = trace_context.new_context(self.source, t0_ns) if trace_context.TRACE_ENABLED else None
+            trace_context.add_span(ctx, "capture", t0_ns)
+            self.ring.put(Frame(self.counter.next(), image, t0_ns, ctx))
+            self.captured += 1
+            period = self.rate.period() if self.rate else self.period
+            if period:
+                next_t += period
+                delay = next_t - time.monotonic()
+                if delay > 0:
+                    self.stop_event.wait(delay)
+                else:
+                    next_t = time.monotonic()  # fell behind; don't burst to catch up
+
+    def _encode_loop(self):
+        while not self.stop_event.is_set():
+            frame = self.ring.get()
+            if frame is None:
+                continue
+            t0_ns = time.time_ns()
+            size, quality = self.rate.encode_settings() if self.rate else (None, JPEG_QUALITY)
+            jpeg = self.encoder.encode(frame.image, size, quality)
+            if jpeg is None:
+                logging.error("JPEG encoding failed")
+                continue
+            payload_b64 = base64.b64encode(jpeg).decode()
+            trace_context.add_span(frame.ctx, "encode", t0_ns)
+            self.encoded += 1
+            filename = f"image_{frame.number:04d}.jpg"
+            if self.archiver:
+                self.archiver.put(filename, jpeg)
+            while not self.stop_event.is_set():
+                try:
+                    self.outq.put((filename, payload_b64, frame.ctx, frame.t_capture_ns), timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    def _publish_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                filename, payload_b64, ctx, t_capture_ns = self.outq.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            trace_context.add_span(ctx, "publish", time.time_ns(), time.time_ns())
+            payload = trace_context.wrap(payload_b64, ctx)
+            for t in self.topics:
+                self._send(t, payload, t_capture_ns, filename)
+
+    def _send(self, topic: str, payload: bytes, t_capture_ns: int, filename: str):
+        """Publish one message; with an outbox, spool it instead while offline or on failure."""
+        ready = self.client.is_connected if self.outbox is not None else None
+        if (ready is None or ready()) and self.window.acquire(self.stop_event, ready):
+            result = self.client.publish(topic, payload, qos=PUBLISH_QOS)
+            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                if PUBLISH_QOS > 0:
+                    self.window.sent(result.mid)
+                self.published += 1
+                logging.debug(f"Published {filename} to '{topic}' (mid={result.mid})")
+                return
+            self.failed += 1
+            logging.error(f"Publish failed for {filename} to '{topic}' rc={result.rc}")
+        if self.outbox is not None and self.outbox.put(topic, payload, t_capture_ns):
+            self.spooled += 1
+
+    def _drain_loop(self):
+        """Replay spooled frames oldest-first; a row is deleted when its PUBACK arrives."""
+        while not self.stop_event.is_set():
+            rate = OUTBOX_DRAIN_RATE * (self.rate.fps / self.rate.fps_max if self.rate else 1.0)
+            if not self.outbox.count or rate <= 0 or not self.client.is_connected():
+                self.stop_event.wait(1.0)
+                continue
+            now = time.monotonic()
+            with self.drain_lock:
+                for mid, (rid, t) in list(self.draining.items()):
+                    if now - t > ACK_TIMEOUT:  # never acked: the row stays and is sent again
+                        del self.draining[mid]
+                busy = {rid for rid, _ in self.draining.values()}
+            rows = self.outbox.peek(1, exclude=busy)
+            if not rows or not self.window.acquire(self.stop_event, self.client.is_connected):
+                self.stop_event.wait(0.5)
+                continue
+            rid, topic, payload, t_capture_ns, t_queued_ns = rows[0]
+            # publish() outside drain_lock; a PUBACK that beats the registration is parked in drain_early
+            result = self.client.publish(topic, mark_replayed(topic, payload, t_capture_ns, t_queued_ns),
+                                         qos=PUBLISH_QOS)
+            acked = PUBLISH_QOS == 0
+            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.replayed += 1
+                if PUBLISH_QOS > 0:
+                    self.window.sent(result.mid)
+                    with self.drain_lock:
+                        if result.mid in self.drain_early:
+                            self.drain_early.discard(result.mid)
+                            acked = True
+                        else:
+                            self.draining[result.mid] = (rid, time.monotonic())
+            if result.rc == mqtt.MQTT_ERR_SUCCESS and acked:
+                self.outbox.delete(rid)
+            self.stop_event.wait(1.0 / rate)
+
+    def stats(self) -> Dict[str, object]:
+        lat = sorted(self.window.ack_latency)
+        return {
+            "captured": self.captured, "ring_dropped": self.ring.dropped, "encoded": self.encoded,
+            "published": self.published, "failed": self.failed, "acked": self.window.acked,
+            "ack_expired": self.window.expired, "inflight": self.window.inflight(),
+            "ack_p50_ms": round(lat[len(lat) // 2] * 1000, 1) if lat else None,
+            "archived": self.archiver.written if self.archiver else 0,
+            "archive_dropped": self.archiver.dropped if self.archiver else 0,
+            "rate": self.rate.state() if self.rate else None,
+            "spooled": self.spooled, "replayed": self.replayed,
+            "outbox": self.outbox.stats() if self.outbox else None,
+        }
+
+    def run_forever(self):
+        """Blocks, logging stats every STATS_SECONDS, until KeyboardInterrupt or stop()."""
+        try:
+            while not self.stop_event.wait(STATS_SECONDS):
+                logging.info(f"📊 Pipeline {self.stats()}")
+        except KeyboardInterrupt:
+            logging.info("Keyboard interrupt detected. Stopping the script.")
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self.stop_event.is_set() and not self.threads:
+            return
+        self.stop_event.set()
+        for t in self.threads:
+            t.join(timeout=2)
+        self.threads = []
+        if self.rate:
+            self.rate.stop()
+        if self.archiver:
+            self.archiver.close()
+        self.counter.flush()
+        logging.info(f"🛑 Pipeline stopped: {self.stats()}")
+        if self.outbox:
+            self.outbox.close()
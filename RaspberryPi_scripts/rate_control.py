@@ -0,0 +1,159 @@
+# rate_control.py — AIMD capture rate / resolution / JPEG quality from cluster feedback.
+#
+# Analyzers publish a small JSON report per camera on CONTROL_PREFIX + <pi_id> (e.g.
+# control/pi1) and the ranker publishes cluster-wide state on CONTROL_PREFIX + "cluster":
+#   {"from": "<node>", "backlog": 3, "latency_p95_ms": 820, "dropped": 0, "overload": false, "ts": ...}
+# Every RATE_TICK_SECONDS the publisher looks at the freshest report of each sender:
+#   congested (any overload, dropped > 0, backlog > FEEDBACK_BACKLOG_HIGH or
+#   latency_p95_ms > LATENCY_TARGET_MS)   -> multiplicative decrease: fps *= DECREASE_FACTOR;
+#                                            at FPS_MIN step resolution down, then quality
+#   otherwise                              -> additive increase after INCREASE_HOLD_SECONDS:
+#                                            quality back up first, then resolution, then fps += FPS_STEP
+# Each report causes at most one decrease: a congested report that arrived before the last
+# decrease only holds the current rate until a newer report shows whether it helped.
+# No fresh reports (analyzers gone, feedback off) counts as "not congested", so the
+# publisher drifts back to its configured maximum, i.e. the old fixed behaviour.
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from jpeg_encoder import JPEG_QUALITY
+from publisher_pipeline import PIPELINE_FPS
+
+CONTROL_PREFIX = os.environ.get("CONTROL_PREFIX", "control/")
+FEEDBACK_ENABLED = os.environ.get("FEEDBACK_ENABLED", "true").lower() == "true"
+FPS_MIN = float(os.environ.get("FPS_MIN", "0.5"))
+FPS_STEP = float(os.environ.get("FPS_STEP", "0.25"))
+DECREASE_FACTOR = float(os.environ.get("DECREASE_FACTOR", "0.5"))
+RESOLUTIONS = os.environ.get("RESOLUTIONS", "1280x720,960x540,640x360")   # largest first
+QUALITY_MIN = int(os.environ.get("QUALITY_MIN", "60"))
+QUALITY_STEP = int(os.environ.get("QUALITY_STEP", "5"))
+FEEDBACK_BACKLOG_HIGH = int(os.environ.get("FEEDBACK_BACKLOG_HIGH", "4"))
+LATENCY_TARGET_MS = float(os.environ.get("LATENCY_TARGET_MS", "1500"))
+RATE_TICK_SECONDS = float(os.environ.get("RATE_TICK_SECONDS", "2"))
+INCREASE_HOLD_SECONDS = float(os.environ.get("INCREASE_HOLD_SECONDS", "10"))
+FEEDBACK_STALE_SECONDS = float(os.environ.get("FEEDBACK_STALE_SECONDS", "20"))
+
+def parse_resolutions(spec: str) -> List[Tuple[int, int]]:
+    """'1280x720,640x360' -> [(1280, 720), (640, 360)], largest first."""
+    out = []
+    for part in spec.split(","):
+        w, _, h = part.strip().lower().partition("x")
+        if w.isdigit() and h.isdigit():
+            out.append((int(w), int(h)))
+    return sorted(out, reverse=True) or [(1280, 720)]
+
+class RateController:
+    """
+    Holds the publisher's current (fps, resolution, quality) and moves it AIMD-style.
+    The pipeline reads period() / encode_settings() on every frame; tick() runs on its
+    own thread. sources: pi ids whose control topics this publisher listens to.
+    """
+    def __init__(self, sources: List[str], fps_max: float = PIPELINE_FPS, quality_max: int = JPEG_QUALITY):
+        self.topics = [CONTROL_PREFIX + s for s in sources] + [CONTROL_PREFIX + "cluster"]
+        self.fps_max = fps_max if fps_max > 0 else 30.0
+        self.fps_min = min(FPS_MIN, self.fps_max)
+        self.quality_max = quality_max
+        self.quality_min = min(QUALITY_MIN, quality_max)
+        self.resolutions = parse_resolutions(RESOLUTIONS)
+        self.fps = self.fps_max
+        self.res_idx = 0
+        self.quality = quality_max
+        self.reports: Dict[Tuple[str, str], Tuple[float, Dict]] = {}  # (topic, sender) -> (monotonic, report)
+        self.lock = threading.Lock()
+        self.last_decrease = 0.0
+        self.decreases = 0
+        self.stop_event = threading.Event()
+
+    # MQTT side
+    def subscribe(self, client):
+        """Call from on_connect (subscriptions do not survive a clean-session reconnect)."""
+        for t in self.topics:
+            client.message_callback_add(t, self.on_message)
+        client.subscribe([(t, 0) for t in self.topics])
+
+    def on_message(self, client, userdata, msg):
+        try:
+            report = json.loads(msg.payload)
+        except ValueError:
+            logging.warning(f"Ignoring malformed feedback on {msg.topic}")
+            return
+        with self.lock:
+            self.reports[(msg.topic, str(report.get("from", "?")))] = (time.monotonic(), report)
+
+    # control
+    @staticmethod
+    def _reason(sender: str, r: Dict) -> Optional[str]:
+        if r.get("overload"):
+            return f"overload from {sender}"
+        if (r.get("dropped") or 0) > 0:
+            return f"{r['dropped']} dropped at {sender}"
+        if (r.get("backlog") or 0) > FEEDBACK_BACKLOG_HIGH:
+            return f"backlog {r['backlog']} at {sender}"
+        if (r.get("latency_p95_ms") or 0) > LATENCY_TARGET_MS:
+            return f"p95 {r['latency_p95_ms']:.0f} ms at {sender}"
+        return None
+
+    def congested(self, now: float) -> Tuple[Optional[str], bool]:
+        """(reason if any fresh report signals overload, True if that report is newer than the last decrease)."""
+        seen = None
+        with self.lock:
+            for key, (t, r) in list(self.reports.items()):
+                if now - t > FEEDBACK_STALE_SECONDS:
+                    del self.reports[key]
+                    continue
+                reason = self._reason(key[1], r)
+                if reason and t > self.last_decrease:
+                    return reason, True
+                seen = seen or reason
+        return seen, False
+
+    def tick(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        reason, new = self.congested(now)
+        before = self.state()
+        if reason and new:
+            self.last_decrease = now
+            self.decreases += 1
+            if self.fps > self.fps_min:
+                self.fps = max(self.fps_min, self.fps * DECREASE_FACTOR)
+            elif self.res_idx < len(self.resolutions) - 1:
+                self.res_idx += 1
+            else:
+                self.quality = max(self.quality_min, self.quality - QUALITY_STEP)
+        elif not reason and now - self.last_decrease >= INCREASE_HOLD_SECONDS:
+            if self.quality < self.quality_max:
+                self.quality = min(self.quality_max, self.quality + QUALITY_STEP)
+            elif self.res_idx > 0:
+                self.res_idx -= 1
+            elif self.fps < self.fps_max:
+                self.fps = min(self.fps_max, self.fps + FPS_STEP)
+        after = self.state()
+        if after != before:
+            logging.info(f"🎚️ Rate {before} -> {after}" + (f" ({reason})" if reason else ""))
+
+    def run(self):
+        while not self.stop_event.wait(RATE_TICK_SECONDS):
+            self.tick()
+
+    def start(self):
+        threading.Thread(target=self.run, name="rate-control", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    # read by the pipeline threads
+    def period(self) -> float:
+        return 1.0 / self.fps
+
+    def encode_settings(self) -> Tuple[Optional[Tuple[int, int]], int]:
+        """(target (w, h) or None for full size, JPEG quality)."""
+        return (self.resolutions[self.res_idx] if self.res_idx else None), self.quality
+
+    def state(self) -> Dict[str, object]:
+        w, h = self.resolutions[self.res_idx]
+        return {"fps": round(self.fps, 2), "resolution": f"{w}x{h}", "quality": self.quality}
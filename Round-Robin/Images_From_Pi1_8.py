@@ -7,7 +7,7 @@ import math as m
 import numpy as np
 import paho.mqtt.client as mqtt
 import psycopg2
-from datetime import datetime
+from datetime import datetime, timezone
 import mediapipe as mp
 import socket
 import logging
@@ -17,6 +17,8 @@ import subprocess
 import threading
 import re
 
+from posture_schema import ensure_schema
+
 # ---------------------------
 # Config (env overrides)
 # ---------------------------
@@ -60,24 +62,6 @@ LOGGER.info("🚀 Starting benchmark on %s | MQTT %s:%s | topic=%s | workers=%s"
 conn = None
 cursor = None
 
-def ensure_table(cur):
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS posture_log (
-            id SERIAL PRIMARY KEY,
-            pi_id TEXT,
-            filename TEXT,
-            received_time TIMESTAMP,
-            analyzed_time TIMESTAMP,
-            neck_angle INT,
-            body_angle INT,
-            posture_status TEXT,
-            landmarks_detected BOOLEAN,
-            processed_by TEXT
-        );
-        """
-    )
-
 def connect_db():
     global conn, cursor
     if not DB_ENABLED:
@@ -93,9 +77,9 @@ def connect_db():
             sslmode=DB_SSLMODE,
         )
         cursor = conn.cursor()
-        ensure_table(cursor)
+        ensure_schema(cursor)
         conn.commit()
-        LOGGER.info("✅ DB connected and table ensured.")
+        LOGGER.info("✅ DB connected and schema ensured.")
     except Exception as e:
         LOGGER.error("❌ DB connection failed: %s", e)
         LOGGER.warning("Continuing without DB writes.")
@@ -278,7 +262,7 @@ def on_connect(client, userdata, flags, rc):
 def on_message(client, userdata, msg):
     # push every message; main loop will take exactly one per loop
     try:
-        received_time = datetime.now()
+        received_time = datetime.now(timezone.utc)
         img, enc = decode_image(msg.payload)
         if img is None:
             LOGGER.error("Could not decode image from %s (enc=%s)", msg.topic, enc)
@@ -463,7 +447,7 @@ def main():
             for f in as_completed(futures):
                 try:
                     result = f.result()
-                    analyzed_time = datetime.now()
+                    analyzed_time = datetime.now(timezone.utc)
                     proc_time = (analyzed_time - received_time).total_seconds()
                     total_time += proc_time
                     finished += 1
@@ -499,7 +483,7 @@ def main():
             loop_stats = sampler.stop_and_summary() if "sampler" in locals() and sampler else {"avg_gpu_pct": None, "avg_cpu_pct": None, "avg_ram_pct": None}
             avg_time = (total_time / finished) if finished else 0.0
             rows.append([loop_idx, copies, finished, round(avg_time, 6), pi_id,
-                         received_time.strftime("%Y-%m-%d %H:%M:%S"),
+                         received_time.astimezone().strftime("%Y-%m-%d %H:%M:%S"),
                          loop_stats.get("avg_gpu_pct"), loop_stats.get("avg_cpu_pct"), loop_stats.get("avg_ram_pct")])
 
             LOGGER.info("✅ Loop %d done: processed=%d, avg_process_time=%.6fs | GPU%%=%s CPU%%=%s RAM%%=%s",
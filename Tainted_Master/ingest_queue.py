@@ -0,0 +1,109 @@
+# ingest_queue.py — bounded MQTT ingest queue with load-shedding policies.
+#
+# INGEST_POLICY decides what is shed once INGEST_QUEUE_SIZE frames are waiting:
+#   drop_oldest   FIFO; the oldest queued frame makes room for the new one
+#   drop_newest   FIFO; the arriving frame is discarded
+#   latest        at most one frame per topic; a new frame replaces its topic's queued
+#                 one (freshest posture per camera, nothing stale is ever analyzed)
+#   priority      INGEST_PRIORITIES "pi1=3,pi2=1" (default 1): get() serves the highest
+#                 priority first; when full the oldest frame of the lowest priority is
+#                 shed (or the new frame, if nothing queued ranks below it)
+# Every shed frame is counted in posture_frames_dropped_total{pi_id,policy} and each
+# topic's depth is exported as posture_queue_depth.
+#
+# The legacy single-file analyzers (mqtt_posture_analyzer_with_db.py) ship a copy of this
+# module and analyzer_metrics.py; keep the copies identical.
+import os
+import threading
+import collections
+from typing import Dict, Optional, Tuple
+
+import analyzer_metrics
+
+INGEST_POLICY = os.environ.get("INGEST_POLICY", "latest").lower()
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "8"))
+INGEST_PRIORITIES = os.environ.get("INGEST_PRIORITIES", "")
+POLICIES = ("drop_oldest", "drop_newest", "latest", "priority")
+
+def parse_priorities(spec: str) -> Dict[str, int]:
+    """'pi1=3, pi2=1' -> {'pi1': 3, 'pi2': 1}"""
+    out = {}
+    for part in spec.split(","):
+        key, _, value = part.strip().partition("=")
+        if key and value.strip().lstrip("-").isdigit():
+            out[key.strip()] = int(value)
+    return out
+
+def pi_id_of(topic: str) -> str:
+    parts = topic.split("/")
+    return parts[1] if len(parts) > 1 else "unknown"
+
+class IngestQueue:
+    """Thread-safe; put() never blocks (paho's network thread calls it)."""
+    def __init__(self, maxsize: int = INGEST_QUEUE_SIZE, policy: str = INGEST_POLICY,
+                 priorities: Optional[Dict[str, int]] = None):
+        if policy not in POLICIES:
+            raise ValueError(f"INGEST_POLICY must be one of {POLICIES}, got {policy!r}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.priorities = priorities if priorities is not None else parse_priorities(INGEST_PRIORITIES)
+        self.cond = threading.Condition()
+        self.seq = 0
+        # (seq, topic, item); "latest" keys by topic, everything else by seq
+        self.items: "collections.OrderedDict[object, Tuple[int, str, object]]" = collections.OrderedDict()
+        self.depth: Dict[str, int] = collections.Counter()
+        self.dropped: Dict[str, int] = collections.Counter()
+
+    def _prio(self, topic: str) -> int:
+        return self.priorities.get(pi_id_of(topic), 1)
+
+    def _shed(self, topic: str):
+        self.dropped[topic] += 1
+        analyzer_metrics.frame_dropped(pi_id_of(topic), policy=self.policy)
+
+    def _remove(self, key):
+        _, topic, _ = self.items.pop(key)
+        self.depth[topic] -= 1
+        analyzer_metrics.queue_depth(pi_id_of(topic), self.depth[topic])
+        return topic
+
+    def put(self, topic: str, item) -> bool:
+        """Queue item; False if the new item itself was shed."""
+        with self.cond:
+            self.seq += 1
+            key = topic if self.policy == "latest" else self.seq
+            if self.policy == "latest" and key in self.items:
+                self._shed(self._remove(key))
+            elif len(self.items) >= self.maxsize:
+                if self.policy == "drop_newest":
+                    self._shed(topic)
+                    return False
+                if self.policy == "priority":
+                    victim = min(self.items, key=lambda k: (self._prio(self.items[k][1]), self.items[k][0]))
+                    if self._prio(self.items[victim][1]) > self._prio(topic):
+                        self._shed(topic)
+                        return False
+                else:  # drop_oldest, or "latest" with more topics than slots
+                    victim = next(iter(self.items))
+                self._shed(self._remove(victim))
+            self.items[key] = (self.seq, topic, item)
+            self.depth[topic] += 1
+            analyzer_metrics.queue_depth(pi_id_of(topic), self.depth[topic])
+            self.cond.notify()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Tuple[str, object]]:
+        """(topic, item), oldest first (highest priority first under "priority"); None on timeout."""
+        with self.cond:
+            if not self.items and not self.cond.wait_for(lambda: bool(self.items), timeout):
+                return None
+            if self.policy == "priority":
+                key = max(self.items, key=lambda k: (self._prio(self.items[k][1]), -self.items[k][0]))
+            else:
+                key = next(iter(self.items))
+            item = self.items[key][2]
+            return self._remove(key), item
+
+    def qsize(self) -> int:
+        with self.cond:
+            return len(self.items)
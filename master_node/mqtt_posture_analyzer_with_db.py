@@ -1,21 +1,70 @@
 import os
-import cv2
+import time
+_T0 = time.monotonic()
 import base64
 import random
+import threading
+import traceback
 import math as m
-import numpy as np
 import paho.mqtt.client as mqtt
 import psycopg2
-from datetime import datetime
-import mediapipe as mp
+from datetime import datetime, timezone
+import analyzer_metrics
+from ingest_queue import IngestQueue
 import socket
 
-
-import socket
 print(f"🚀 Posture analyzer started on {socket.gethostname()}")
 
+# Startup: cv2/mediapipe import + Pose construction run in a background thread while
+# the DB and MQTT connections are made. STARTUP_PROFILE=true prints per-phase times;
+# READY_FILE is created once frames can be analyzed (for an exec readinessProbe).
+STARTUP_PROFILE = os.environ.get("STARTUP_PROFILE", "false").lower() == "true"
+READY_FILE = os.environ.get("READY_FILE", "/tmp/analyzer-ready")
+_phases = {}
+_model_ready = threading.Event()
+
+cv2 = np = mp = None
+mp_pose = pose = mp_drawing = mp_styles = None
+font = None
+
+def _load_model():
+    try:
+        _build_model()
+    except Exception:
+        # a daemon thread cannot fail the process by raising; without this the analysis
+        # thread waits on _model_ready forever and the pod never becomes ready
+        print("❌ Model load failed; exiting so the pod is restarted")
+        traceback.print_exc()
+        os._exit(1)
+
+def _build_model():
+    global cv2, np, mp, mp_pose, pose, mp_drawing, mp_styles, font
+    t0 = time.monotonic()
+    import cv2 as _cv2, numpy as _np, mediapipe as _mp
+    cv2, np, mp = _cv2, _np, _mp
+    _phases["import_libs"] = time.monotonic() - t0
+
+    t0 = time.monotonic()
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    mp_pose = mp.solutions.pose
+    pose = mp_pose.Pose(static_image_mode=True, model_complexity=2)
+    mp_drawing = mp.solutions.drawing_utils
+    mp_styles = mp.solutions.drawing_styles
+    _phases["model_build"] = time.monotonic() - t0
+
+    _phases["ready_since_start"] = time.monotonic() - _T0
+    _model_ready.set()
+    try:
+        open(READY_FILE, "w").close()
+    except OSError:
+        pass
+    if STARTUP_PROFILE:
+        print("⏱  startup: " + ", ".join(f"{k}={v:.3f}s" for k, v in _phases.items()))
+
+threading.Thread(target=_load_model, daemon=True).start()
 
 # Database connection to Supabase PostgreSQL
+_t_db = time.monotonic()
 conn = psycopg2.connect(
     host=os.environ['SUPABASE_HOST'],
     database=os.environ['SUPABASE_DB'],
@@ -26,13 +75,25 @@ conn = psycopg2.connect(
 )
 
 cursor = conn.cursor()
+_phases["db_connect"] = time.monotonic() - _t_db
 
 # MQTT and folder setup
 broker = '192.168.1.79'
 port = 1883
 output_base = './analyzed_images'
 
-font = cv2.FONT_HERSHEY_SIMPLEX
+# Frames wait in a bounded queue for the analysis thread so the MQTT network thread never
+# stalls behind MediaPipe. ingest_queue.py (a copy of the K3s analyzers' module) sheds
+# frames by INGEST_POLICY once INGEST_QUEUE_SIZE wait. With prometheus_client installed,
+# posture_frames_dropped_total and posture_queue_depth are served on METRICS_PORT (0 disables).
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "8000"))
+try:
+    _ingest = IngestQueue()
+except ValueError as e:
+    raise SystemExit(str(e))
+analyzer_metrics.init_metrics()
+analyzer_metrics.serve(METRICS_PORT)
+
 colors = {
     "blue": (255, 127, 0),
     "red": (50, 50, 255),
@@ -42,11 +103,6 @@ colors = {
     "pink": (255, 0, 255)
 }
 
-mp_pose = mp.solutions.pose
-pose = mp_pose.Pose(static_image_mode=True, model_complexity=2)
-mp_drawing = mp.solutions.drawing_utils
-mp_styles = mp.solutions.drawing_styles
-
 # Utility functions
 def findDistance(x1, y1, x2, y2):
     return m.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
@@ -72,12 +128,25 @@ def on_connect(client, userdata, flags, rc):
     client.subscribe("images/#")
 
 def on_message(client, userdata, msg):
+    if msg.topic == 'images/jetson_orin':
+        return
+    _ingest.put(msg.topic, (msg.payload, datetime.now(timezone.utc)))
+
+def analysis_worker():
+    reported = 0
+    while True:
+        topic, (payload, received_time) = _ingest.get()
+        with _ingest.cond:
+            dropped = sum(_ingest.dropped.values())
+        if dropped != reported:
+            print(f"⚠️ {dropped - reported} frame(s) dropped ({_ingest.policy}, {dropped} total)")
+            reported = dropped
+        analyze_message(topic, payload, received_time)
+
+def analyze_message(topic, payload, received_time):
     try:
-        if msg.topic == 'images/jetson_orin':
-            return
-
-        received_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        image_data = base64.b64decode(msg.payload)
+        _model_ready.wait()
+        image_data = base64.b64decode(payload)
         np_arr = np.frombuffer(image_data, np.uint8)
         image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
 
@@ -85,7 +154,7 @@ def on_message(client, userdata, msg):
             print("Could not decode image.")
             return
 
-        topic_parts = msg.topic.split('/')
+        topic_parts = topic.split('/')
         prefix = topic_parts[1] if len(topic_parts) > 1 else "unknown"
         output_folder = os.path.join(output_base, f'analyzed_images_from_{prefix}')
         os.makedirs(output_folder, exist_ok=True)
@@ -163,7 +232,7 @@ def on_message(client, userdata, msg):
         hostname = socket.gethostname()
         cursor.execute(
             "INSERT INTO posture_log (pi_id, filename, received_time, analyzed_time, neck_angle, body_angle, posture_status, landmarks_detected, processed_by) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
-            (prefix, filename, received_time, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), neck_angle, body_angle, posture_status, landmarks_detected, hostname)
+            (prefix, filename, received_time, datetime.now(timezone.utc), neck_angle, body_angle, posture_status, landmarks_detected, hostname)
         )
         conn.commit()
         print(f"✅ Analyzed and saved to {save_path} with posture: {posture_status}")
@@ -180,4 +249,5 @@ client.on_connect = on_connect
 print("✅ Connected to MQTT broker")
 client.on_message = on_message
 client.connect(broker, port, 60)
+threading.Thread(target=analysis_worker, daemon=True).start()
 client.loop_forever()